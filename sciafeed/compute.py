@@ -6,13 +6,15 @@ records.
 
     (metadata, datetime object, par_code, par_value, flag) .
 """
-from datetime import datetime, timedelta
+import bisect
+from datetime import date, datetime, timedelta
+import functools
 import itertools
 from math import pi, acos, cos, sin, tan
 import operator
 import statistics
 
-from sqlalchemy import MetaData, Table
+import numpy as np
 
 from sciafeed import querying
 
@@ -40,9 +42,80 @@ INDICATORS_TABLES = {
     'ds__vnt10': ['data_i', 'cod_staz', 'cod_aggr', 'vntmxgg',
                   'vnt', 'prs_ff', 'prs_dd', 'vntmd']
 }
+# upper bounds of the classes of PREC of `wet_distribution` (the last class is unbounded)
+WET_CLASSES_BOUNDS = [1, 5, 10, 20, 50]
+# upper bounds of the classes of FF of `wind_ff_distribution` (the first is of the calms)
+WIND_FF_CLASSES_BOUNDS = [0.5, 3, 5, 10]
+# bounds of the sectors of DD of `wind_dd_partition`
+WIND_DD_SECTORS_BOUNDS = [22.5 * i for i in range(17)]
 # -------------- GENERIC UTILITIES --------------
 
 
+class ValidRecords(list):
+    """
+    A list of records already filtered as valid (flag True and value not None), that the
+    compute_* functions don't need to filter again.
+    """
+    hours_index = None
+
+
+def get_valid_records(records):
+    """
+    Return the valid records (flag True and value not None) of the input `records`.
+    If `records` is a ValidRecords object, it is returned as it is.
+
+    :param records: list of records
+    :return: the list of valid records
+    """
+    if isinstance(records, ValidRecords):
+        return records
+    return [r for r in records if r[4] and r[3] is not None]
+
+
+def records_by_hour(valid_records):
+    """
+    Return the dictionary {hour: list of records} of the input `valid_records`.
+    The dictionary is computed only once for a ValidRecords object.
+
+    :param valid_records: list of valid records with datetime objects
+    :return: the dictionary of the records by hour
+    """
+    hours_index = getattr(valid_records, 'hours_index', None)
+    if hours_index is not None:
+        return hours_index
+    hours_index = dict()
+    for record in valid_records:
+        hours_index.setdefault(record[1].hour, []).append(record)
+    if isinstance(valid_records, ValidRecords):
+        valid_records.hours_index = hours_index
+    return hours_index
+
+
+class DayBucket:
+    """
+    The valid measures of a station and a day, indexed by par_code in a single pass.
+    The records of each par_code are ValidRecords, also indexed by hour (see `records_by_hour`).
+    """
+
+    def __init__(self, measures):
+        self.records = dict()
+        for measure in measures:
+            if measure[3] is not None and measure[4]:
+                par_records = self.records.get(measure[2])
+                if par_records is None:
+                    par_records = self.records[measure[2]] = ValidRecords()
+                par_records.append(measure)
+
+    def get(self, par_code):
+        """
+        Return the valid records of `par_code`.
+
+        :param par_code: the parameter code
+        :return: the ValidRecords object (empty if there are no records)
+        """
+        return self.records.get(par_code) or ValidRecords()
+
+
 def sum_records_by_hour_groups(day_records, hours_interval):
     """
     Return a new set of records obtaining sum of values if they belong to the same
@@ -61,10 +134,12 @@ def sum_records_by_hour_groups(day_records, hours_interval):
         return day_records
     par_code = day_records[0][2]
     start_time = datetime(day.year, day.month, day.day, 0, 0)
+    groups = dict()
+    for record in day_records:
+        groups.setdefault(record[1].hour // hours_interval, []).append(record)
     new_records = []
     for min_hour in range(0, 24, hours_interval):
-        max_hour = min_hour + hours_interval
-        subrecords = [r for r in day_records if min_hour <= r[1].hour < max_hour]
+        subrecords = groups.get(min_hour // hours_interval)
         if not subrecords:
             continue
         tot = sum([s[3] for s in subrecords])
@@ -91,13 +166,10 @@ def wet_distribution(input_records):
     :param input_records: input records of PREC
     :return: (dry, wet_01, wet_02, wet_03, wet_04, wet_05)
     """
-    dry = len([d for d in input_records if d[3] <= 1])
-    wet_01 = len([d for d in input_records if 1 < d[3] <= 5])
-    wet_02 = len([d for d in input_records if 5 < d[3] <= 10])
-    wet_03 = len([d for d in input_records if 10 < d[3] <= 20])
-    wet_04 = len([d for d in input_records if 20 < d[3] <= 50])
-    wet_05 = len([d for d in input_records if d[3] > 50])
-    return dry, wet_01, wet_02, wet_03, wet_04, wet_05
+    ret_value = [0] * (len(WET_CLASSES_BOUNDS) + 1)
+    for record in input_records:
+        ret_value[bisect.bisect_left(WET_CLASSES_BOUNDS, record[3])] += 1
+    return tuple(ret_value)
 
 
 def compute_flag(day_records, at_least_perc):
@@ -116,7 +188,7 @@ def compute_flag(day_records, at_least_perc):
     """
     if not day_records:
         return 0, 0
-    ndati = len([r for r in day_records if r[4] and r[3] is not None])
+    ndati = len(get_valid_records(day_records))
     num_expected = 1
     if isinstance(day_records[0][1], datetime):
         num_expected = 24
@@ -149,7 +221,7 @@ def compute_prec24(day_records, at_least_perc=0.9, force_flag=None):
     :param force_flag: if not None, is the flag to be returned
     :return: (flag, val_tot, val_mx, data_mx)
     """
-    valid_values = [r[3] for r in day_records if r[4] and r[3] is not None]
+    valid_values = [r[3] for r in get_valid_records(day_records)]
     if not valid_values:
         return None
     flag = force_flag
@@ -206,7 +278,7 @@ def compute_prec01(day_records, at_least_perc=0.9, force_flag=None):
     :param force_flag: if not None, is the flag to be returned
     :return: (flag, val_mx, data_mx)
     """
-    valid_records = [r for r in day_records if r[4] and r[3] is not None]
+    valid_records = get_valid_records(day_records)
     if not valid_records or not isinstance(valid_records[0][1], datetime):
         return None
     flag = force_flag
@@ -239,7 +311,7 @@ def compute_prec06(day_records, at_least_perc=0.9, force_flag=None):
     :param force_flag: if not None, is the flag to be returned
     :return: (flag, val_mx, data_mx)
     """
-    valid_records = [r for r in day_records if r[4] and r[3] is not None]
+    valid_records = get_valid_records(day_records)
     val_mx = None
     data_mx = None
     if not valid_records or not isinstance(valid_records[0][1], datetime):
@@ -273,7 +345,7 @@ def compute_cl_prec06(day_records):
     :param day_records: list of `data` objects for a day and a station.
     :return: (dry, wet_01, wet_02, wet_03, wet_04, wet_05)
     """
-    valid_records = [r for r in day_records if r[4] and r[3] is not None]
+    valid_records = get_valid_records(day_records)
     if not valid_records:
         return None
     new_records = sum_records_by_hour_groups(valid_records, 6)
@@ -299,7 +371,7 @@ def compute_prec12(day_records, at_least_perc=0.9, force_flag=None):
     :param force_flag: if not None, is the flag to be returned
     :return: (flag, val_mx, data_mx)
     """
-    valid_records = [r for r in day_records if r[4] and r[3] is not None]
+    valid_records = get_valid_records(day_records)
     if not valid_records or not isinstance(valid_records[0][1], datetime):
         return None
     new_records = sum_records_by_hour_groups(valid_records, 12)
@@ -332,7 +404,7 @@ def compute_cl_prec12(day_records):
     :param day_records: list of `data` objects for a day and a station.
     :return: (dry, wet_01, wet_02, wet_03, wet_04, wet_05)
     """
-    valid_records = [r for r in day_records if r[4] and r[3] is not None]
+    valid_records = get_valid_records(day_records)
     if not valid_records:
         return None
     new_records = sum_records_by_hour_groups(valid_records, 12)
@@ -355,7 +427,7 @@ def compute_temperature_flag(input_records, perc_day=0.75, perc_night=0.75,
     :param daylight_hours: time interval of hours considered for the daylight
     :return: (ndati, wht)
     """
-    valid_records = [r for r in input_records if r[4] and r[3] is not None]
+    valid_records = get_valid_records(input_records)
     if not valid_records:
         return 0, 0
     if not isinstance(valid_records[0][1], datetime):
@@ -366,10 +438,11 @@ def compute_temperature_flag(input_records, perc_day=0.75, perc_night=0.75,
     if not day_hours or not night_hours:
         # empty interval of day or night
         return ndati, 0
-    day_records = [r for r in valid_records if r[1].hour in day_hours]
-    night_records = [r for r in valid_records if r[1].hour in night_hours]
-    data_perc_day = len(day_records) / len(day_hours)
-    data_perc_night = len(night_records) / len(night_hours)
+    hours_index = records_by_hour(valid_records)
+    num_day_records = sum([len(hours_index.get(h, ())) for h in day_hours])
+    num_night_records = sum([len(hours_index.get(h, ())) for h in night_hours])
+    data_perc_day = num_day_records / len(day_hours)
+    data_perc_night = num_night_records / len(night_hours)
     if data_perc_day < perc_day or data_perc_night < perc_night:
         return ndati, 0
     return ndati, 1
@@ -398,7 +471,7 @@ def compute_tmdgg(day_records, at_least_perc=0.75, force_flag=None):
     if not flag:
         flag = compute_temperature_flag(
             day_records, perc_day=at_least_perc, perc_night=at_least_perc)
-    valid_values = [r[3] for r in day_records if r[4] and r[3] is not None]
+    valid_values = [r[3] for r in get_valid_records(day_records)]
     val_vr = None
     if not valid_values:
         return None
@@ -430,7 +503,7 @@ def compute_tmxgg(day_records, at_least_perc=0.75, force_flag=None):
     :return: (flag, val_md, val_vr, val_x, data_x)
     """
     val_vr = None
-    valid_records = [r for r in day_records if r[4] and r[3] is not None]
+    valid_records = get_valid_records(day_records)
     if not valid_records:
         return None
     flag = force_flag
@@ -469,7 +542,7 @@ def compute_tmngg(day_records, at_least_perc=0.75, force_flag=None):
     :return: (flag, val_md, val_vr, val_x, data_x)
     """
     val_vr = None
-    valid_records = [r for r in day_records if r[4] and r[3] is not None]
+    valid_records = get_valid_records(day_records)
     if not valid_records:
         return None
     flag = force_flag
@@ -513,9 +586,9 @@ def compute_press(day_records_pmedia, day_records_pmax, day_records_pmin, at_lea
     :param force_flag: if not None, is the flag to be returned
     :return: (flag, val_md, val_vr, val_mx, val_mn)
     """
-    pmedia_values = [r[3] for r in day_records_pmedia if r[4] and r[3] is not None]
-    pmax_values = [r[3] for r in day_records_pmax if r[4] and r[3] is not None]
-    pmin_values = [r[3] for r in day_records_pmin if r[4] and r[3] is not None]
+    pmedia_values = [r[3] for r in get_valid_records(day_records_pmedia)]
+    pmax_values = [r[3] for r in get_valid_records(day_records_pmax)]
+    pmin_values = [r[3] for r in get_valid_records(day_records_pmin)]
     if not pmin_values and not pmax_values and not pmedia_values:
         return None
     flag = force_flag
@@ -565,7 +638,7 @@ def compute_bagna(day_records, at_least_perc=0.75, force_flag=None):
     :return: (flag, val_md, val_vr, val_mx, val_mn, val_tot)
     """
     # 'values / 60' because outputs are in hours and input in minutes
-    valid_values = [r[3]/60 for r in day_records if r[4] and r[3] is not None]
+    valid_values = [r[3]/60 for r in get_valid_records(day_records)]
     val_vr = None
     if not valid_values:
         return None
@@ -606,7 +679,7 @@ def compute_elio(day_records, at_least_perc=0.75, force_flag=None):
     :return: (flag, val_md, val_vr, val_mx)
     """
     # 'values / 60' because outputs are in hours and input in minutes
-    valid_values = [r[3]/60 for r in day_records if r[4] and r[3] is not None]
+    valid_values = [r[3]/60 for r in get_valid_records(day_records)]
     val_vr = None
     val_mx = None
     if not valid_values:
@@ -645,7 +718,7 @@ def compute_radglob(day_records, at_least_perc=0.75, force_flag=None):
     :param force_flag: if not None, is the flag to be returned
     :return: (flag, val_md, val_vr, val_mx, val_mn)
     """
-    valid_values = [r[3] for r in day_records if r[4] and r[3] is not None]
+    valid_values = [r[3] for r in get_valid_records(day_records)]
     val_vr = None
     if not valid_values:
         return None
@@ -689,9 +762,9 @@ def compute_ur(day_records_urmedia, day_records_urmax, day_records_urmin,
     :param force_flag: if not None, is the flag to be returned
     :return: (flag, val_md, val_vr, flag1, val_mx, val_mn)
     """
-    urmedia_values = [r[3] for r in day_records_urmedia if r[4] and r[3] is not None]
-    urmax_values = [r[3] for r in day_records_urmax if r[4] and r[3] is not None]
-    urmin_values = [r[3] for r in day_records_urmin if r[4] and r[3] is not None]
+    urmedia_values = [r[3] for r in get_valid_records(day_records_urmedia)]
+    urmax_values = [r[3] for r in get_valid_records(day_records_urmax)]
+    urmin_values = [r[3] for r in get_valid_records(day_records_urmin)]
     if not urmedia_values and not urmax_values and not urmin_values:
         return None
     flag = force_flag
@@ -740,7 +813,7 @@ def compute_vntmd(day_records, at_least_perc=0.75, force_flag=None):
     :param force_flag: if not None, is the flag to be returned
     :return: (flag, ff)
     """
-    valid_values = [r[3] for r in day_records if r[4] and r[3] is not None]
+    valid_values = [r[3] for r in get_valid_records(day_records)]
     if not valid_values:
         return None
     flag = force_flag
@@ -791,7 +864,7 @@ def compute_vntmxgg(day_ff_records, day_dd_records, at_least_perc=0.75, force_fl
     :param force_flag: if not None, is the flag to be returned
     :return: (flag, ff, dd)
     """
-    valid_ff_records = [r for r in day_ff_records if r[4] and r[3] is not None]
+    valid_ff_records = get_valid_records(day_ff_records)
     if not valid_ff_records:
         return None
     flag = force_flag
@@ -799,7 +872,7 @@ def compute_vntmxgg(day_ff_records, day_dd_records, at_least_perc=0.75, force_fl
         # TODO: ask how to compute the flag
         # flag = compute_wind_flag(day_ff_records, day_dd_records, at_least_perc)
         flag = compute_flag(day_ff_records, at_least_perc)
-    dd_records_times = dict([(r[1], r[3]) for r in day_dd_records if r[4] and r[3] is not None])
+    dd_records_times = dict([(r[1], r[3]) for r in get_valid_records(day_dd_records)])
     ff = max([r[3] for r in valid_ff_records])
     hour_of_max = [r[1] for r in valid_ff_records if r[3] == ff][0]
     dd = dd_records_times.get(hour_of_max)
@@ -822,11 +895,10 @@ def wind_ff_distribution(input_records):
     :param input_records: input records of FF
     :return: [c1, c2, c3, c4, c5]
     """
-    c1 = len([d for d in input_records if 0.5 < d[3] <= 3])
-    c2 = len([d for d in input_records if 3 < d[3] <= 5])
-    c3 = len([d for d in input_records if 5 < d[3] <= 10])
-    c4 = len([d for d in input_records if d[3] > 10])
-    return [c1, c2, c3, c4]
+    ret_value = [0] * (len(WIND_FF_CLASSES_BOUNDS) + 1)
+    for record in input_records:
+        ret_value[bisect.bisect_left(WIND_FF_CLASSES_BOUNDS, record[3])] += 1
+    return ret_value[1:]
 
 
 def wind_dd_partition(input_records):
@@ -853,10 +925,9 @@ def wind_dd_partition(input_records):
             sector_indx -= 1
         return sector_indx
 
-    input_records = sorted(input_records, key=get_sector_index)
     ret_value = [[] for _ in range(16)]
-    for sector_index, dd_measures in itertools.groupby(input_records, key=get_sector_index):
-        ret_value[sector_index] = list(dd_measures)
+    for record in input_records:
+        ret_value[get_sector_index(record)].append(record)
     return ret_value
 
 
@@ -884,8 +955,8 @@ def compute_vnt(day_ff_records, day_dd_records, at_least_perc=0.75, force_flag=N
     if not flag:
         # flag = compute_wind_flag(day_ff_records, day_dd_records, at_least_perc)
         flag = compute_flag(day_ff_records, at_least_perc)
-    valid_ff_records = [m for m in day_ff_records if m[3] is not None and m[4]]
-    valid_dd_records = [m for m in day_dd_records if m[3] is not None and m[4]]
+    valid_ff_records = get_valid_records(day_ff_records)
+    valid_dd_records = get_valid_records(day_dd_records)
     if not valid_ff_records and not valid_dd_records:
         return None
 
@@ -918,6 +989,286 @@ def compute_vnt(day_ff_records, day_dd_records, at_least_perc=0.75, force_flag=N
     return ret_value
 
 
+# --------------  HOURLY KERNELS   --------------
+
+
+def hourly_matrix(days_records):
+    """
+    Put the valid records of a parameter of the days of a station in (n_days x 24) matrices,
+    one row for each item of `days_records` and one column for each hour.
+    Only the days whose records are all naive datetimes, with float values and strictly
+    increasing times in distinct hours fit the matrices: the cells of the other days are empty.
+    It returns the tuple (values, positions, offsets, regular) where:
+    ::
+
+    * values: the values of the records (NaN where there is no record)
+    * positions: index of the record in the list of its day (-1 where there is no record)
+    * offsets: microseconds of the time of the record since the midnight
+    * regular: the boolean array of the days that fit the matrices
+
+    :param days_records: list of the valid records of each day (see `DayBucket.get`)
+    :return: (values, positions, offsets, regular)
+    """
+    num_days = len(days_records)
+    regular = np.zeros(num_days, dtype=bool)
+    cells = []
+    cells_values = []
+    cells_positions = []
+    cells_offsets = []
+    for day_index, day_records in enumerate(days_records):
+        last_time = None
+        for record in day_records:
+            record_time = record[1]
+            if not isinstance(record_time, datetime) or record_time.tzinfo is not None \
+                    or type(record[3]) is not float or record[3] != record[3]:
+                break
+            if last_time is not None and (
+                    record_time <= last_time or record_time.hour == last_time.hour):
+                break
+            last_time = record_time
+        else:
+            if not day_records:
+                continue
+            regular[day_index] = True
+            for position, record in enumerate(day_records):
+                record_time = record[1]
+                cells.append(day_index * 24 + record_time.hour)
+                cells_values.append(record[3])
+                cells_positions.append(position)
+                cells_offsets.append(
+                    (record_time.hour * 3600 + record_time.minute * 60 + record_time.second)
+                    * 1000000 + record_time.microsecond)
+    cells = np.asarray(cells, dtype=np.int64)
+    values = np.full(num_days * 24, np.nan)
+    positions = np.full(num_days * 24, -1, dtype=np.int64)
+    offsets = np.full(num_days * 24, -1, dtype=np.int64)
+    values[cells] = cells_values
+    positions[cells] = cells_positions
+    offsets[cells] = cells_offsets
+    return (values.reshape(num_days, 24), positions.reshape(num_days, 24),
+            offsets.reshape(num_days, 24), regular)
+
+
+def hourly_counts(days_records):
+    """
+    Return the (n_days x 24) matrix of the number of valid records in each hour of the days
+    of a station, one row for each item of `days_records`, and the boolean array of the days
+    that fit it: the days whose records are all datetimes (the cells of the others are 0).
+
+    :param days_records: list of the valid records of each day (see `DayBucket.get`)
+    :return: (counts, regular)
+    """
+    num_days = len(days_records)
+    regular = np.zeros(num_days, dtype=bool)
+    cells = []
+    for day_index, day_records in enumerate(days_records):
+        if not day_records or not all(isinstance(r[1], datetime) for r in day_records):
+            continue
+        regular[day_index] = True
+        cells.extend([day_index * 24 + r[1].hour for r in day_records])
+    counts = np.bincount(np.asarray(cells, dtype=np.int64), minlength=num_days * 24)
+    return counts.reshape(num_days, 24), regular
+
+
+def classes_counts(values, present, bounds):
+    """
+    Count for each row of the matrix `values` the present values in each class delimited by
+    `bounds`, assigning the classes as `wet_distribution` does.
+
+    :param values: (n x m) matrix of values
+    :param present: (n x m) boolean matrix of the values to be counted
+    :param bounds: sorted upper bounds of the classes (the last class is unbounded)
+    :return: (n x len(bounds)+1) matrix of the counts
+    """
+    num_classes = len(bounds) + 1
+    rows, columns = np.nonzero(present)
+    classes = np.searchsorted(bounds, values[rows, columns], side='left')
+    counts = np.bincount(rows * num_classes + classes, minlength=len(values) * num_classes)
+    return counts.reshape(len(values), num_classes)
+
+
+def prec_kernel(values):
+    """
+    Compute the precipitation indicators of all the days of a station at once, from the
+    matrix of PREC `values` of `hourly_matrix`. The sums are sequential, as the builtin `sum`
+    of the single day functions. It returns a dictionary of arrays:
+    ::
+
+    * ndati: number of records of each day
+    * prec24: total of each day
+    * hour01: hour of the first max of each day
+    * prec06, prec12: max of the sums of the 6/12 hours groups of each day
+    * hour06, hour12: start hour of the first group with the max
+    * cl_prec06, cl_prec12: counts of the classes of the sums of the groups
+    * cl_prec24: counts of the classes of the values (see `wet_distribution`)
+
+    :param values: (n_days x 24) matrix of PREC values
+    :return: the dictionary of arrays
+    """
+    num_days = len(values)
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    ret_value = {
+        'ndati': present.sum(axis=1),
+        'prec24': np.cumsum(filled, axis=1)[:, -1] + 0.0,
+        'hour01': np.argmax(np.where(present, values, -np.inf), axis=1),
+        'cl_prec24': classes_counts(values, present, WET_CLASSES_BOUNDS),
+    }
+    for hours_interval in (6, 12):
+        shape = (num_days, 24 // hours_interval, hours_interval)
+        groups_present = present.reshape(shape).any(axis=2)
+        groups_sums = np.cumsum(filled.reshape(shape), axis=2)[:, :, -1] + 0.0
+        groups_mx = np.argmax(np.where(groups_present, groups_sums, -np.inf), axis=1)
+        ret_value['prec%02d' % hours_interval] = groups_sums[np.arange(num_days), groups_mx]
+        ret_value['hour%02d' % hours_interval] = groups_mx * hours_interval
+        ret_value['cl_prec%02d' % hours_interval] = classes_counts(
+            groups_sums, groups_present, WET_CLASSES_BOUNDS)
+    return ret_value
+
+
+def temperature_flag_kernel(counts, perc_day=0.75, perc_night=0.75, daylight_hours=(9, 18)):
+    """
+    Compute the flags of temperature of all the days of a station at once, from the matrix
+    of the `counts` of `hourly_counts` (see `compute_temperature_flag`).
+
+    :param counts: (n_days x 24) matrix of the number of records in each hour
+    :param perc_day: minimum percentage of valid measures during the daylight
+    :param perc_night: minimum percentage of valid measures during the night
+    :param daylight_hours: time interval of hours considered for the daylight
+    :return: (ndati, wht) arrays
+    """
+    day_hours = range(daylight_hours[0], daylight_hours[1]+1)
+    night_hours = [h for h in range(0, 24) if h not in day_hours]
+    ndati = counts.sum(axis=1)
+    if not day_hours or not night_hours:
+        return ndati, np.zeros(len(counts), dtype=np.int64)
+    is_day_hour = np.array([h in day_hours for h in range(0, 24)])
+    data_perc_day = counts[:, is_day_hour].sum(axis=1) / len(day_hours)
+    data_perc_night = counts[:, ~is_day_hour].sum(axis=1) / len(night_hours)
+    wht = (data_perc_day >= perc_day) & (data_perc_night >= perc_night)
+    return ndati, wht.astype(np.int64)
+
+
+def wind_kernel(ff_values, ff_offsets, dd_values, dd_offsets):
+    """
+    Compute the wind indicators of all the days of a station at once, from the matrices of FF
+    and DD of `hourly_matrix`. A FF and a DD records are paired if they are in the same cell.
+    It returns a dictionary of arrays:
+    ::
+
+    * aligned: the days whose paired records have the same time and DD values in [0, 360]
+      (for the other days the results are not meaningful)
+    * ndati: number of FF records of each day
+    * frq_calme: number of FF records <= 0.5 of each day
+    * vnt: (n_days x 64) counts of the classes of FF of the paired records in each sector
+      of DD (see `wind_ff_distribution` and `wind_dd_partition`)
+    * ff_mx: max of FF of each day
+    * dd_mx: DD paired with the first max of FF of each day (NaN if missing)
+
+    :param ff_values: (n_days x 24) matrix of FF values
+    :param ff_offsets: (n_days x 24) matrix of the times of the FF records
+    :param dd_values: (n_days x 24) matrix of DD values
+    :param dd_offsets: (n_days x 24) matrix of the times of the DD records
+    :return: the dictionary of arrays
+    """
+    num_days = len(ff_values)
+    num_classes = len(WIND_FF_CLASSES_BOUNDS)
+    ff_present = ~np.isnan(ff_values)
+    dd_present = ~np.isnan(dd_values)
+    paired = ff_present & dd_present
+    dd_filled = np.where(dd_present, dd_values, 0.0)
+    aligned = (~paired | (ff_offsets == dd_offsets)).all(axis=1) \
+        & ((dd_filled >= 0) & (dd_filled <= 360)).all(axis=1)
+    ff_filled = np.where(ff_present, ff_values, 0.0)
+    ff_classes = np.searchsorted(WIND_FF_CLASSES_BOUNDS, ff_filled, side='left')
+    sectors = np.searchsorted(WIND_DD_SECTORS_BOUNDS, dd_filled, side='left') - 1
+    # DD == 0 is in the last sector
+    sectors = np.where(sectors < 0, 15, np.minimum(sectors, 15))
+    counted = paired & (ff_classes > 0)
+    rows = np.nonzero(counted)[0]
+    cells = (rows * 16 + sectors[counted]) * num_classes + ff_classes[counted] - 1
+    vnt = np.bincount(cells, minlength=num_days * 16 * num_classes)
+    ff_mx = np.argmax(np.where(ff_present, ff_values, -np.inf), axis=1)
+    return {
+        'aligned': aligned,
+        'ndati': ff_present.sum(axis=1),
+        'frq_calme': (ff_present & (ff_filled <= 0.5)).sum(axis=1),
+        'vnt': vnt.reshape(num_days, 16 * num_classes),
+        'ff_mx': ff_values[np.arange(num_days), ff_mx],
+        'dd_mx': dd_values[np.arange(num_days), ff_mx],
+    }
+
+
+def compute_hourly_indicators(buckets):
+    """
+    Compute with the hourly kernels the indicators of precipitation and wind, and the flags
+    of temperature, of the days of a station. Only the days whose records fit the hourly
+    matrices are computed (see `hourly_matrix` and `hourly_counts`): the others are left
+    to the functions of the single day.
+    Return a list with a dictionary for each DayBucket of `buckets`, of kind:
+    ::
+
+        {'ds__preci': {column: value, ...},
+         'ds__vnt10': {column: value, ...},
+         'temperature_flags': {par_code: flag, ...}}
+
+    :param buckets: list of DayBucket objects of the days of a station
+    :return: the list of the dictionaries of the computed indicators
+    """
+    ret_value = [dict() for _ in buckets]
+    days = np.arange(len(buckets))
+
+    # PREC
+    prec_records = [bucket.get('PREC') for bucket in buckets]
+    values, positions, _, regular = hourly_matrix(prec_records)
+    kernel = prec_kernel(values)
+    prec01 = values[days, kernel['hour01']].tolist()
+    positions01 = positions[days, kernel['hour01']].tolist()
+    kernel = dict((k, v.tolist()) for k, v in kernel.items())
+    for i in np.flatnonzero(regular).tolist():
+        day_records = prec_records[i]
+        ndati = kernel['ndati'][i]
+        flag = (ndati, int(ndati / 24 >= 0.9))
+        day = day_records[0][1]
+        start_time = datetime(day.year, day.month, day.day, 0, 0)
+        ret_value[i]['ds__preci'] = {
+            'prec01': (flag, prec01[i], day_records[positions01[i]][1].isoformat()),
+            'prec06': (flag, round(kernel['prec06'][i], ROUND_PRECISION),
+                       (start_time + timedelta(hours=kernel['hour06'][i])).isoformat()),
+            'prec12': (flag, round(kernel['prec12'][i], ROUND_PRECISION),
+                       (start_time + timedelta(hours=kernel['hour12'][i])).isoformat()),
+            'prec24': (flag, round(kernel['prec24'][i], ROUND_PRECISION), None, None),
+            'cl_prec06': tuple(kernel['cl_prec06'][i]),
+            'cl_prec12': tuple(kernel['cl_prec12'][i]),
+            'cl_prec24': tuple(kernel['cl_prec24'][i]),
+        }
+
+    # TEMPERATURE
+    for par_code in ('Tmedia', 'Tmin', 'Tmax'):
+        counts, regular = hourly_counts([bucket.get(par_code) for bucket in buckets])
+        ndati, wht = [a.tolist() for a in temperature_flag_kernel(counts)]
+        for i in np.flatnonzero(regular).tolist():
+            ret_value[i].setdefault('temperature_flags', dict())[par_code] = (ndati[i], wht[i])
+
+    # VENTO
+    ff_values, _, ff_offsets, ff_regular = hourly_matrix([b.get('FF') for b in buckets])
+    dd_values, _, dd_offsets, dd_regular = hourly_matrix([b.get('DD') for b in buckets])
+    kernel = wind_kernel(ff_values, ff_offsets, dd_values, dd_offsets)
+    regular = ff_regular & dd_regular & kernel['aligned']
+    kernel = dict((k, v.tolist()) for k, v in kernel.items())
+    for i in np.flatnonzero(regular).tolist():
+        ndati = kernel['ndati'][i]
+        flag = (ndati, int(ndati / 24 >= 0.75))
+        dd = kernel['dd_mx'][i]
+        if dd != dd:
+            dd = None
+        ret_value[i]['ds__vnt10'] = {
+            'vntmxgg': (flag, round(kernel['ff_mx'][i], ROUND_PRECISION), dd),
+            'vnt': [flag, kernel['frq_calme'][i]] + kernel['vnt'][i],
+        }
+    return ret_value
+
+
 def compute_day_indicators(measures):
     """
     Compute all indicators extracting values from the input measures.
@@ -932,13 +1283,28 @@ def compute_day_indicators(measures):
     :param measures: input measures
     :return: dictionaries of tables where to put indicators.
     """
+    return compute_bucket_indicators(DayBucket(measures))
+
+
+def compute_bucket_indicators(bucket, hourly_indicators=None):
+    """
+    Compute all indicators of the measures of a DayBucket (see `compute_day_indicators`).
+    The indicators in `hourly_indicators`, if any, are taken as they are instead of
+    computing them (see `compute_hourly_indicators`).
+
+    :param bucket: the DayBucket of the measures of a station and a day
+    :param hourly_indicators: dictionary of the indicators computed by the hourly kernels
+    :return: dictionaries of tables where to put indicators.
+    """
     ret_value = dict()
-    measures = [m for m in measures if m[3] is not None and m[4]]
+    hourly_indicators = hourly_indicators or dict()
 
     # PREC
-    prec_day_records = [m for m in measures if m[2] == 'PREC']
+    prec_day_records = bucket.get('PREC')
     prec_flag = compute_flag(prec_day_records, at_least_perc=0.9)
-    if prec_flag[0]:
+    if 'ds__preci' in hourly_indicators:
+        ret_value['ds__preci'] = hourly_indicators['ds__preci']
+    elif prec_flag[0]:
         ret_value['ds__preci'] = {
             'prec01': compute_prec01(prec_day_records, force_flag=prec_flag),
             'prec06': compute_prec06(prec_day_records, force_flag=prec_flag),
@@ -950,67 +1316,73 @@ def compute_day_indicators(measures):
         }
 
     # TEMPERATURE
-    tmedia_day_records = [m for m in measures if m[2] == 'Tmedia']
-    tmin_day_records = [m for m in measures if m[2] == 'Tmin']
-    tmax_day_records = [m for m in measures if m[2] == 'Tmax']
+    tmedia_day_records = bucket.get('Tmedia')
+    tmin_day_records = bucket.get('Tmin')
+    tmax_day_records = bucket.get('Tmax')
     if tmedia_day_records or tmin_day_records or tmax_day_records:
         ret_value['ds__t200'] = dict()
+        temperature_flags = hourly_indicators.get('temperature_flags', dict())
         if tmedia_day_records:
-            ret_value['ds__t200']['tmdgg'] = compute_tmdgg(tmedia_day_records)
+            ret_value['ds__t200']['tmdgg'] = compute_tmdgg(
+                tmedia_day_records, force_flag=temperature_flags.get('Tmedia'))
         if tmedia_day_records or tmin_day_records:
             ret_value['ds__t200']['tmngg'] = compute_tmngg(
-                tmin_day_records or tmedia_day_records)
+                tmin_day_records or tmedia_day_records,
+                force_flag=temperature_flags.get('Tmin' if tmin_day_records else 'Tmedia'))
         if tmedia_day_records or tmax_day_records:
             ret_value['ds__t200']['tmxgg'] = compute_tmxgg(
-                tmax_day_records or tmedia_day_records)
+                tmax_day_records or tmedia_day_records,
+                force_flag=temperature_flags.get('Tmax' if tmax_day_records else 'Tmedia'))
 
     # PRESSURE
-    pmedia_day_records = [m for m in measures if m[2] == 'P']
-    pmin_day_records = [m for m in measures if m[2] == 'Pmin']
-    pmax_day_records = [m for m in measures if m[2] == 'Pmax']
+    pmedia_day_records = bucket.get('P')
+    pmin_day_records = bucket.get('Pmin')
+    pmax_day_records = bucket.get('Pmax')
     if pmedia_day_records or pmax_day_records or pmin_day_records:
         ret_value['ds__press'] = {
             'press': compute_press(pmedia_day_records, pmax_day_records, pmin_day_records)
         }
 
     # BAGNATURA FOGLIARE
-    bagna_day_records = [m for m in measures if m[2] == 'Bagnatura_f']
+    bagna_day_records = bucket.get('Bagnatura_f')
     if bagna_day_records:
         ret_value['ds__bagna'] = {
             'bagna': compute_bagna(bagna_day_records),
         }
 
     # ELIOFANIA
-    elio_day_records = [m for m in measures if m[2] == 'INSOL']
-    elio00_day_records = [m for m in measures if m[2] == 'INSOL_00']
+    elio_day_records = bucket.get('INSOL')
+    elio00_day_records = bucket.get('INSOL_00')
     if elio_day_records or elio00_day_records:
         ret_value['ds__elio'] = {
             'elio': compute_elio(elio_day_records or elio00_day_records)
         }
 
     # RADIAZIONE SOLARE
-    radsol_day_records = [m for m in measures if m[2] == 'RADSOL']
+    radsol_day_records = bucket.get('RADSOL')
     if radsol_day_records:
         ret_value['ds__radglob'] = {
             'radglob': compute_radglob(radsol_day_records)
         }
 
     # UMIDITA' RELATIVA
-    urmedia_day_records = [m for m in measures if m[2] == 'UR media']
-    urmin_day_records = [m for m in measures if m[2] == 'UR min']
-    urmax_day_records = [m for m in measures if m[2] == 'UR max']
+    urmedia_day_records = bucket.get('UR media')
+    urmin_day_records = bucket.get('UR min')
+    urmax_day_records = bucket.get('UR max')
     if urmedia_day_records or urmax_day_records or urmin_day_records:
         ret_value['ds__urel'] = {
             'ur': compute_ur(urmedia_day_records, urmax_day_records, urmin_day_records)
         }
 
     # VENTO
-    ff_day_records = [m for m in measures if m[2] == 'FF']
-    dd_day_records = [m for m in measures if m[2] == 'DD']
+    ff_day_records = bucket.get('FF')
+    dd_day_records = bucket.get('DD')
     if ff_day_records:
         ret_value['ds__vnt10'] = dict()
         ret_value['ds__vnt10']['vntmd'] = compute_vntmd(ff_day_records)
-        if dd_day_records:
+        if 'ds__vnt10' in hourly_indicators:
+            ret_value['ds__vnt10'].update(hourly_indicators['ds__vnt10'])
+        elif dd_day_records:
             ret_value['ds__vnt10']['vntmxgg'] = compute_vntmxgg(
                 ff_day_records, dd_day_records)
             ret_value['ds__vnt10']['vnt'] = compute_vnt(ff_day_records, dd_day_records)
@@ -1034,6 +1406,26 @@ def compute_grgg(tmedia, thresholds=(0, 5, 10, 15, 21)):
     return flag, tot00, tot05, tot10, tot15, tot21
 
 
+@functools.lru_cache(maxsize=None)
+def extraterrestrial_radiation(lat, jd):
+    """
+    Return the extraterrestrial radiation Ra used by `compute_etp`.
+    The values are memoised, since the stations have a fixed set of latitudes.
+
+    :param lat: latitude
+    :param jd: julian day
+    :return: the value of Ra
+    """
+    g_sc = 0.082
+    lat_rad = lat * pi / 180
+    decl_sol = 0.409 * sin(2*pi*jd/365 - 1.39)
+    fi_s = acos(-tan(lat_rad)*tan(decl_sol))
+    dr = 1 + 0.033 * cos(2*pi*jd/365)
+    ra = 1440 / pi * (g_sc*dr) * (
+            fi_s*sin(lat_rad)*sin(decl_sol) + cos(lat_rad)*cos(decl_sol)*sin(fi_s))
+    return ra
+
+
 def compute_etp(tmax, tmin, lat, jd):
     """
     Compute "Evapotraspirazione potenziale giornaliera"
@@ -1050,13 +1442,7 @@ def compute_etp(tmax, tmin, lat, jd):
     tmax, tmin, lat = map(float, [tmax, tmin, lat])
     tmedia = (tmax + tmin) / 2
     delta_t = tmax - tmin
-    g_sc = 0.082
-    lat_rad = lat * pi / 180
-    decl_sol = 0.409 * sin(2*pi*jd/365 - 1.39)
-    fi_s = acos(-tan(lat_rad)*tan(decl_sol))
-    dr = 1 + 0.033 * cos(2*pi*jd/365)
-    ra = 1440 / pi * (g_sc*dr) * (
-            fi_s*sin(lat_rad)*sin(decl_sol) + cos(lat_rad)*cos(decl_sol)*sin(fi_s))
+    ra = extraterrestrial_radiation(lat, int(jd))
     etp = round(0.0023*0.408*ra*(tmedia+17.8)*delta_t**0.5, ROUND_PRECISION)
     val_md = etp
     val_vr = None
@@ -1081,6 +1467,165 @@ def compute_deltaidro(prec24, etp):
     return flag, val_md, val_vr, val_mx, val_mn
 
 
+def round_array(values, precision=ROUND_PRECISION):
+    """
+    Round the values of a float array as the builtin `round` does (numpy.round
+    differs on the halves that are not exactly representable).
+
+    :param values: numpy array of floats
+    :param precision: number of decimal digits
+    :return: the list of the rounded values
+    """
+    return [round(v, precision) for v in values.tolist()]
+
+
+def day_of_year_array(days):
+    """
+    Return the julian days (day of the year, starting from 1) of an array of day ordinals.
+
+    :param days: numpy array of day ordinals (see `date.toordinal`)
+    :return: numpy array of julian days
+    """
+    dates = (np.asarray(days, dtype=np.int64) - date(1970, 1, 1).toordinal()).astype(
+        'datetime64[D]')
+    return (dates - dates.astype('datetime64[Y]')).astype(np.int64) + 1
+
+
+def compute_grgg_array(tmedia, thresholds=(0, 5, 10, 15, 21)):
+    """
+    Compute 'gradi giorno' for an array of daily temperatures (see `compute_grgg`).
+
+    :param tmedia: numpy array of average daily temperatures
+    :param thresholds: thresholds to compute grgg components
+    :return: numpy array of shape (len(tmedia), len(thresholds)) of the grgg components
+    """
+    tmedia = np.asarray(tmedia, dtype=np.float64)
+    return np.maximum(0, tmedia[:, None] - np.asarray(thresholds, dtype=np.float64))
+
+
+def ra_table(latitudes):
+    """
+    Return the table of the extraterrestrial radiation Ra (see `extraterrestrial_radiation`)
+    for a set of latitudes: the row i contains the values of `latitudes[i]` for the julian
+    days from 1 to 366 (NaN where Ra cannot be computed).
+
+    :param latitudes: numpy array of latitudes
+    :return: numpy array of shape (len(latitudes), 366)
+    """
+    g_sc = 0.082
+    lat_rad = np.asarray(latitudes, dtype=np.float64)[:, None] * pi / 180
+    jd_rad = 2 * pi * np.arange(1, 367, dtype=np.float64) / 365
+    decl_sol = 0.409 * np.sin(jd_rad - 1.39)
+    with np.errstate(invalid='ignore'):
+        fi_s = np.arccos(-np.tan(lat_rad)*np.tan(decl_sol))
+        dr = 1 + 0.033 * np.cos(jd_rad)
+        return 1440 / pi * (g_sc*dr) * (fi_s*np.sin(lat_rad)*np.sin(decl_sol)
+                                        + np.cos(lat_rad)*np.cos(decl_sol)*np.sin(fi_s))
+
+
+def compute_etp_array(tmax, tmin, lat, jd):
+    """
+    Compute "Evapotraspirazione potenziale giornaliera" for arrays of daily values
+    (see `compute_etp`). The values are not rounded; NaN is returned where
+    the input values do not allow the computation.
+
+    :param tmax: numpy array of max daily temperatures
+    :param tmin: numpy array of min daily temperatures
+    :param lat: numpy array of latitudes
+    :param jd: numpy array of julian days
+    :return: numpy array of the etp values
+    """
+    tmax, tmin, lat = [np.asarray(v, dtype=np.float64) for v in (tmax, tmin, lat)]
+    tmedia = (tmax + tmin) / 2
+    delta_t = tmax - tmin
+    latitudes, lat_indexes = np.unique(lat, return_inverse=True)
+    ra = ra_table(latitudes)[lat_indexes.ravel(), np.asarray(jd, dtype=np.int64) - 1]
+    with np.errstate(invalid='ignore'):
+        return 0.0023*0.408*ra*(tmedia+17.8)*np.sqrt(delta_t)
+
+
+def find_station_id(registry, station_md):
+    """
+    Return the id_staz of the station described by the metadata of a measure,
+    or None if the station is not found in the `registry`.
+
+    :param registry: the station registry (see `querying.get_station_registry`)
+    :param station_md: metadata of a measure
+    :return: the id of the station, or None
+    """
+    station_props = {
+        'cod_rete': station_md['cod_rete']
+    }
+    if station_md['format'] not in ('ARPA-ER', 'RMN'):
+        station_props['cod_utente'] = station_md['cod_utente']
+    else:  # workaround to manage Emilia Romagna/RMN: try to find by name
+        station_props['nome'] = station_md['cod_utente']
+        if station_md['lat']:
+            station_props['lat'] = station_md['lat']
+        if station_md['lon']:
+            station_props['lon'] = station_md['lon']
+    station = registry.get(**station_props)
+    # {'cod_rete': '20', 'nome': 'Corniolo', 'lat': '43.90708', 'lon': '11.79314'}
+    if not station:
+        return None
+    return station.id_staz
+
+
+def measure_day(measure):
+    """
+    Return the day (as date object) of a measure.
+
+    :param measure: a measure of kind (metadata, datetime object, par_code, par_value, flag)
+    :return: the date of the measure
+    """
+    row_day = measure[1]
+    if isinstance(row_day, datetime):
+        row_day = row_day.date()
+    return row_day
+
+
+def compute_station_indicators(cod_staz, stat_measures, writers, table_map):
+    """
+    Compute the indicators of the measures of a station, and write them on CSV files
+    (see `compute_and_store`). Return the dictionaries of computed indicators.
+
+    :param cod_staz: id of the station
+    :param stat_measures: list of measures of the station
+    :param writers: dictionary of CSV writers
+    :param table_map: dictionary of columns of the tables where to insert the indicators
+    :return: the dictionaries of computed indicators
+    """
+    computed_indicators = {}
+    stat_measures = sorted(stat_measures, key=measure_day)
+    station_days = []
+    buckets = []
+    for station_day, day_measures in itertools.groupby(stat_measures, measure_day):
+        station_days.append(station_day)
+        buckets.append(DayBucket(day_measures))
+    hourly_indicators = compute_hourly_indicators(buckets)
+    for station_day, bucket, day_hourly_indicators in zip(
+            station_days, buckets, hourly_indicators):
+        station_date_str = station_day.strftime('%Y-%m-%d 00:00:00')
+        # msg = "- computing day indicators for cod_staz=%s, day=%s" \
+        #        % (cod_staz, station_date_str)
+        day_indicators = compute_bucket_indicators(bucket, day_hourly_indicators)
+        for table, columns in table_map.items():
+            if table not in day_indicators or table not in writers:
+                continue
+            key_tuple = (table, station_date_str, cod_staz)
+            indicators_row = day_indicators[table]
+            if len([i for i in indicators_row.values() if i is not None]) == 0:
+                # don't write empty rows
+                continue
+            writer, _ = writers[table]
+            indicators_row['cod_aggr'] = 4
+            indicators_row['data_i'] = station_date_str
+            indicators_row['cod_staz'] = cod_staz
+            writer.writerow(indicators_row)
+            computed_indicators[key_tuple] = day_indicators
+    return computed_indicators
+
+
 def compute_and_store(conn, data, writers, table_map, logger=None):
     """
     Extract indicators from `data` object, write on CSV files with
@@ -1102,57 +1647,17 @@ def compute_and_store(conn, data, writers, table_map, logger=None):
     def group_by_station(r):
         return r[0]['cod_utente'], r[0]['cod_rete'], r[0]['lat'], r[0]['lon']
 
-    def group_by_date(r):
-        row_day = r[1]
-        if isinstance(row_day, datetime):
-            row_day = row_day.date()
-        return row_day
-
     computed_indicators = {}
-    meta = MetaData()
-    anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
-                       schema='dailypdbadmclima')
+    registry = querying.get_station_registry(conn)
     data_sorted = sorted(data, key=group_by_station)
     for (cod_utente, cod_rete, lat, lon), stat_measures in itertools.groupby(
             data_sorted, group_by_station):
         # measures are all of the same station
-        stat_measures = sorted(stat_measures, key=group_by_date)
-        station_md = stat_measures[0][0]
-        station_props = {
-            'cod_rete': cod_rete
-        }
-        if station_md['format'] not in ('ARPA-ER', 'RMN'):
-            station_props['cod_utente'] = cod_utente
-        else:  # workaround to manage Emilia Romagna/RMN: try to find by name
-            station_props['nome'] = station_md['cod_utente']
-            if station_md['lat']:
-                station_props['lat'] = lat
-            if station_md['lon']:
-                station_props['lon'] = lon
-        station = querying.get_db_station(conn, anag_table, **station_props)
-        # {'cod_rete': '20', 'nome': 'Corniolo', 'lat': '43.90708', 'lon': '11.79314'}
-        if not station:
+        stat_measures = sorted(stat_measures, key=measure_day)
+        cod_staz = find_station_id(registry, stat_measures[0][0])
+        if cod_staz is None:
             logger.error('station not found: cod_utente=%s cod_rete=%s' % (cod_utente, cod_rete))
             continue
-        cod_staz = station.id_staz
-        for station_day, day_measures in itertools.groupby(stat_measures, group_by_date):
-            station_date_str = station_day.strftime('%Y-%m-%d 00:00:00')
-            # msg = "- computing day indicators for cod_staz=%s, day=%s" \
-            #        % (cod_staz, station_date_str)
-            day_measures = list(day_measures)
-            day_indicators = compute_day_indicators(day_measures)
-            for table, columns in table_map.items():
-                if table not in day_indicators or table not in writers:
-                    continue
-                key_tuple = (table, station_date_str, cod_staz)
-                indicators_row = day_indicators[table]
-                if len([i for i in indicators_row.values() if i is not None]) == 0:
-                    # don't write empty rows
-                    continue
-                writer, _ = writers[table]
-                indicators_row['cod_aggr'] = 4
-                indicators_row['data_i'] = station_date_str
-                indicators_row['cod_staz'] = cod_staz
-                writer.writerow(indicators_row)
-                computed_indicators[key_tuple] = day_indicators
+        computed_indicators.update(
+            compute_station_indicators(cod_staz, stat_measures, writers, table_map))
     return computed_indicators
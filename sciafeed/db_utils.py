@@ -1,8 +1,19 @@
 """
 This module contains functions and utilities to interface with a database
 """
+import atexit
+from datetime import date, datetime
+from decimal import Decimal
+import glob
+import hashlib
+import itertools
+import multiprocessing
+import os.path
+import pickle
 
-from sqlalchemy import engine_from_config, MetaData, Table
+import numpy as np
+import sqlalchemy
+from sqlalchemy import engine_from_config, inspect, MetaData, Table
 
 
 USER = 'scia'
@@ -13,38 +24,74 @@ DB_NAME = 'sciapg'
 
 DEFAULT_DB_URI = "postgresql://%s:%s@%s:%s/%s" % (USER, PASSWORD, ADDRESS, PORT, DB_NAME)
 ENGINE = None
+# if not None, engine where select queries are routed (i.e. a read-replica)
+READ_ENGINE = None
+# pool settings of the engines
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+# number of rows fetched at a time by the streaming read connections
+ITERSIZE = 2000
+# streaming read connections, as {engine: connection}
+READ_CONNECTIONS = dict()
+# above this number of stations, the station filters join a temporary table of ids
+STATIONS_TEMP_TABLE_THRESHOLD = 1000
+# context of the worker processes: they are spawned, so they don't inherit the engines,
+# the pooled connections and their sockets from the parent process
+MP_CONTEXT = multiprocessing.get_context('spawn')
+# reflected tables, as {(db URI, schema): MetaData}
+REFLECTION_CACHE = dict()
+# if not None, folder where the reflected tables are persisted between runs
+REFLECTION_CACHE_FOLDER = None
+# paths of the persisted reflected tables, as {(db URI, schema): path}
+REFLECTION_CACHE_PATHS = dict()
 
 
-def configure(db_uri=None):
+def create_configured_engine(db_uri, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW):
     """
-    Configure the connection to the database, setting the value of the ENGINE
-    global variable.
-    This method should be launched before the first use of this module.
+    Return a new engine object for the database located at `db_uri`.
 
-    :param db_uri: postgresql connection URI
+    :param db_uri: database connection URI
+    :param pool_size: number of connections kept open in the pool
+    :param max_overflow: number of connections allowed over `pool_size`
+    :return: the engine object
     """
-    global ENGINE
-    if not db_uri:
-        db_uri = DEFAULT_DB_URI
     db_config = {
             'sqlalchemy.url': db_uri,
             'sqlalchemy.encoding': 'utf-8',
             'sqlalchemy.echo': False,
             'sqlalchemy.pool_recycle': 300,
     }
-    ENGINE = engine_from_config(db_config)
+    if not db_uri.startswith('sqlite'):
+        db_config['sqlalchemy.pool_size'] = pool_size
+        db_config['sqlalchemy.max_overflow'] = max_overflow
+    return engine_from_config(db_config)
 
 
-configure()
+def configure(db_uri=None, reflection_cache_folder=None, read_db_uri=None,
+              pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, itersize=ITERSIZE):
+    """
+    Configure the connection to the database, setting the value of the ENGINE
+    global variable.
+    This method should be launched before the first use of this module.
 
-# import sqlalchemy.pool as pool
-# import psycopg2
-#
-# def getconn():
-#     c = psycopg2.connect(user=USER, host=ADDRESS, dbname=DB_NAME, password=PASSWORD, port=PORT)
-#     return c
-#
-# mypool = pool.QueuePool(getconn, max_overflow=10, pool_size=5)
+    :param db_uri: postgresql connection URI
+    :param reflection_cache_folder: if not None, folder where to persist the reflected tables
+    :param read_db_uri: if not None, connection URI where to route the select queries
+    :param pool_size: number of connections kept open in the pool
+    :param max_overflow: number of connections allowed over `pool_size`
+    :param itersize: number of rows fetched at a time by the streaming read connections
+    """
+    global ENGINE, READ_ENGINE, REFLECTION_CACHE_FOLDER, ITERSIZE
+    close_read_connections()
+    REFLECTION_CACHE_FOLDER = reflection_cache_folder
+    REFLECTION_CACHE_PATHS.clear()
+    ITERSIZE = itersize
+    if not db_uri:
+        db_uri = DEFAULT_DB_URI
+    ENGINE = create_configured_engine(db_uri, pool_size, max_overflow)
+    READ_ENGINE = None
+    if read_db_uri:
+        READ_ENGINE = create_configured_engine(read_db_uri, pool_size, max_overflow)
 
 
 def ensure_engine(db_uri='sqlite:///:memory:'):
@@ -75,15 +122,164 @@ def get_safe_memory_read_connection(conn):
     """
     Return a sqlalchemy connection object memory-optimized for select query only.
     It return the input connection `conn` if it is already optimized.
+    The connection is opened only once for each engine (on the read-replica, if configured)
+    and reused by the next calls, until `close_read_connections` is called.
 
     :param conn: the input connection object
     :return: the connection object memory-optimized for select query only
     """
     if conn._execution_options.get('stream_results'):
         return conn
-    new_conn = conn.engine.connect()
-    new_conn = new_conn.execution_options(stream_results=True)
-    return new_conn
+    engine = conn.engine
+    if READ_ENGINE is not None and engine is ENGINE:
+        engine = READ_ENGINE
+    read_conn = READ_CONNECTIONS.get(engine)
+    if read_conn is None or read_conn.closed:
+        read_conn = engine.connect().execution_options(
+            stream_results=True, max_row_buffer=ITERSIZE)
+        READ_CONNECTIONS[engine] = read_conn
+    return read_conn
+
+
+def close_read_connections():
+    """
+    Close all the connections opened by `get_safe_memory_read_connection`,
+    giving them back to the pool.
+    """
+    while READ_CONNECTIONS:
+        _, read_conn = READ_CONNECTIONS.popitem()
+        if not read_conn.closed:
+            read_conn.close()
+
+
+atexit.register(close_read_connections)
+configure()
+
+
+def schema_version(engine, schema):
+    """
+    Return a fingerprint of the tables and columns of the schema `schema` of the database
+    of `engine` (and of the sqlalchemy version), that changes when the schema changes.
+
+    :param engine: the engine object
+    :param schema: the database schema
+    :return: the fingerprint string
+    """
+    if engine.dialect.name == 'postgresql':
+        sql = """
+        SELECT table_name, column_name, data_type, udt_name FROM information_schema.columns
+        WHERE table_schema = %(schema)s ORDER BY table_name, ordinal_position"""
+        columns = [tuple(r) for r in engine.execute(sql, schema=schema)]
+    else:
+        inspector = inspect(engine)
+        columns = [(t, c['name'], str(c['type']))
+                   for t in inspector.get_table_names(schema=schema)
+                   for c in inspector.get_columns(t, schema=schema)]
+    key = ('%s|%r' % (sqlalchemy.__version__, columns)).encode('utf-8')
+    return hashlib.sha1(key).hexdigest()
+
+
+def reflection_cache_prefix(engine, schema):
+    """
+    Return the common prefix of the paths of the files where the reflected tables of the
+    schema `schema` of the database of `engine` are persisted (None if the persistence
+    is not configured).
+
+    :param engine: the engine object
+    :param schema: the database schema
+    :return: the path prefix (or None)
+    """
+    if not REFLECTION_CACHE_FOLDER:
+        return None
+    key = ('%r|%s' % (engine.url, schema)).encode('utf-8')
+    return os.path.join(REFLECTION_CACHE_FOLDER, 'reflection_%s' % hashlib.sha1(key).hexdigest())
+
+
+def reflection_cache_path(engine, schema):
+    """
+    Return the path of the file where the reflected tables of the schema `schema`
+    of the database of `engine` are persisted (None if the persistence is not configured).
+    The path includes the version of the schema (see `schema_version`), so that the file
+    is not used anymore when the schema changes. The version is queried once per run.
+
+    :param engine: the engine object
+    :param schema: the database schema
+    :return: the file path (or None)
+    """
+    prefix = reflection_cache_prefix(engine, schema)
+    if not prefix:
+        return None
+    key = (repr(engine.url), schema)
+    if key not in REFLECTION_CACHE_PATHS:
+        REFLECTION_CACHE_PATHS[key] = '%s_%s.pickle' % (prefix, schema_version(engine, schema))
+    return REFLECTION_CACHE_PATHS[key]
+
+
+def get_schema_metadata(engine, schema):
+    """
+    Return the MetaData object with the reflected tables of the schema `schema`
+    of the database of `engine`. It is shared among all the callers and (if configured)
+    loaded from the file where it was persisted.
+
+    :param engine: the engine object
+    :param schema: the database schema
+    :return: the MetaData object
+    """
+    key = (repr(engine.url), schema)
+    meta = REFLECTION_CACHE.get(key)
+    if meta is not None:
+        return meta
+    cache_path = reflection_cache_path(engine, schema)
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as fp:
+                meta = pickle.load(fp)
+        except Exception:
+            meta = None
+    if meta is None:
+        meta = MetaData()
+    REFLECTION_CACHE[key] = meta
+    return meta
+
+
+def get_table(table_name, schema='public', engine=None):
+    """
+    Return the table object of the table named `table_name`. The table is reflected from the
+    database only the first time, then it is taken from the reflection cache.
+
+    :param table_name: the table name
+    :param schema: the database schema
+    :param engine: the engine object (if None, it uses the configured engine)
+    :return: the table object
+    """
+    if engine is None:
+        engine = ensure_engine()
+    meta = get_schema_metadata(engine, schema)
+    table_key = '%s.%s' % (schema, table_name)
+    if table_key not in meta.tables:
+        Table(table_name, meta, autoload=True, autoload_with=engine, schema=schema)
+        cache_path = reflection_cache_path(engine, schema)
+        if cache_path:
+            with open(cache_path, 'wb') as fp:
+                pickle.dump(meta, fp)
+    return meta.tables[table_key]
+
+
+def clear_reflection_cache(engine=None):
+    """
+    Forget the reflected tables (including the persisted ones) of the database of `engine`
+    (of all the databases if `engine` is None).
+
+    :param engine: the engine object
+    """
+    for key in list(REFLECTION_CACHE):
+        if engine is None or key[0] == repr(engine.url):
+            REFLECTION_CACHE.pop(key)
+            REFLECTION_CACHE_PATHS.pop(key, None)
+            if engine is not None and REFLECTION_CACHE_FOLDER:
+                prefix = reflection_cache_prefix(engine, key[1])
+                for cache_path in glob.glob(prefix + '_*.pickle'):
+                    os.remove(cache_path)
 
 
 def get_table_columns(table_name, schema='public'):
@@ -94,15 +290,48 @@ def get_table_columns(table_name, schema='public'):
     :param schema: the database schema
     :return: the list of column names
     """
-    meta = MetaData()
-    engine = ensure_engine()
     try:
-        table_obj = Table(table_name, meta, autoload=True, autoload_with=engine, schema=schema)
+        table_obj = get_table(table_name, schema=schema)
     except:
         return []
     return [c.name for c in table_obj.columns]
 
 
+def stations_filter(conn, stations_ids, column='cod_staz'):
+    """
+    Return a SQL condition (and its parameters) that filters the column `column` by
+    the station ids `stations_ids`, to be executed on the connection `conn`.
+    The ids are bound as an array (`= ANY(...)`) or, for large sets, loaded in a
+    temporary table of the session, so the size of the statement doesn't depend
+    on the number of stations. On the read-replica (see `configure`), where temporary
+    tables cannot be created, the ids are always bound as an array.
+
+    :param conn: db connection object where the condition will be executed
+    :param stations_ids: list of station ids (if None: no filter by station)
+    :param column: name of the column of the station id
+    :return: (SQL condition, dictionary of parameters)
+    """
+    if stations_ids is None:
+        return '1=1', {}
+    stations_ids = sorted(set(stations_ids))
+    if len(stations_ids) == 0:
+        return '%s IN (NULL)' % column, {}
+    if len(stations_ids) <= STATIONS_TEMP_TABLE_THRESHOLD:
+        return '%s = ANY(%%(stations_ids)s)' % column, {'stations_ids': stations_ids}
+    if READ_ENGINE is not None and conn.engine is READ_ENGINE:
+        return '%s = ANY(%%(stations_ids)s::integer[])' % column, {'stations_ids': stations_ids}
+    key = ','.join(map(str, stations_ids)).encode('utf-8')
+    tmp_table_name = 'stations_%s' % hashlib.sha1(key).hexdigest()[:16]
+    sql = "SELECT to_regclass('pg_temp.%s')" % tmp_table_name
+    if conn.execute(sql).scalar() is None:
+        tmp_conn = conn.execution_options(autocommit=False)
+        tmp_conn.execute("CREATE TEMP TABLE %s (cod_staz integer PRIMARY KEY)" % tmp_table_name)
+        tmp_conn.execute("INSERT INTO %s SELECT unnest(%%(stations_ids)s::integer[])"
+                         % tmp_table_name, stations_ids=stations_ids)
+        tmp_conn.execute("ANALYZE %s" % tmp_table_name)
+    return '%s IN (SELECT cod_staz FROM %s)' % (column, tmp_table_name), {}
+
+
 def create_flag_map(records, flag_index=3):
     """
     Return a dictionary that maps the tuple (cod_staz, data_i) with a flag.
@@ -152,3 +381,349 @@ def results_list(results):
     for result in results:
         result = list(result)
         yield result
+
+
+class StoreColumn:
+    """
+    A column of a RecordStore: the numpy array `values`, the boolean array `nulls` of the
+    None values (their items in `values` are meaningless) and, for a column of Decimal
+    values, the number `scale` of their decimal digits: the Decimal values are kept exactly
+    as the integers value * 10**scale.
+    """
+    # maximum number of digits of the Decimal values kept as int64 integers
+    MAX_DIGITS = 18
+
+    def __init__(self, values, nulls, scale=None):
+        self.values = values
+        self.nulls = nulls
+        self.scale = scale
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Return the column of the list `values`: int64 if all the not None values are integers,
+        scaled int64 if they are Decimal values (see `from_decimals`), float64 if they are
+        numbers, object otherwise.
+
+        :param values: list of values
+        :return: the StoreColumn object
+        """
+        nulls = np.fromiter((v is None for v in values), bool, len(values))
+        types = {type(v) for v in values if v is not None}
+        if types <= {int}:
+            return cls(np.fromiter((v or 0 for v in values), np.int64, len(values)), nulls)
+        if types == {Decimal}:
+            column = cls.from_decimals(values, nulls)
+            if column is not None:
+                return column
+        if types <= {int, float, Decimal}:
+            return cls(np.fromiter((np.nan if v is None else v for v in values), np.float64,
+                                   len(values)), nulls)
+        objects = np.empty(len(values), dtype=object)
+        objects[:] = values
+        return cls(objects, nulls)
+
+    @classmethod
+    def from_decimals(cls, values, nulls):
+        """
+        Return the column of the list of Decimal (or None) `values` as scaled int64 integers,
+        or None if some value is not finite or has more than MAX_DIGITS digits once scaled.
+
+        :param values: list of Decimal or None values
+        :param nulls: numpy boolean array of the None values
+        :return: the StoreColumn object or None
+        """
+        decimals = [v.as_tuple() for v in values if v is not None]
+        if not all(isinstance(d.exponent, int) for d in decimals):
+            return None
+        scale = max([0] + [-d.exponent for d in decimals])
+        if any(len(d.digits) + d.exponent + scale > cls.MAX_DIGITS for d in decimals):
+            return None
+        integers = (0 if v is None else int(v.scaleb(scale)) for v in values)
+        return cls(np.fromiter(integers, np.int64, len(values)), nulls, scale)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        Return the column made of the columns `parts`, with the type of `from_values`
+        computed on all the values: parts with only None values don't count.
+
+        :param parts: list of StoreColumn objects
+        :return: the StoreColumn object
+        """
+        nulls = np.concatenate([p.nulls for p in parts])
+        kinds = {(p.values.dtype, p.scale) for p in parts if not p.nulls.all()}
+        scales = {scale for dtype, scale in kinds}
+        if kinds and None not in scales:
+            values = [p.rescaled(max(scales)) for p in parts]
+            if all(v is not None for v in values):
+                return cls(np.concatenate(values), nulls, max(scales))
+            dtype = np.dtype(object)
+        elif len(scales) > 1:
+            dtype = np.dtype(object)
+        else:
+            dtype = np.result_type(*[dtype for dtype, scale in kinds]) if kinds \
+                else np.dtype(np.int64)
+        return cls(np.concatenate([p.astype(dtype) for p in parts]), nulls)
+
+    def rescaled(self, scale):
+        """
+        Return the integers of a column of Decimal values as scaled by 10**`scale`, or None
+        if some value has more than MAX_DIGITS digits once scaled.
+
+        :param scale: the new number of decimal digits
+        :return: the numpy array or None
+        """
+        if self.nulls.all():
+            return np.zeros(len(self.values), dtype=np.int64)
+        factor = 10 ** (scale - self.scale)
+        if factor > 1 and np.abs(self.values[~self.nulls]).max() >= 10 ** self.MAX_DIGITS // factor:
+            return None
+        return self.values * factor
+
+    def astype(self, dtype):
+        """
+        Return the values of the column converted to the type `dtype`.
+
+        :param dtype: numpy dtype
+        :return: the numpy array
+        """
+        if dtype == object:
+            ret_value = np.empty(len(self.values), dtype=object)
+            ret_value[:] = [self.get(index) for index in range(len(self.values))]
+            return ret_value
+        if self.values.dtype == dtype:
+            return self.values
+        return self.values.astype(dtype)
+
+    def get(self, index):
+        """
+        Return the value at `index`.
+
+        :param index: index of the value
+        :return: the value
+        """
+        if self.nulls[index]:
+            return None
+        value = self.values[index]
+        if self.scale is not None:
+            return Decimal(int(value)).scaleb(-self.scale)
+        if isinstance(value, np.floating):
+            return float(value)
+        if isinstance(value, np.integer):
+            return int(value)
+        return value
+
+    def set(self, index, value):
+        """
+        Set the value at `index`: the column is converted to fit the new value.
+
+        :param index: index of the value
+        :param value: the new value
+        """
+        self.nulls[index] = value is None
+        if value is None:
+            return
+        other = StoreColumn.from_values([value])
+        if (other.values.dtype, other.scale) != (self.values.dtype, self.scale):
+            other = StoreColumn.concatenate([self, other])
+            self.values, self.scale = other.values[:-1], other.scale
+        self.values[index] = other.values[-1]
+
+    def floats(self):
+        """
+        Return the values as a float64 array, with NaN for None values.
+
+        :return: the numpy array
+        """
+        ret_value = np.full(len(self.values), np.nan)
+        valid = ~self.nulls
+        ret_value[valid] = self.values[valid].astype(np.float64)
+        if self.scale:
+            ret_value /= 10 ** self.scale
+        return ret_value
+
+
+class RecordStore:
+    """
+    Columnar store of the records [cod_staz, data_i, ...] of a daily table, sorted by station.
+    The station ids are kept in the array `stations`, the dates as day ordinals in the array
+    `days`, and each of the other columns in a `StoreColumn` of `columns`.
+    """
+
+    def __init__(self, stations, days, columns, datetimes=True):
+        self.stations = stations
+        self.days = days
+        self.columns = columns
+        self.datetimes = datetimes
+        self.date_class = datetimes and datetime or date
+
+    @classmethod
+    def from_results(cls, results, batch_size=ITERSIZE):
+        """
+        Create a RecordStore filled with the rows of an iterable of results (i.e. a sqlalchemy
+        query result object), consumed in batches of `batch_size` rows.
+        The type of each column is chosen on the values of all the batches.
+
+        :param results: iterable of the rows [cod_staz, data_i, ...]
+        :param batch_size: number of rows converted at a time
+        :return: the RecordStore object
+        """
+        results = iter(results)
+        stations = []
+        days = []
+        columns = []
+        datetimes = True
+        while True:
+            batch = list(itertools.islice(results, batch_size))
+            if not batch:
+                break
+            batch_columns = list(zip(*batch))
+            if not stations:
+                datetimes = isinstance(batch_columns[1][0], datetime)
+            stations.append(np.array(batch_columns[0], dtype=np.int64))
+            days.append(np.fromiter(
+                (d.toordinal() for d in batch_columns[1]), np.int64, len(batch)))
+            columns.append([StoreColumn.from_values(c) for c in batch_columns[2:]])
+        if not stations:
+            return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), [])
+        columns = [StoreColumn.concatenate(parts) for parts in zip(*columns)]
+        return cls(np.concatenate(stations), np.concatenate(days), columns, datetimes)
+
+    def __len__(self):
+        return len(self.stations)
+
+    @property
+    def width(self):
+        return len(self.columns) + 2
+
+    def station_offsets(self):
+        """
+        Return the offsets where the records of each station start, followed by the number
+        of records: the records of the i-th station are in [offsets[i]:offsets[i+1]].
+
+        :return: the numpy array of the offsets
+        """
+        if not len(self):
+            return np.zeros(1, dtype=np.int64)
+        starts = np.flatnonzero(np.diff(self.stations)) + 1
+        return np.concatenate(([0], starts, [len(self)]))
+
+    def get_value(self, index, position):
+        """
+        Return the value of the column at `position` of the record at `index`.
+
+        :param index: index of the record
+        :param position: position of the column in the record
+        :return: the value
+        """
+        if position < 0:
+            position += self.width
+        if position == 0:
+            return int(self.stations[index])
+        if position == 1:
+            return self.date_class.fromordinal(int(self.days[index]))
+        return self.columns[position - 2].get(index)
+
+    def set_value(self, index, position, value):
+        """
+        Set the value of the column at `position` of the record at `index`.
+        The column is converted to fit the new value (see `StoreColumn.set`).
+
+        :param index: index of the record
+        :param position: position of the column in the record
+        :param value: the new value
+        """
+        if position < 0:
+            position += self.width
+        if position == 0:
+            self.stations[index] = value
+            return
+        if position == 1:
+            self.days[index] = value.toordinal()
+            return
+        self.columns[position - 2].set(index, value)
+
+    def float_column(self, number):
+        """
+        Return the column `number` of `columns` as a float64 array, with NaN for None values.
+
+        :param number: index of the column in `columns`
+        :return: the numpy array
+        """
+        return self.columns[number].floats()
+
+    def record(self, index):
+        """
+        Return the record at `index` as a list.
+
+        :param index: index of the record
+        :return: the list [cod_staz, data_i, ...]
+        """
+        return [self.get_value(index, position) for position in range(self.width)]
+
+    def view(self):
+        """
+        Return a list-like view of the records, where each record is a `RecordView`
+        that reads and writes the values of the store.
+
+        :return: the RecordListView object
+        """
+        return RecordListView(self)
+
+
+class RecordView:
+    """
+    A list-like record of a RecordStore: changes to its values are written to the store.
+    A slice of the record (i.e. `record[:]`) returns a copy as a list.
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __len__(self):
+        return self.store.width
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return self.store.record(self.index)[position]
+        return self.store.get_value(self.index, position)
+
+    def __setitem__(self, position, value):
+        self.store.set_value(self.index, position, value)
+
+    def __iter__(self):
+        return iter(self.store.record(self.index))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(self.store.record(self.index))
+
+
+class RecordListView:
+    """
+    A list-like view of the records of a RecordStore (see `RecordStore.view`).
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [RecordView(self.store, i) for i in range(len(self.store))[index]]
+        if index < 0:
+            index += len(self.store)
+        if not 0 <= index < len(self.store):
+            raise IndexError('record index out of range')
+        return RecordView(self.store, index)
+
+    def __iter__(self):
+        for index in range(len(self.store)):
+            yield RecordView(self.store, index)
@@ -136,6 +136,21 @@ class Ui_process_dma_form(object):
         self.input_policy.addItem(_fromUtf8(""))
         self.input_policy.addItem(_fromUtf8(""))
         self.horizontalLayout_11.addWidget(self.input_policy)
+        self.layoutWidget_5 = QtGui.QWidget(process_dma_form)
+        self.layoutWidget_5.setGeometry(QtCore.QRect(30, 250, 151, 29))
+        self.layoutWidget_5.setObjectName(_fromUtf8("layoutWidget_5"))
+        self.horizontalLayout_12 = QtGui.QHBoxLayout(self.layoutWidget_5)
+        self.horizontalLayout_12.setMargin(0)
+        self.horizontalLayout_12.setObjectName(_fromUtf8("horizontalLayout_12"))
+        self.label_3 = QtGui.QLabel(self.layoutWidget_5)
+        self.label_3.setObjectName(_fromUtf8("label_3"))
+        self.horizontalLayout_12.addWidget(self.label_3)
+        self.input_workers = QtGui.QSpinBox(self.layoutWidget_5)
+        self.input_workers.setMinimum(1)
+        self.input_workers.setMaximum(64)
+        self.input_workers.setProperty("value", 1)
+        self.input_workers.setObjectName(_fromUtf8("input_workers"))
+        self.horizontalLayout_12.addWidget(self.input_workers)
         self.widget1 = QtGui.QWidget(process_dma_form)
         self.widget1.setGeometry(QtCore.QRect(30, 280, 431, 59))
         self.widget1.setObjectName(_fromUtf8("widget1"))
@@ -195,6 +210,7 @@ class Ui_process_dma_form(object):
         self.layoutWidget_3.raise_()
         self.layoutWidget_3.raise_()
         self.layoutWidget_4.raise_()
+        self.layoutWidget_5.raise_()
 
         self.retranslateUi(process_dma_form)
         QtCore.QMetaObject.connectSlotsByName(process_dma_form)
@@ -219,6 +235,7 @@ class Ui_process_dma_form(object):
         self.label_4.setText(_translate("process_dma_form", "Schema di input", None))
         self.label_6.setText(_translate("process_dma_form", "Schema di output", None))
         self.label_2.setText(_translate("process_dma_form", "Tipo di inserimento", None))
+        self.label_3.setText(_translate("process_dma_form", "Processi", None))
         self.input_policy.setItemText(0, _translate("process_dma_form", "UPSERT", None))
         self.input_policy.setItemText(1, _translate("process_dma_form", "SOLO INSERT", None))
         self.label_5.setText(_translate("process_dma_form", "File di report", None))
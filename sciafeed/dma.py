@@ -1,14 +1,19 @@
 """
 This module contains functions and utilities that get and update information for DMA data
 """
+import bisect
 import calendar
+import collections
 from datetime import datetime
+from decimal import Decimal
+import fractions
 import functools
 import itertools
-
+import math
 import operator
 import numpy as np
 import statistics
+import sys
 
 from sciafeed import db_utils
 from sciafeed import querying
@@ -17,6 +22,18 @@ from sciafeed import upsert
 from sciafeed import utils
 
 ROUND_PRECISION = 1
+# bits of the integer square root computed by `sqrt_of_fraction` before rounding to float
+FLOAT_SQRT_BIT_WIDTH = 2 * sys.float_info.mant_dig + 3
+# number of stations processed at once by `process_dma_family`
+DMA_STATIONS_BATCH_SIZE = 500
+# classes of relative humidity (upper bound included) and critical temperatures of sharl/ifu1
+SHARL_UREL_THRESHOLDS = [57.5, 62.5, 67.5, 72.5, 77.5, 82.5, 87.5, 92.5, 97.5]
+SHARL_CRITICAL_TEMPS = [26.2, 24.8, 23.4, 22.2, 21.1, 20.1, 19.1, 18.2, 17.3, 16.5]
+IFU1_UREL_THRESHOLDS = [42.5, 47.5, 52.5, 57.5, 62.5, 67.5, 72.5, 77.5, 82.5, 87.5]
+IFU1_CRITICAL_TEMPS = [-2.5, -1.5, -0.5, -0.3, 0, 0.5, 1.5, 1.8, 2.2, 2.8, 3.5]
+# classes of temperature (upper bound included) of the persistence of tmax and tmin
+PRS_T200MX_THRESHOLDS = [-5, 0, 5, 10, 15, 20, 25, 30, 35, 40]
+PRS_T200MN_THRESHOLDS = [-20, -15, -10, -5, 0, 5, 10, 15]
 
 
 def merge_data_items(records1, records2, pkeys=('data_i', 'cod_staz', 'cod_aggr')):
@@ -42,6 +59,56 @@ def merge_data_items(records1, records2, pkeys=('data_i', 'cod_staz', 'cod_aggr'
     return list(dict1.values())
 
 
+class DmaAccumulator(object):
+    """
+    Accumulator of the DMA records of a target table: the records with the same keys `pkeys`
+    written by different aggregators are merged in place into a single record, so the
+    records to upsert are built only once.
+    The records added are not copied: each record must be added to one accumulator only.
+    """
+    def __init__(self, pkeys=('data_i', 'cod_staz', 'cod_aggr')):
+        """
+        :param pkeys: list of keys to identify a single record
+        """
+        self.pkeys = pkeys
+        self.items = dict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, records):
+        """
+        Merge the records `records` into the accumulator.
+
+        :param records: list of DMA records (dictionaries)
+        """
+        items = self.items
+        pkeys = self.pkeys
+        for record in records:
+            key = tuple([record[p] for p in pkeys])
+            item = items.get(key)
+            if item is None:
+                items[key] = record
+            else:
+                item.update(record)
+
+    def records(self):
+        """
+        Return the list of the records accumulated, in order of insertion.
+        """
+        return list(self.items.values())
+
+    def columns(self, fields):
+        """
+        Return the records accumulated column-wise, as a dictionary {field: list of values}
+        (None for the fields missing in a record).
+
+        :param fields: list of the fields to return
+        :return: the dictionary of columns
+        """
+        return {field: [item.get(field) for item in self.items.values()] for field in fields}
+
+
 def compute_flag(records, at_least_perc, num_expected=10):
     """
     Return (ndati, wht) where:
@@ -104,10 +171,10 @@ def compute_temp_flag(records, at_least_perc, num_expected=10):
     ndati, wht = compute_flag(records, at_least_perc, num_expected)
     if num_expected not in (355, 356) or not wht:
         return ndati, wht
-    valid_records = [r for r in records if r[4] > 0 and r[3] is not None]
-    summer_days = [r for r in valid_records if spring.is_day_in_summer(r[1])]
-    winter_days = [r for r in valid_records if spring.is_day_in_winter(r[1])]
-    if abs(len(summer_days) - len(winter_days)) > 20:
+    valid_days = [r[1] for r in records if r[4] > 0 and r[3] is not None]
+    summer_days = int(spring.days_in_summer(valid_days).sum())
+    winter_days = int(spring.days_in_winter(valid_days).sum())
+    if abs(summer_days - winter_days) > 20:
         wht = 0
     return ndati, wht
 
@@ -569,6 +636,40 @@ def compute_icu(records, num_expected, at_least_perc=0.75):
     return flag, num
 
 
+def run_lengths(keys):
+    """
+    Return (starts, lengths) of the runs of consecutive equal items of the array `keys`.
+
+    :param keys: numpy array
+    :return: (array of the start indexes, array of the lengths) of the runs
+    """
+    if not len(keys):
+        return np.array([], dtype=int), np.array([], dtype=int)
+    starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(keys)))
+    return starts, lengths
+
+
+def count_over_critical_temp(valid_values, urel_thresholds, critical_temps):
+    """
+    Return (num_01, num_02) of the indexes `compute_sharl` and `compute_ifu1`, where the critical
+    temperature of each value depends on the class of relative humidity.
+
+    :param valid_values: list of (tmedia, urel)
+    :param urel_thresholds: upper bounds of the classes of relative humidity
+    :param critical_temps: critical temperature of each class
+    :return: (num_01, num_02)
+    """
+    if not valid_values:
+        return 0, 0
+    values = np.array(valid_values, dtype=float)
+    classes = np.digitize(values[:, 1], urel_thresholds, right=True)
+    delta = values[:, 0] - np.array(critical_temps, dtype=float)[classes]
+    num_01 = int(np.count_nonzero(delta > 0))
+    num_02 = int(np.count_nonzero(delta > 1)) + int(np.count_nonzero(delta > 2))
+    return num_01, num_02
+
+
 def compute_sharl(records, num_expected, at_least_perc=0.75):
     """
     Compute "indice di Scharlau" for different DMA aggregations.
@@ -582,37 +683,9 @@ def compute_sharl(records, num_expected, at_least_perc=0.75):
     flag = compute_flag(records, at_least_perc, num_expected)
     valid_values = [r[3] for r in records if r[4] > 0 and len(r[3]) == 2 and r[3][0] is not None
                     and r[3][1] is not None]
-    sortedbyurel = sorted(valid_values, key=operator.itemgetter(1))
-    num_01 = num_02 = num_03 = 0
-
-    def group_by_ur(valid_value):
-        temp, urel = valid_value
-        if urel <= 57.5:
-            return 26.2
-        elif 57.5 < urel <= 62.5:
-            return 24.8
-        elif 62.5 < urel <= 67.5:
-            return 23.4
-        elif 67.5 < urel <= 72.5:
-            return 22.2
-        elif 72.5 < urel <= 77.5:
-            return 21.1
-        elif 77.5 < urel <= 82.5:
-            return 20.1
-        elif 82.5 < urel <= 87.5:
-            return 19.1
-        elif 87.5 < urel <= 92.5:
-            return 18.2
-        elif 92.5 < urel <= 97.5:
-            return 17.3
-        # else: 97.5 < urel <= 100:
-        return 16.5
-
-    for critical_temp, urel_set in itertools.groupby(sortedbyurel, group_by_ur):
-        urel_set = list(urel_set)
-        num_01 += len([r for r in urel_set if float(r[0]) - critical_temp > 0])
-        num_02 += len([r for r in urel_set if float(r[0]) - critical_temp > 1])
-        num_02 += len([r for r in urel_set if float(r[0]) - critical_temp > 2])
+    num_01, num_02 = count_over_critical_temp(
+        valid_values, SHARL_UREL_THRESHOLDS, SHARL_CRITICAL_TEMPS)
+    num_03 = 0
     return flag, num_01, num_02, num_03
 
 
@@ -629,39 +702,9 @@ def compute_ifu1(records, num_expected, at_least_perc=0.75):
     flag = compute_flag(records, at_least_perc, num_expected)
     valid_values = [r[3] for r in records if r[4] > 0 and len(r[3]) == 2 and r[3][0] is not None
                     and r[3][1] is not None]
-    sortedbyurel = sorted(valid_values, key=operator.itemgetter(1))
-    num_01 = num_02 = num_03 = 0
-
-    def group_by_ur(valid_value):
-        temp, urel = valid_value
-        if urel <= 42.5:
-            return -2.5
-        elif 42.5 < urel <= 47.5:
-            return -1.5
-        elif 47.5 < urel <= 52.5:
-            return -0.5
-        elif 52.5 < urel <= 57.5:
-            return -0.3
-        elif 57.5 < urel <= 62.5:
-            return 0
-        elif 62.5 < urel <= 67.5:
-            return 0.5
-        elif 67.5 < urel <= 72.5:
-            return 1.5
-        elif 72.5 < urel <= 77.5:
-            return 1.8
-        elif 77.5 < urel <= 82.5:
-            return 2.2
-        elif 82.5 < urel <= 87.5:
-            return 2.8
-        # else: 87.5 < urel <= 100:
-        return 3.5
-
-    for critical_temp, urel_set in itertools.groupby(sortedbyurel, group_by_ur):
-        urel_set = list(urel_set)
-        num_01 += len([r for r in urel_set if float(r[0]) - critical_temp > 0])
-        num_02 += len([r for r in urel_set if float(r[0]) - critical_temp > 1])
-        num_02 += len([r for r in urel_set if float(r[0]) - critical_temp > 2])
+    num_01, num_02 = count_over_critical_temp(
+        valid_values, IFU1_UREL_THRESHOLDS, IFU1_CRITICAL_TEMPS)
+    num_03 = 0
     return flag, num_01, num_02, num_03
 
 
@@ -679,60 +722,76 @@ def compute_prs_prec(records, num_expected, at_least_perc=0.9):
     nwet_01, totwet_01, datawet_01, nwet_02, totwet_02, datawet_02, \
         nwet_03, totwet_03, datawet_03 = [None] * 9
 
-    def group_by_low_prec(r):
-        return r[3] <= 1
+    is_low = np.fromiter((r[3] <= 1 for r in valid_records), dtype=bool, count=len(valid_records))
+    starts, lengths = run_lengths(is_low)
+    # runs sorted by length (descending), the first ones first in case of same length
+    order = np.argsort(-lengths, kind='stable')
+    run_is_low = is_low[starts][order]
+    # only the 4 longest sequences can be used
+    dry_sequences = [valid_records[starts[i]:starts[i]+lengths[i]] for i in order[run_is_low][:4]]
+    wet_sequences = [valid_records[starts[i]:starts[i]+lengths[i]] for i in order[~run_is_low][:4]]
 
-    dry_sequences = []
-    wet_sequences = []
+    def first_date(rec_sequence):
+        return min([r[1] for r in rec_sequence]).strftime('%Y-%m-%d 00:00:00')
 
-    for is_low, rec_sequence in itertools.groupby(valid_records, group_by_low_prec):
-        rec_sequence = list(rec_sequence)
-        if is_low:
-            dry_sequences.append(rec_sequence)
-        else:
-            wet_sequences.append(rec_sequence)
-    dry_sequences.sort(key=lambda r: len(r), reverse=True)
-    wet_sequences.sort(key=lambda r: len(r), reverse=True)
     if len(dry_sequences) > 1:
         longest = dry_sequences[0]
         ndry_01 = len(longest)
-        datadry_01 = sorted(longest, key=operator.itemgetter(1))[0][1].strftime(
-            '%Y-%m-%d 00:00:00')
+        datadry_01 = first_date(longest)
     if len(dry_sequences) > 2:
         longest = dry_sequences[1]
         ndry_02 = len(longest)
-        datadry_02 = sorted(longest, key=operator.itemgetter(1))[0][1].strftime(
-            '%Y-%m-%d 00:00:00')
+        datadry_02 = first_date(longest)
     if len(dry_sequences) > 3:
         longest = dry_sequences[1]
         ndry_03 = len(longest)
-        datadry_03 = sorted(longest, key=operator.itemgetter(1))[0][1].strftime(
-            '%Y-%m-%d 00:00:00')
+        datadry_03 = first_date(longest)
 
     if len(wet_sequences) > 1:
         longest = wet_sequences[0]
         nwet_01 = len(longest)
         totwet_01 = float(sum([r[3] for r in longest]))
-        datawet_01 = sorted(longest, key=operator.itemgetter(1))[0][1].strftime(
-            '%Y-%m-%d 00:00:00')
+        datawet_01 = first_date(longest)
     if len(wet_sequences) > 2:
         longest = wet_sequences[1]
         nwet_02 = len(longest)
         totwet_02 = float(sum([r[3] for r in longest]))
-        datawet_02 = sorted(longest, key=operator.itemgetter(1))[0][1].strftime(
-            '%Y-%m-%d 00:00:00')
+        datawet_02 = first_date(longest)
     if len(wet_sequences) > 3:
         longest = wet_sequences[2]
         nwet_03 = len(longest)
         totwet_03 = float(sum([r[3] for r in longest]))
-        datawet_03 = sorted(longest, key=operator.itemgetter(1))[0][1].strftime(
-            '%Y-%m-%d 00:00:00')
+        datawet_03 = first_date(longest)
     ret_value = [flag, ndry_01, datadry_01, ndry_02, datadry_02, ndry_03, datadry_03,
                  nwet_01, totwet_01, datawet_01, nwet_02, totwet_02, datawet_02,
                  nwet_03, totwet_03, datawet_03] + [None] * 9
     return ret_value
 
 
+def compute_temp_persistence(valid_records, thresholds):
+    """
+    Return (numX, dataX) where, for each class of temperature defined by `thresholds`
+    (upper bound included), numX is the length of the longest sequence of consecutive records
+    in the class and dataX is the date of the first record of the (first) longest sequence.
+
+    :param valid_records: list of valid `data` objects
+    :param thresholds: upper bounds of the classes of temperature
+    :return: (numX, dataX)
+    """
+    numX = [0] * (len(thresholds) + 1)
+    dataX = [None] * (len(thresholds) + 1)
+    values = np.array([r[3] for r in valid_records], dtype=float)
+    classes = np.digitize(values, thresholds, right=True)
+    starts, lengths = run_lengths(classes)
+    run_classes = classes[starts]
+    for the_index in np.unique(run_classes):
+        runs = np.flatnonzero(run_classes == the_index)
+        longest = runs[np.argmax(lengths[runs])]
+        numX[the_index] = int(lengths[longest])
+        dataX[the_index] = valid_records[starts[longest]][1].strftime('%Y-%m-%d 00:00:00')
+    return numX, dataX
+
+
 def compute_prs_t200mx(records, num_expected, at_least_perc=0.75):
     """
     Compute 'Persistenza temperatura (Tmassima)'
@@ -743,39 +802,7 @@ def compute_prs_t200mx(records, num_expected, at_least_perc=0.75):
     """
     flag = compute_temp_flag(records, at_least_perc, num_expected)
     valid_records = [r for r in records if r[4] and r[4] > 0 and r[3] is not None]
-    numX = [0] * 11
-    dataX = [None] * 11
-
-    def group_by_trange(record):
-        value = record[3]
-        if value <= -5:
-            return 0
-        elif -5 < value <= 0:
-            return 1
-        elif 0 < value <= 5:
-            return 2
-        elif 5 < value <= 10:
-            return 3
-        elif 10 < value <= 15:
-            return 4
-        elif 15 < value <= 20:
-            return 5
-        elif 20 < value <= 25:
-            return 6
-        elif 25 < value <= 30:
-            return 7
-        elif 30 < value <= 35:
-            return 8
-        elif 35 < value <= 40:
-            return 9
-        # else > 40:
-        return 10
-
-    for the_index, rec_sequence in itertools.groupby(valid_records, group_by_trange):
-        rec_sequence = list(rec_sequence)
-        if len(rec_sequence) > numX[the_index]:
-            numX[the_index] = len(rec_sequence)
-            dataX[the_index] = rec_sequence[0][1].strftime('%Y-%m-%d 00:00:00')
+    numX, dataX = compute_temp_persistence(valid_records, PRS_T200MX_THRESHOLDS)
     # fields = [numX[0], dataX[0], numX[1], dataX[1], ...]
     fields = list(functools.reduce(operator.add, zip(numX, dataX)))
     ret_value = [flag] + fields
@@ -792,35 +819,7 @@ def compute_prs_t200mn(records, num_expected, at_least_perc=0.75):
     """
     flag = compute_temp_flag(records, at_least_perc, num_expected)
     valid_records = [r for r in records if r[4] and r[4] > 0 and r[3] is not None]
-    numX = [0] * 9
-    dataX = [None] * 9
-
-    def group_by_trange(record):
-        value = record[3]
-        if value <= -20:
-            return 0
-        elif -20 < value <= -15:
-            return 1
-        elif -15 < value <= -10:
-            return 2
-        elif -10 < value <= -5:
-            return 3
-        elif -5 < value <= 0:
-            return 4
-        elif 0 < value <= 5:
-            return 5
-        elif 5 < value <= 10:
-            return 6
-        elif 10 < value <= 15:
-            return 7
-        # value > 15
-        return 8
-
-    for the_index, rec_sequence in itertools.groupby(valid_records, group_by_trange):
-        rec_sequence = list(rec_sequence)
-        if len(rec_sequence) > numX[the_index]:
-            numX[the_index] = len(rec_sequence)
-            dataX[the_index] = rec_sequence[0][1].strftime('%Y-%m-%d 00:00:00')
+    numX, dataX = compute_temp_persistence(valid_records, PRS_T200MN_THRESHOLDS)
     # fields = [numX[0], dataX[0], numX[1], dataX[1], ...]
     fields = list(functools.reduce(operator.add, zip(numX, dataX)))
     ret_value = [flag] + fields
@@ -1009,65 +1008,468 @@ def compute_day_gelo(records, num_expected, at_least_perc=0.75):
     return flag, num
 
 
-def compute_dma_records(table_records, field=None, field_funct=None, map_funct=None):
-    """
-    It return records of kind [{'data_i': ..., 'cod_staz': ...,  'cod_aggr': ...}, ...]
-    obtaining aggregating input records in decades, months and years.
-    Each output record has also some keys computed running some functions:
-    ::
+def exact_ratio(value):
+    """
+    Return the exact (numerator, denominator) of a finite number.
+
+    :param value: int, float, Decimal or Fraction value
+    :return: (numerator, denominator)
+    """
+    value = fractions.Fraction(value)
+    return value.numerator, value.denominator
+
+
+def coerce_types(type1, type2):
+    """
+    Return the numeric type of the result of an operation between values of `type1` and
+    `type2` (ints are coerced to the other type, subclasses win over their base classes,
+    fractions are coerced to floats), as the functions of `statistics` do.
+
+    :param type1: the first type
+    :param type2: the second type
+    :return: the coerced type
+    """
+    if type1 is type2 or issubclass(type2, int):
+        return type1
+    if issubclass(type1, int) or issubclass(type2, type1):
+        return type2
+    if issubclass(type1, type2):
+        return type1
+    if issubclass(type1, fractions.Fraction) and issubclass(type2, float):
+        return type2
+    if issubclass(type1, float) and issubclass(type2, fractions.Fraction):
+        return type1
+    raise TypeError("don't know how to coerce %s and %s" % (type1.__name__, type2.__name__))
+
+
+def convert_fraction(value, value_type):
+    """
+    Return the Fraction `value` converted to the numeric type `value_type`
+    (a float if `value_type` is int but `value` is not integer).
+
+    :param value: the Fraction value
+    :param value_type: the numeric type
+    :return: the converted value
+    """
+    if issubclass(value_type, fractions.Fraction):
+        return value
+    if issubclass(value_type, int):
+        if value.denominator == 1:
+            return value_type(value.numerator)
+        value_type = float
+    if issubclass(value_type, Decimal):
+        return value_type(value.numerator) / value_type(value.denominator)
+    return value_type(value)
+
+
+def sqrt_of_fraction(value, value_type):
+    """
+    Return the correctly rounded square root of the Fraction `value` (not negative), as a
+    Decimal if `value_type` is Decimal, as a float otherwise.
+
+    :param value: the Fraction value
+    :param value_type: the numeric type
+    :return: the square root
+    """
+    n, m = value.numerator, value.denominator
+    if issubclass(value_type, Decimal):
+        if not n:
+            return Decimal('0.0')
+        root = (Decimal(n) / Decimal(m)).sqrt()
+        # fix the rounding by comparing the square of the midpoints with the exact value
+        nr, dr = root.as_integer_ratio()
+        plus = root.next_plus()
+        np_, dp = plus.as_integer_ratio()
+        if 4 * n * (dr*dp)**2 > m * (dr*np_ + dp*nr)**2:
+            return plus
+        minus = root.next_minus()
+        nm, dm = minus.as_integer_ratio()
+        if 4 * n * (dr*dm)**2 < m * (dr*nm + dm*nr)**2:
+            return minus
+        return root
+    # integer square root with enough extra bits, rounded to odd, then a single rounding
+    q = (n.bit_length() - m.bit_length() - FLOAT_SQRT_BIT_WIDTH) // 2
+    if q >= 0:
+        m <<= 2 * q
+        root = math.isqrt(n // m)
+        return (root | (root * root * m != n)) << q
+    n <<= -2 * q
+    root = math.isqrt(n // m)
+    return (root | (root * root * m != n)) / (1 << -q)
+
+
+class DmaSummary(object):
+    """
+    Mergeable partial state of a DMA aggregation over a set of valid values: the number
+    of values, their exact sums and sums of squares (kept as `statistics` does), the extremes
+    with their days, the number of negative values and the counts of values inside the classes
+    defined by `thresholds` (upper bound included).
+    """
+    def __init__(self, thresholds=None):
+        """
+        :param thresholds: sorted upper bounds of the classes to count (None for no classes)
+        """
+        self.count = 0
+        self.types = set()
+        self.sx_partials = collections.defaultdict(int)
+        self.sxx_partials = collections.defaultdict(int)
+        self.mx = self.mx_day = None
+        self.mn = self.mn_day = None
+        self.negatives = 0
+        self.thresholds = thresholds
+        self.bins = None
+        if thresholds is not None:
+            self.bins = [0] * (len(thresholds) + 1)
+
+    def add(self, value, day):
+        """
+        Add a valid value to the summary.
+
+        :param value: the value
+        :param day: the datetime object of the value
+        """
+        self.count += 1
+        self.types.add(type(value))
+        numerator, denominator = exact_ratio(value)
+        self.sx_partials[denominator] += numerator
+        self.sxx_partials[denominator] += numerator * numerator
+        if self.mx is None or value > self.mx:
+            self.mx, self.mx_day = value, day
+        if self.mn is None or value < self.mn:
+            self.mn, self.mn_day = value, day
+        if value < 0:
+            self.negatives += 1
+        if self.bins is not None:
+            self.bins[bisect.bisect_left(self.thresholds, value)] += 1
+
+    @classmethod
+    def from_partials(cls, count, sx=None, sxx=None, mx=None, mn=None):
+        """
+        Return the summary of `count` values from their sum `sx`, sum of squares `sxx`,
+        maximum `mx` and minimum `mn` (for example computed by a SQL aggregation).
+        If `sx` is None, the summary only counts the values.
+
+        :param count: number of values
+        :param sx: sum of the values
+        :param sxx: sum of the squares of the values
+        :param mx: maximum of the values
+        :param mn: minimum of the values
+        :return: the DmaSummary instance
+        """
+        summary = cls()
+        summary.count = count
+        if not count or sx is None:
+            return summary
+        summary.types.add(type(mx))
+        numerator, denominator = exact_ratio(sx)
+        summary.sx_partials[denominator] += numerator
+        # partials of the squares are fractions numerator/denominator**2
+        numerator, denominator = exact_ratio(sxx)
+        summary.sxx_partials[denominator] += numerator * denominator
+        summary.mx = mx
+        summary.mn = mn
+        return summary
+
+    def merge(self, other):
+        """
+        Return a new summary of the values of this summary followed by the values of `other`.
+
+        :param other: the DmaSummary instance of the following values
+        :return: the merged DmaSummary instance
+        """
+        ret_value = DmaSummary(self.thresholds)
+        ret_value.count = self.count + other.count
+        ret_value.types = self.types | other.types
+        for summary in (self, other):
+            for denominator, numerator in summary.sx_partials.items():
+                ret_value.sx_partials[denominator] += numerator
+            for denominator, numerator in summary.sxx_partials.items():
+                ret_value.sxx_partials[denominator] += numerator
+        ret_value.mx, ret_value.mx_day = self.mx, self.mx_day
+        if other.mx is not None and (self.mx is None or other.mx > self.mx):
+            ret_value.mx, ret_value.mx_day = other.mx, other.mx_day
+        ret_value.mn, ret_value.mn_day = self.mn, self.mn_day
+        if other.mn is not None and (self.mn is None or other.mn < self.mn):
+            ret_value.mn, ret_value.mn_day = other.mn, other.mn_day
+        ret_value.negatives = self.negatives + other.negatives
+        if self.bins is not None:
+            ret_value.bins = [b1 + b2 for b1, b2 in zip(self.bins, other.bins)]
+        return ret_value
+
+    def flag(self, at_least_perc, num_expected):
+        """
+        Return (ndati, wht), as `compute_flag`.
+
+        :param at_least_perc: minimum percentage of valid data for the wht
+        :param num_expected: number of expected for full coverage
+        :return: (ndati, wht)
+        """
+        wht = 0
+        if self.count / num_expected >= at_least_perc:
+            wht = 1
+        return self.count, wht
+
+    def value_type(self):
+        """
+        Return the numeric type of the statistics of the values (as `statistics` does)
+        """
+        return functools.reduce(coerce_types, self.types, int)
+
+    def exact_sum(self):
+        """
+        Return the sum of the values as a Fraction
+        """
+        return sum(fractions.Fraction(n, d) for d, n in self.sx_partials.items())
+
+    def total(self):
+        """
+        Return the sum of the values
+        """
+        return convert_fraction(self.exact_sum(), self.value_type())
+
+    def mean(self):
+        """
+        Return the mean of the values, the same of `statistics.mean`
+        """
+        return convert_fraction(self.exact_sum() / self.count, self.value_type())
+
+    def stdev(self):
+        """
+        Return the sample standard deviation of the values, the same of `statistics.stdev`
+        """
+        sx = self.exact_sum()
+        sxx = sum(fractions.Fraction(n, d*d) for d, n in self.sxx_partials.items())
+        mss = (self.count * sxx - sx * sx) / self.count / (self.count - 1)
+        return sqrt_of_fraction(mss, self.value_type())
+
+
+class MergeableAggregation(object):
+    """
+    A DMA aggregation that can be computed from a DmaSummary of the valid input records, so
+    that the months can be derived from the decades and the years from the months.
+    """
+    def __init__(self, valid_funct, value_funct, finalize_funct, thresholds=None):
+        """
+        :param valid_funct: function that returns True if an input record is valid
+        :param value_funct: function that returns the value of a valid input record
+        :param finalize_funct: function (summary, num_expected) -> result of the aggregation
+        :param thresholds: sorted upper bounds of the classes to count (None for no classes)
+        """
+        self.valid_funct = valid_funct
+        self.value_funct = value_funct
+        self.finalize_funct = finalize_funct
+        self.thresholds = thresholds
+
+    def summarize(self, records):
+        """
+        Return the DmaSummary of the valid records of `records`.
+
+        :param records: list of `data` objects
+        :return: the DmaSummary instance
+        """
+        summary = DmaSummary(self.thresholds)
+        for record in records:
+            if self.valid_funct(record):
+                summary.add(self.value_funct(record), record[1])
+        return summary
+
+    def finalize(self, summary, num_expected):
+        """
+        Return the result of the aggregation from the summary `summary`.
+
+        :param summary: the DmaSummary instance
+        :param num_expected: number of records expected
+        :return: the result of the aggregation
+        """
+        return self.finalize_funct(summary, num_expected)
+
+
+def round_value(value):
+    """
+    Return the float of `value` rounded with ROUND_PRECISION
+    """
+    return float(round(value, ROUND_PRECISION))
+
+
+def finalize_bagna(summary, num_expected, at_least_perc=0.75):
+    """finalize of `compute_bagna` from a DmaSummary"""
+    if not summary.count:
+        return (None, None), None, None, None, None, None
+    val_vr = None
+    if summary.count >= 2:
+        val_vr = round_value(summary.stdev())
+    return summary.flag(at_least_perc, num_expected), round_value(summary.total()), val_vr, \
+        round_value(summary.mx), round_value(summary.mn), round_value(summary.mean())
 
-        record[field] = field_funct(aggregated_records, num_expected)
 
-    where field and field_funct are items of `map_funct`, and num_expected=number of total records
-    expected in the aggregation.
-    If map_funct is not set, map_funct = {`field`: `field_funct`}, otherwise `field` and
-    `field_funct` are ignored.
-    It assumes input records are of kind (metadata, datetime object, par_code, par_value, flag).
+def finalize_md_vr_mx_mn(summary, num_expected, at_least_perc=0.75):
+    """finalize of `compute_deltaidro`, `compute_etp` and `compute_radglob` from a DmaSummary"""
+    if not summary.count:
+        return (None, None), None, None, None, None
+    val_vr = None
+    if summary.count >= 2:
+        val_vr = round_value(summary.stdev())
+    return summary.flag(at_least_perc, num_expected), round_value(summary.mean()), val_vr, \
+        round_value(summary.mx), round_value(summary.mn)
 
-    :param table_records: input records
-    :param field: additional key to be set for output records
-    :param field_funct: function to be run to compute the value of key `field` for output records
-    :param map_funct: dictionary of fields and corresponding field_functions to be run
-    :return: list of records of kind {'data_i': ...,'cod_staz': ..., 'cod_aggr': ...,`field`: ...}
-    """
-    group_by_station = operator.itemgetter(0)
-    group_by_year = lambda r: r[1].year
-    group_by_month = lambda r: r[1].month
 
-    if map_funct is None:
-        map_funct = {field: field_funct}
+def finalize_elio(summary, num_expected, at_least_perc=0.75):
+    """finalize of `compute_elio` from a DmaSummary"""
+    if not summary.count:
+        return (None, None), None, None, None
+    val_vr = None
+    if summary.count >= 2:
+        val_vr = round_value(summary.stdev())
+    return summary.flag(at_least_perc, num_expected), round_value(summary.mean()), val_vr, None
+
+
+def finalize_prec24(summary, num_expected, at_least_perc=0.9):
+    """finalize of `compute_prec24` from a DmaSummary"""
+    if not summary.count:
+        return (None, None), None, None, None
+    data_mx = summary.mx_day.strftime('%Y-%m-%d 00:00:00')
+    return summary.flag(at_least_perc, num_expected), round_value(summary.total()), \
+        round_value(summary.mx), data_mx
+
+
+def finalize_classes(summary, *args, **kwargs):
+    """finalize of `compute_cl_prec24`, `compute_cl_tmxgg` and `compute_cl_tmngg`"""
+    return tuple(summary.bins)
+
+
+def finalize_tmdgg(summary, num_expected, at_least_perc=0.75):
+    """finalize of `compute_tmdgg` from a DmaSummary"""
+    val_md = val_vr = None
+    if summary.count:
+        val_md = round_value(summary.mean())
+    if summary.count >= 2:
+        val_vr = round_value(summary.stdev())
+    return summary.flag(at_least_perc, num_expected), val_md, val_vr
+
+
+def finalize_tmxgg(summary, num_expected, at_least_perc=0.75):
+    """finalize of `compute_tmxgg` from a DmaSummary"""
+    if not summary.count:
+        return (None, None), None, None, None, None
+    val_vr = None
+    if summary.count >= 2:
+        val_vr = round_value(summary.stdev())
+    data_x = summary.mx_day.strftime('%Y-%m-%d 00:00:00')
+    return summary.flag(at_least_perc, num_expected), round_value(summary.mean()), val_vr, \
+        round_value(summary.mx), data_x
+
+
+def finalize_tmngg(summary, num_expected, at_least_perc=0.75):
+    """finalize of `compute_tmngg` from a DmaSummary"""
+    flag = summary.flag(at_least_perc, num_expected)
+    if not summary.count or not flag[1]:
+        return flag, None, None, None, None
+    val_vr = None
+    if summary.count >= 2:
+        val_vr = round_value(summary.stdev())
+    data_x = summary.mn_day.strftime('%Y-%m-%d 00:00:00')
+    return flag, round_value(summary.mean()), val_vr, round_value(summary.mn), data_x
+
+
+def finalize_tmdgg1(summary, num_expected, at_least_perc=0.75):
+    """finalize of `compute_tmdgg1` from a DmaSummary"""
+    flag = summary.flag(at_least_perc, num_expected)
+    val_md = val_vr = None
+    if not summary.count or not flag[1]:
+        return flag, val_md, val_vr
+    val_md = round_value(summary.mean())
+    if summary.count >= 2:
+        val_vr = round_value(summary.stdev())
+    return flag, val_md, val_vr
+
+
+def finalize_deltagg(summary, num_expected, at_least_perc=0.75):
+    """finalize of `compute_deltagg` from a DmaSummary"""
+    flag = summary.flag(at_least_perc, num_expected)
+    val_md = val_vr = val_mx = val_mn = None
+    if not summary.count or not flag[1]:
+        return flag, val_md, val_vr, val_mx, val_mn
+    val_md = round_value(summary.mean())
+    if summary.count >= 2:
+        val_vr = round_value(summary.stdev())
+    return flag, val_md, val_vr, float(summary.mx), float(summary.mn)
+
+
+def finalize_day_gelo(summary, num_expected, at_least_perc=0.75):
+    """finalize of `compute_day_gelo` from a DmaSummary"""
+    flag = summary.flag(at_least_perc, num_expected)
+    if not summary.count or not flag[1]:
+        return flag, None, None
+    return flag, summary.negatives
+
+
+def is_valid(r):
+    return r[4] is not None and r[4] > 0 and r[3] is not None
 
-    def group_by_decade(r):
-        if r[1].day <= 10:
-            return 1
-        elif r[1].day <= 20:
-            return 2
-        return 3
 
+def is_valid_prec(r):
+    return r[4] > 0 and r[3] is not None
+
+
+def is_valid_temp(r):
+    return r[4] and r[4] > 0 and r[3] is not None
+
+
+def is_valid_tmax_tmin(r):
+    return len(r[3]) == 2 and r[3][0] is not None and r[3][1] is not None and r[4] and r[4] > 0
+
+
+get_value = operator.itemgetter(3)
+
+# aggregations that can be computed hierarchically by `compute_dma_records`
+MERGEABLE_AGGREGATIONS = {
+    compute_bagna: MergeableAggregation(is_valid, get_value, finalize_bagna),
+    compute_deltaidro: MergeableAggregation(is_valid, get_value, finalize_md_vr_mx_mn),
+    compute_elio: MergeableAggregation(is_valid, get_value, finalize_elio),
+    compute_etp: MergeableAggregation(is_valid, get_value, finalize_md_vr_mx_mn),
+    compute_radglob: MergeableAggregation(is_valid, get_value, finalize_md_vr_mx_mn),
+    compute_prec24: MergeableAggregation(is_valid_prec, get_value, finalize_prec24),
+    compute_cl_prec24: MergeableAggregation(
+        is_valid_prec, get_value, finalize_classes, thresholds=[1, 5, 10, 20, 50]),
+    compute_tmdgg: MergeableAggregation(is_valid_temp, get_value, finalize_tmdgg),
+    compute_tmxgg: MergeableAggregation(is_valid_temp, get_value, finalize_tmxgg),
+    compute_tmngg: MergeableAggregation(is_valid_temp, get_value, finalize_tmngg),
+    compute_cl_tmxgg: MergeableAggregation(
+        is_valid_temp, get_value, finalize_classes,
+        thresholds=[-5, 0, 5, 10, 15, 20, 25, 30, 35, 40]),
+    compute_cl_tmngg: MergeableAggregation(
+        is_valid_temp, get_value, finalize_classes, thresholds=[-15, -10, -5, 0, 5, 10, 15, 20]),
+    compute_tmdgg1: MergeableAggregation(
+        is_valid_tmax_tmin, lambda r: (r[3][0]+r[3][1])/2, finalize_tmdgg1),
+    compute_deltagg: MergeableAggregation(
+        is_valid_tmax_tmin, lambda r: r[3][0]-r[3][1], finalize_deltagg),
+    compute_day_gelo: MergeableAggregation(is_valid_temp, get_value, finalize_day_gelo),
+}
+
+
+def aggregate_dma_periods(decade_states, aggregate, merge):
+    """
+    Return the items of kind {'data_i': ..., 'cod_staz': ..., 'cod_aggr': ..., ...}
+    of the decades, months and years of the states of the decades `decade_states`.
+    The state of a month is the merge of the states of its decades, the state of a year
+    is the merge of the states of its months.
+
+    :param decade_states: iterable of (cod_staz, year, month, decade, state) sorted by
+                          station and date
+    :param aggregate: function (state, num_expected) -> dictionary of the values of the item
+    :param merge: function (list of states) -> state of their union
+    :return: the list of items of the years, followed by months and decades
+    """
     year_items = []
     month_items = []
     decade_items = []
-    for station, station_records in itertools.groupby(table_records, group_by_station):
-        for year, year_records in itertools.groupby(station_records, group_by_year):
-            year_records = list(year_records)
-            data_i = datetime(year, 12, 31)
-            year_item = {
-                'data_i': data_i, 'cod_staz': station, 'cod_aggr': 3, 'provenienza': 'daily'}
-            days_in_year = calendar.isleap(year) and 366 or 365
-            for field, field_funct in map_funct.items():
-                year_item[field] = str(field_funct(year_records, days_in_year))
-            year_items.append(year_item)
-            for month, month_records in itertools.groupby(year_records, group_by_month):
-                month_records = list(month_records)
+    for station, station_states in itertools.groupby(decade_states, operator.itemgetter(0)):
+        for year, year_states in itertools.groupby(station_states, operator.itemgetter(1)):
+            months_states = []
+            for month, month_states in itertools.groupby(year_states, operator.itemgetter(2)):
+                decades_states = []
                 days_in_month = calendar.monthrange(year, month)[1]
-                data_i = datetime(year, month, days_in_month)
-                month_item = {
-                    'data_i': data_i, 'cod_staz': station,  'cod_aggr': 2, 'provenienza': 'daily'}
-                for field, field_funct in map_funct.items():
-                    month_item[field] = str(field_funct(month_records, days_in_month))
-                month_items.append(month_item)
-                for decade, dec_records in itertools.groupby(month_records, group_by_decade):
-                    dec_records = list(dec_records)
+                for _, _, _, decade, state in month_states:
                     if decade == 3:
                         data_i = datetime(year, month, days_in_month)
                         days_in_decade = days_in_month - 20
@@ -1076,12 +1478,32 @@ def compute_dma_records(table_records, field=None, field_funct=None, map_funct=N
                         days_in_decade = 10
                     decade_item = {'data_i': data_i, 'cod_staz': station, 'cod_aggr': 1,
                                    'provenienza': 'daily'}
-                    for field, field_funct in map_funct.items():
-                        decade_item[field] = str(field_funct(dec_records, days_in_decade))
+                    decade_item.update(aggregate(state, days_in_decade))
                     decade_items.append(decade_item)
-    data = year_items + month_items + decade_items
+                    decades_states.append(state)
+                month_state = merge(decades_states)
+                month_item = {'data_i': datetime(year, month, days_in_month), 'cod_staz': station,
+                              'cod_aggr': 2, 'provenienza': 'daily'}
+                month_item.update(aggregate(month_state, days_in_month))
+                month_items.append(month_item)
+                months_states.append(month_state)
+            days_in_year = calendar.isleap(year) and 366 or 365
+            year_item = {'data_i': datetime(year, 12, 31), 'cod_staz': station, 'cod_aggr': 3,
+                         'provenienza': 'daily'}
+            year_item.update(aggregate(merge(months_states), days_in_year))
+            year_items.append(year_item)
+    return year_items + month_items + decade_items
+
+
+def expand_dma_items(items):
+    """
+    Return the items expanded by `upsert.expand_record`, without the NULL values.
+
+    :param items: list of DMA items
+    :return: list of records of kind {'data_i': ...,'cod_staz': ..., 'cod_aggr': ..., ...}
+    """
     ret_value = []
-    for record in data:
+    for record in items:
         record = upsert.expand_record(record)
         record = {
             k: v for k, v in record.items()
@@ -1091,6 +1513,73 @@ def compute_dma_records(table_records, field=None, field_funct=None, map_funct=N
     return ret_value
 
 
+def compute_dma_records(table_records, field=None, field_funct=None, map_funct=None):
+    """
+    It return records of kind [{'data_i': ..., 'cod_staz': ...,  'cod_aggr': ...}, ...]
+    obtaining aggregating input records in decades, months and years.
+    Each output record has also some keys computed running some functions:
+    ::
+
+        record[field] = field_funct(aggregated_records, num_expected)
+
+    where field and field_funct are items of `map_funct`, and num_expected=number of total records
+    expected in the aggregation.
+    If map_funct is not set, map_funct = {`field`: `field_funct`}, otherwise `field` and
+    `field_funct` are ignored.
+    The functions in MERGEABLE_AGGREGATIONS are computed on a DmaSummary of each decade, and
+    the summaries are merged for months and years (sums of floats are exact, not left-folded).
+    It assumes input records are of kind (metadata, datetime object, par_code, par_value, flag).
+
+    :param table_records: input records
+    :param field: additional key to be set for output records
+    :param field_funct: function to be run to compute the value of key `field` for output records
+    :param map_funct: dictionary of fields and corresponding field_functions to be run
+    :return: list of records of kind {'data_i': ...,'cod_staz': ..., 'cod_aggr': ...,`field`: ...}
+    """
+    if map_funct is None:
+        map_funct = {field: field_funct}
+
+    # mergeable aggregations are computed on decades, and merged for months and years;
+    # the others are computed on the records of each decade, month and year.
+    mergeables = {f: MERGEABLE_AGGREGATIONS[funct] for f, funct in map_funct.items()
+                  if funct in MERGEABLE_AGGREGATIONS}
+    need_slices = len(mergeables) < len(map_funct)
+
+    def aggregate(state, num_expected):
+        records, summaries = state
+        values = dict()
+        for field, field_funct in map_funct.items():
+            if field in mergeables:
+                values[field] = mergeables[field].finalize(summaries[field], num_expected)
+            else:
+                values[field] = field_funct(records, num_expected)
+        return values
+
+    def merge(states):
+        records = []
+        if need_slices:
+            for state_records, _ in states:
+                records.extend(state_records)
+        summaries = {field: functools.reduce(lambda s1, s2: s1.merge(s2),
+                                             [summaries[field] for _, summaries in states])
+                     for field in mergeables}
+        return records, summaries
+
+    def group_by_decade(r):
+        day = r[1]
+        return r[0], day.year, day.month, day.day <= 10 and 1 or day.day <= 20 and 2 or 3
+
+    def decade_states():
+        for key, dec_records in itertools.groupby(table_records, group_by_decade):
+            dec_records = list(dec_records)
+            dec_summaries = {field: aggregation.summarize(dec_records)
+                             for field, aggregation in mergeables.items()}
+            yield key + ((dec_records, dec_summaries), )
+
+    data = aggregate_dma_periods(decade_states(), aggregate, merge)
+    return expand_dma_items(data)
+
+
 def compute_year_records(table_records, field=None, field_funct=None, map_funct=None):
     """
     The same of compute_dma_records but only grouping by year.
@@ -1116,21 +1605,332 @@ def compute_year_records(table_records, field=None, field_funct=None, map_funct=
                 'data_i': data_i, 'cod_staz': station, 'cod_aggr': 3, 'provenienza': 'daily'}
             days_in_year = calendar.isleap(year) and 366 or 365
             for field, field_funct in map_funct.items():
-                year_item[field] = str(field_funct(year_records, days_in_year))
+                year_item[field] = field_funct(year_records, days_in_year)
             year_items.append(year_item)
-    data = year_items
-    ret_value = []
-    for record in data:
-        record = upsert.expand_record(record)
-        record = {
-            k: v for k, v in record.items()
-            if v not in (None, 'NULL') and list(filter(lambda r: utils.is_float(r), str(v)))
-        }
-        ret_value.append(record)
-    return ret_value
+    return expand_dma_items(year_items)
 
 
-def process_dma_bagnatura(conn, startschema, targetschema, policy, stations_ids, logger):
+def first_value_finalize(finalize_funct):
+    """
+    Return a finalize function of the summaries of `select_dma_states` that runs
+    `finalize_funct` on the summary of the first value.
+    """
+    return lambda summaries, num_expected: finalize_funct(summaries[1], num_expected)
+
+
+def finalize_press_states(summaries, num_expected, at_least_perc=0.75):
+    """finalize of `compute_press` from the summaries of `select_dma_states`"""
+    flag_summary, pmedia, pmax, pmin = summaries
+    if not pmedia.count and not pmax.count and not pmin.count:
+        return (None, None), None, None, None, None
+    flag = flag_summary.flag(at_least_perc, num_expected)
+    val_md = val_vr = val_mx = val_mn = None
+    if pmedia.count:
+        val_md = round_value(pmedia.mean())
+        val_mx = round_value(pmedia.mx)
+        val_mn = round_value(pmedia.mn)
+        if pmedia.count >= 2:
+            val_vr = round_value(pmedia.stdev())
+    if pmax.count:
+        val_mx = round_value(pmax.mx)
+    if pmin.count:
+        val_mn = round_value(pmin.mn)
+    return flag, val_md, val_vr, val_mx, val_mn
+
+
+def finalize_ur_states(summaries, num_expected, at_least_perc=0.75):
+    """finalize of `compute_ur` from the summaries of `select_dma_states`"""
+    flag_summary, urmedia, urmax, urmin = summaries
+    if not urmedia.count and not urmax.count and not urmin.count:
+        return (None, None), None, None, None, None, None
+    flag = flag1 = flag_summary.flag(at_least_perc, num_expected)
+    val_md = val_vr = val_mx = val_mn = None
+    if urmedia.count:
+        val_md = round_value(urmedia.mean())
+        if urmedia.count >= 2:
+            val_vr = round_value(urmedia.stdev())
+    if urmax.count:
+        val_mx = round_value(urmax.mx)
+    if urmin.count:
+        val_mn = round_value(urmin.mn)
+    return flag, val_md, val_vr, flag1, val_mx, val_mn
+
+
+def finalize_grgg_states(summaries, num_expected, at_least_perc=0.75):
+    """finalize of `compute_grgg` from the summaries of `select_dma_states`"""
+    flag_summary = summaries[0]
+    if not flag_summary.count:
+        return (None, None), None, None, None, None, None
+    flag = flag_summary.flag(at_least_perc, num_expected)
+    totals = [s.count and round_value(s.mean()) or None for s in summaries[1:]]
+    return (flag, ) + tuple(totals)
+
+
+def select_dma_states(conn, table, schema, values, flag, stations_ids=None, where_sql=None,
+                      where_params=None):
+    """
+    Select the partial states of the values `values` of the table `table` aggregated
+    in SQL for each station and decade. It yields records of kind
+    (cod_staz, year, month, decade, summaries), where summaries is a list of DmaSummary
+    objects: the first one counts the records with `flag` > 0, the others are the summaries
+    of each value, not NULL and with `flag` > 0.
+
+    :param conn: db connection object
+    :param table: table name where to select
+    :param schema: database schema to consider
+    :param values: list of sql expressions of the values
+    :param flag: sql expression of the validity flag
+    :param stations_ids: list of station ids (if None: no filter by station)
+    :param where_sql: if not None, add the selected where clause in sql
+    :param where_params: dictionary of the parameters bound in `where_sql`
+    :return: the iterable of the partial states
+    """
+    conn_r = db_utils.get_safe_memory_read_connection(conn)
+    stations_where, params = db_utils.stations_filter(conn_r, stations_ids)
+    if where_sql:
+        stations_where += ' AND %s' % where_sql
+        params.update(where_params or {})
+    valid = '(%s) > 0' % flag
+    sql_fields = ['count(*) FILTER (WHERE %s)' % valid]
+    for value in values:
+        condition = '%s AND (%s) IS NOT NULL' % (valid, value)
+        for aggr_sql in ('count(%s)', 'sum(%s)', 'sum((%s) * (%s))', 'max(%s)', 'min(%s)'):
+            aggr_sql = aggr_sql.replace('%s', value)
+            sql_fields.append('%s FILTER (WHERE %s)' % (aggr_sql, condition))
+    sql = """
+    SELECT cod_staz, date_part('year', data_i)::integer, date_part('month', data_i)::integer,
+           CASE WHEN date_part('day', data_i) <= 10 THEN 1
+                WHEN date_part('day', data_i) <= 20 THEN 2
+                ELSE 3 END,
+           %s
+    FROM %s.%s
+    WHERE %s
+    GROUP BY 1, 2, 3, 4
+    ORDER BY 1, 2, 3, 4""" % (', '.join(sql_fields), schema, table, stations_where)
+    for row in conn_r.execute(sql, **params):
+        summaries = [DmaSummary.from_partials(row[4])]
+        for index in range(5, len(row), 5):
+            summaries.append(DmaSummary.from_partials(*row[index:index+5]))
+        yield row[0], row[1], row[2], row[3], summaries
+
+
+def compute_dma_records_from_states(states_records, field, finalize_funct):
+    """
+    The same of compute_dma_records but computing the value of `field` from the
+    partial states of the decades selected by `select_dma_states`: the states of the
+    months and years are the merge of the states of their decades.
+
+    :param states_records: iterable of records of kind (cod_staz, year, month, decade, summaries)
+    :param field: key to be set for output records
+    :param finalize_funct: function (summaries, num_expected) -> value of `field`
+    :return: list of records of kind {'data_i': ...,'cod_staz': ..., 'cod_aggr': ...,`field`: ...}
+    """
+    def merge(states_list):
+        return [functools.reduce(lambda s1, s2: s1.merge(s2), summaries)
+                for summaries in zip(*states_list)]
+
+    def aggregate(summaries, num_expected):
+        return {field: finalize_funct(summaries, num_expected)}
+
+    data = aggregate_dma_periods(states_records, aggregate, merge)
+    return expand_dma_items(data)
+
+
+# name of the table of the changes of the DMA source tables (see `create_dma_changes_log`)
+DMA_CHANGES_TABLE = 'dma_changes'
+# tables of the start schema read by the process_dma_* functions
+DMA_SOURCE_TABLES = ('ds__bagna', 'ds__delta_idro', 'ds__elio', 'ds__etp', 'ds__grgg',
+                     'ds__preci', 'ds__press', 'ds__radglob', 'ds__t200', 'ds__urel', 'ds__vnt10')
+
+
+def create_dma_changes_log(conn, schema):
+    """
+    Create (if not existing) the table DMA_CHANGES_TABLE in the schema `schema` and the
+    triggers that log on it the (cod_staz, data_i) of each record inserted, updated or
+    deleted in the DMA_SOURCE_TABLES of the same schema.
+
+    :param conn: db connection object
+    :param schema: db schema of the source tables
+    """
+    sql = """
+    CREATE TABLE IF NOT EXISTS %(schema)s.%(changes)s (
+        id bigserial PRIMARY KEY,
+        table_name varchar NOT NULL,
+        cod_staz integer NOT NULL,
+        data_i timestamp NOT NULL
+    );
+    CREATE OR REPLACE FUNCTION %(schema)s.log_%(changes)s() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND
+                (OLD.cod_staz, OLD.data_i) IS DISTINCT FROM (NEW.cod_staz, NEW.data_i)) THEN
+            INSERT INTO %(schema)s.%(changes)s (table_name, cod_staz, data_i)
+            VALUES (TG_TABLE_NAME, OLD.cod_staz, OLD.data_i);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO %(schema)s.%(changes)s (table_name, cod_staz, data_i)
+            VALUES (TG_TABLE_NAME, NEW.cod_staz, NEW.data_i);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """ % {'schema': schema, 'changes': DMA_CHANGES_TABLE}
+    for table in DMA_SOURCE_TABLES:
+        sql += """
+    DROP TRIGGER IF EXISTS %(changes)s_trigger ON %(schema)s.%(table)s;
+    CREATE TRIGGER %(changes)s_trigger AFTER INSERT OR UPDATE OR DELETE
+        ON %(schema)s.%(table)s FOR EACH ROW EXECUTE PROCEDURE %(schema)s.log_%(changes)s();
+    """ % {'schema': schema, 'changes': DMA_CHANGES_TABLE, 'table': table}
+    conn.execute(sql)
+
+
+def load_dma_changes(conn, schema, stations_ids=None):
+    """
+    Return (change_ids, changes) where changes is a dictionary {table name: set of
+    (cod_staz, data_i)} of the records changed in the DMA source tables of schema `schema`
+    (only of the stations `stations_ids`, if not None) and change_ids is the list of the
+    ids of the changes read (None if the changes log doesn't exist).
+
+    :param conn: db connection object
+    :param schema: db schema of the source tables
+    :param stations_ids: list of station ids to consider (if None: no filter by station)
+    :return: (change_ids, changes)
+    """
+    changes = collections.defaultdict(set)
+    exists = conn.execute("SELECT to_regclass(%(table)s)",
+                          table='%s.%s' % (schema, DMA_CHANGES_TABLE)).scalar()
+    if not exists:
+        return None, changes
+    change_ids = []
+    sql = "SELECT id, table_name, cod_staz, data_i FROM %s.%s" % (schema, DMA_CHANGES_TABLE)
+    params = dict()
+    if stations_ids is not None:
+        sql += " WHERE cod_staz = ANY(%(stations_ids)s)"
+        params['stations_ids'] = [int(s) for s in stations_ids]
+    for change_id, table_name, cod_staz, data_i in conn.execute(sql, **params):
+        change_ids.append(change_id)
+        changes[table_name].add((cod_staz, data_i))
+    return change_ids, changes
+
+
+def clear_dma_changes(conn, schema, change_ids):
+    """
+    Delete from the changes log of schema `schema` the changes with id in `change_ids`.
+    Changes logged after `load_dma_changes` are kept, even if they have a lower id.
+
+    :param conn: db connection object
+    :param schema: db schema of the source tables
+    :param change_ids: list of the ids of the changes processed
+    """
+    sql = "DELETE FROM %s.%s WHERE id = ANY(%%(change_ids)s)" % (schema, DMA_CHANGES_TABLE)
+    conn.execute(sql, change_ids=list(change_ids))
+
+
+def dma_buckets(cod_staz, day):
+    """
+    Return the keys (cod_staz, cod_aggr, data_i) of the decade, month and year including
+    the day `day`, as computed by `compute_dma_records`.
+
+    :param cod_staz: the station id
+    :param day: the datetime object of the day
+    :return: list of the 3 keys
+    """
+    days_in_month = calendar.monthrange(day.year, day.month)[1]
+    if day.day <= 20:
+        decade_day = day.day <= 10 and 10 or 20
+    else:
+        decade_day = days_in_month
+    return [(cod_staz, 1, datetime(day.year, day.month, decade_day)),
+            (cod_staz, 2, datetime(day.year, day.month, days_in_month)),
+            (cod_staz, 3, datetime(day.year, 12, 31))]
+
+
+def changed_selection(changes, tables, stations_ids):
+    """
+    Return (stations_ids, where_sql, where_params, buckets) to select and update only the
+    DMA records affected by the changes of the source tables `tables`: the stations changed,
+    the SQL condition (and its bound parameters) of the years changed for each station and
+    the set of keys (cod_staz, cod_aggr, data_i) of the affected decades, months and years.
+    If `changes` is None, it returns (stations_ids, None, None, None) (no filtering).
+
+    :param changes: dictionary {table name: set of (cod_staz, data_i)} (see `load_dma_changes`)
+    :param tables: source tables of the DMA records
+    :param stations_ids: list of station ids to consider
+    :return: (stations_ids, where_sql, where_params, buckets)
+    """
+    if changes is None:
+        return stations_ids, None, None, None
+    changed = set()
+    for table in tables:
+        changed.update(changes.get(table, ()))
+    if stations_ids is not None:
+        stations_ids = set(stations_ids)
+        changed = {c for c in changed if c[0] in stations_ids}
+    station_years = sorted({(cod_staz, day.year) for cod_staz, day in changed})
+    if not station_years:
+        return [], None, None, set()
+    where_sql = "(cod_staz, date_part('year', data_i)::integer) IN " \
+                "(SELECT * FROM unnest(%(changed_stations)s::integer[], " \
+                "%(changed_years)s::integer[]))"
+    where_params = {
+        'changed_stations': [int(s) for s, y in station_years],
+        'changed_years': [int(y) for s, y in station_years],
+    }
+    buckets = set()
+    for cod_staz, day in changed:
+        buckets.update(dma_buckets(cod_staz, day))
+    return sorted({s for s, y in station_years}), where_sql, where_params, buckets
+
+
+def filter_buckets(data, buckets):
+    """
+    Return the records of `data` whose key (cod_staz, cod_aggr, data_i) is in `buckets`
+    (all the records if `buckets` is None).
+
+    :param data: list of DMA records
+    :param buckets: set of keys (cod_staz, cod_aggr, data_i), or None
+    :return: list of DMA records
+    """
+    if buckets is None:
+        return data
+    return [r for r in data if (r['cod_staz'], r['cod_aggr'], r['data_i']) in buckets]
+
+
+def delete_missing_buckets(conn, table_name, schema, data, buckets, stations_ids=None):
+    """
+    Delete from the table `table_name` of schema `schema` the DMA records (with
+    provenienza 'DAILY') of the keys (cod_staz, cod_aggr, data_i) in `buckets` that are not
+    in `data`, i.e. of the decades, months and years whose source records were all deleted.
+    If `stations_ids` is not None, only the buckets of these stations are considered.
+    Nothing is done if `buckets` is None.
+
+    :param conn: db connection object
+    :param table_name: name of the table of the DMA records
+    :param schema: db schema of the table
+    :param data: list of the DMA records computed
+    :param buckets: set of keys (cod_staz, cod_aggr, data_i), or None
+    :param stations_ids: list of station ids to consider (if None: no filter by station)
+    :return: the number of buckets to delete
+    """
+    if not buckets:
+        return 0
+    computed = {(r['cod_staz'], r['cod_aggr'], r['data_i']) for r in data}
+    missing = buckets - computed
+    if stations_ids is not None:
+        stations_ids = set(stations_ids)
+        missing = {b for b in missing if b[0] in stations_ids}
+    if not missing:
+        return 0
+    missing = sorted(missing)
+    sql = "DELETE FROM %s.%s WHERE provenienza = 'DAILY' AND (cod_staz, cod_aggr, data_i) IN " \
+          "(SELECT * FROM unnest(%%(missing_stations)s::integer[], " \
+          "%%(missing_aggrs)s::integer[], %%(missing_days)s::timestamp[]))" % (schema, table_name)
+    conn.execute(sql, missing_stations=[int(b[0]) for b in missing],
+                 missing_aggrs=[b[1] for b in missing], missing_days=[b[2] for b in missing])
+    return len(missing)
+
+
+def process_dma_bagnatura(conn, startschema, targetschema, policy, stations_ids, logger,
+                          changes=None, pushdown=False):
     """
     process the compute and update of DMA data for table of bagnatura fogliare
 
@@ -1140,17 +1940,32 @@ def process_dma_bagnatura(conn, startschema, targetschema, policy, stations_ids,
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
+    :param pushdown: if True, aggregate the decades in the database
     """
     logger.info('starting process DMA bagnatura fogliare')
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, ['ds__bagna'], stations_ids)
     logger.info('select for input records...')
     # records are: (metadata, datetime object, par_code, par_value, flag)
     sql_fields = "cod_staz, data_i, '%s', (%s).%s, ((%s).flag).wht" \
                  % ('bagna', 'bagna', 'val_md', 'bagna')
-    table_records = querying.select_records(
-        conn, 'ds__bagna', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-        schema=startschema)
-    logger.info('computing aggregations...')
-    data = compute_dma_records(table_records, 'bagna', compute_bagna)
+    if pushdown:
+        logger.info('computing aggregations in the database...')
+        values = ['(bagna).val_md']
+        states = select_dma_states(
+            conn, 'ds__bagna', startschema, values, '((bagna).flag).wht', stations_ids,
+            where_sql, where_params)
+        data = compute_dma_records_from_states(
+            states, 'bagna', first_value_finalize(finalize_bagna))
+    else:
+        table_records = querying.select_records(
+            conn, 'ds__bagna', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
+            schema=startschema, where_sql=where_sql, where_params=where_params)
+        logger.info('computing aggregations...')
+        data = compute_dma_records(table_records, 'bagna', compute_bagna)
+    data = filter_buckets(data, buckets)
+    delete_missing_buckets(conn, 'ds__bagna', targetschema, data, buckets)
     logger.info('setting provenienza="DAILY" for the resulting records...')
     for record in data:
         record['provenienza'] = 'DAILY'
@@ -1163,7 +1978,8 @@ def process_dma_bagnatura(conn, startschema, targetschema, policy, stations_ids,
     logger.info('end process DMA bagnatura fogliare')
 
 
-def process_dma_bilancio_idrico(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_bilancio_idrico(conn, startschema, targetschema, policy, stations_ids, logger,
+                                changes=None, pushdown=False):
     """
     process the compute and update of DMA data for table containing bilancio idrico
 
@@ -1173,17 +1989,32 @@ def process_dma_bilancio_idrico(conn, startschema, targetschema, policy, station
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
+    :param pushdown: if True, aggregate the decades in the database
     """
     logger.info('starting process DMA bilancio idrico')
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, ['ds__delta_idro'], stations_ids)
     logger.info('select for input records...')
     # records are: (metadata, datetime object, par_code, par_value, flag)
     sql_fields = "cod_staz, data_i, '%s', (%s).%s, ((%s).flag).wht" \
                  % ('deltaidro', 'deltaidro', 'val_md', 'deltaidro')
-    table_records = querying.select_records(
-        conn, 'ds__delta_idro', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-        schema=startschema)
-    logger.info('computing aggregations...')
-    data = compute_dma_records(table_records, 'deltaidro', compute_deltaidro)
+    if pushdown:
+        logger.info('computing aggregations in the database...')
+        values = ['(deltaidro).val_md']
+        states = select_dma_states(
+            conn, 'ds__delta_idro', startschema, values, '((deltaidro).flag).wht', stations_ids,
+            where_sql, where_params)
+        data = compute_dma_records_from_states(
+            states, 'deltaidro', first_value_finalize(finalize_md_vr_mx_mn))
+    else:
+        table_records = querying.select_records(
+            conn, 'ds__delta_idro', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
+            schema=startschema, where_sql=where_sql, where_params=where_params)
+        logger.info('computing aggregations...')
+        data = compute_dma_records(table_records, 'deltaidro', compute_deltaidro)
+    data = filter_buckets(data, buckets)
+    delete_missing_buckets(conn, 'ds__delta_idro', targetschema, data, buckets)
     logger.info('setting provenienza="DAILY" for the resulting records...')
     for record in data:
         record['provenienza'] = 'DAILY'
@@ -1196,7 +2027,8 @@ def process_dma_bilancio_idrico(conn, startschema, targetschema, policy, station
     logger.info('end process DMA bilancio idrico')
 
 
-def process_dma_eliofania(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_eliofania(conn, startschema, targetschema, policy, stations_ids, logger,
+                          changes=None, pushdown=False):
     """
     process the compute and update of DMA data for table of eliofania
 
@@ -1206,17 +2038,31 @@ def process_dma_eliofania(conn, startschema, targetschema, policy, stations_ids,
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
+    :param pushdown: if True, aggregate the decades in the database
     """
     logger.info('starting process DMA eliofania')
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, ['ds__elio'], stations_ids)
     logger.info('select for input records...')
     # records are: (metadata, datetime object, par_code, par_value, flag)
     sql_fields = "cod_staz, data_i, '%s', (%s).%s, ((%s).flag).wht" \
                  % ('elio', 'elio', 'val_md', 'elio')
-    table_records = querying.select_records(
-        conn, 'ds__elio', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-        schema=startschema)
-    logger.info('computing aggregations...')
-    data = compute_dma_records(table_records, 'elio', compute_elio)
+    if pushdown:
+        logger.info('computing aggregations in the database...')
+        values = ['(elio).val_md']
+        states = select_dma_states(
+            conn, 'ds__elio', startschema, values, '((elio).flag).wht', stations_ids,
+            where_sql, where_params)
+        data = compute_dma_records_from_states(states, 'elio', first_value_finalize(finalize_elio))
+    else:
+        table_records = querying.select_records(
+            conn, 'ds__elio', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
+            schema=startschema, where_sql=where_sql, where_params=where_params)
+        logger.info('computing aggregations...')
+        data = compute_dma_records(table_records, 'elio', compute_elio)
+    data = filter_buckets(data, buckets)
+    delete_missing_buckets(conn, 'ds__elio', targetschema, data, buckets)
     logger.info('setting provenienza="DAILY" for the resulting records...')
     for record in data:
         record['provenienza'] = 'DAILY'
@@ -1229,7 +2075,8 @@ def process_dma_eliofania(conn, startschema, targetschema, policy, stations_ids,
     logger.info('end process DMA eliofania')
 
 
-def process_dma_radiazione_globale(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_radiazione_globale(conn, startschema, targetschema, policy, stations_ids, logger,
+                                   changes=None, pushdown=False):
     """
     process the compute and update of DMA data for table of radiazione globale
 
@@ -1239,17 +2086,32 @@ def process_dma_radiazione_globale(conn, startschema, targetschema, policy, stat
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
+    :param pushdown: if True, aggregate the decades in the database
     """
     logger.info('starting process DMA radiazione globale')
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, ['ds__radglob'], stations_ids)
     logger.info('select for input records...')
     # records are: (metadata, datetime object, par_code, par_value, flag)
     sql_fields = "cod_staz, data_i, '%s', (%s).%s, ((%s).flag).wht" \
                  % ('radglob', 'radglob', 'val_md', 'radglob')
-    table_records = querying.select_records(
-        conn, 'ds__radglob', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-        schema=startschema)
-    logger.info('computing aggregations...')
-    data = compute_dma_records(table_records, 'radglob', compute_radglob)
+    if pushdown:
+        logger.info('computing aggregations in the database...')
+        values = ['(radglob).val_md']
+        states = select_dma_states(
+            conn, 'ds__radglob', startschema, values, '((radglob).flag).wht', stations_ids,
+            where_sql, where_params)
+        data = compute_dma_records_from_states(
+            states, 'radglob', first_value_finalize(finalize_md_vr_mx_mn))
+    else:
+        table_records = querying.select_records(
+            conn, 'ds__radglob', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
+            schema=startschema, where_sql=where_sql, where_params=where_params)
+        logger.info('computing aggregations...')
+        data = compute_dma_records(table_records, 'radglob', compute_radglob)
+    data = filter_buckets(data, buckets)
+    delete_missing_buckets(conn, 'ds__radglob', targetschema, data, buckets)
     logger.info('setting provenienza="DAILY" for the resulting records...')
     for record in data:
         record['provenienza'] = 'DAILY'
@@ -1262,7 +2124,8 @@ def process_dma_radiazione_globale(conn, startschema, targetschema, policy, stat
     logger.info('end process DMA radiazione globale')
 
 
-def process_dma_evapotraspirazione(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_evapotraspirazione(conn, startschema, targetschema, policy, stations_ids, logger,
+                                   changes=None, pushdown=False):
     """
     process the compute and update of DMA data for table of evapotraspirazione
 
@@ -1272,17 +2135,32 @@ def process_dma_evapotraspirazione(conn, startschema, targetschema, policy, stat
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
+    :param pushdown: if True, aggregate the decades in the database
     """
     logger.info('starting process DMA evapotraspirazione')
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, ['ds__etp'], stations_ids)
     logger.info('select for input records...')
     # records are: (metadata, datetime object, par_code, par_value, flag)
     sql_fields = "cod_staz, data_i, '%s', (%s).%s, ((%s).flag).wht" \
                  % ('etp', 'etp', 'val_md', 'etp')
-    table_records = querying.select_records(
-        conn, 'ds__etp', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-        schema=startschema)
-    logger.info('computing aggregations...')
-    data = compute_dma_records(table_records, 'etp', compute_etp)
+    if pushdown:
+        logger.info('computing aggregations in the database...')
+        values = ['(etp).val_md']
+        states = select_dma_states(
+            conn, 'ds__etp', startschema, values, '((etp).flag).wht', stations_ids,
+            where_sql, where_params)
+        data = compute_dma_records_from_states(
+            states, 'etp', first_value_finalize(finalize_md_vr_mx_mn))
+    else:
+        table_records = querying.select_records(
+            conn, 'ds__etp', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
+            schema=startschema, where_sql=where_sql, where_params=where_params)
+        logger.info('computing aggregations...')
+        data = compute_dma_records(table_records, 'etp', compute_etp)
+    data = filter_buckets(data, buckets)
+    delete_missing_buckets(conn, 'ds__etp', targetschema, data, buckets)
     logger.info('setting provenienza="DAILY" for the resulting records...')
     for record in data:
         record['provenienza'] = 'DAILY'
@@ -1295,7 +2173,8 @@ def process_dma_evapotraspirazione(conn, startschema, targetschema, policy, stat
     logger.info('end process DMA evapotraspirazione')
 
 
-def process_dma_gradi_giorno(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_gradi_giorno(conn, startschema, targetschema, policy, stations_ids, logger,
+                             changes=None, pushdown=False):
     """
     process the compute and update of DMA data for table of gradi giorno
 
@@ -1305,18 +2184,32 @@ def process_dma_gradi_giorno(conn, startschema, targetschema, policy, stations_i
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
+    :param pushdown: if True, aggregate the decades in the database
     """
     logger.info('starting process DMA gradi giorno')
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, ['ds__grgg'], stations_ids)
     logger.info('selecting for input records...')
     # records are: (metadata, datetime object, par_code, par_value, flag)
     subfields = ['tot00', 'tot05', 'tot10', 'tot15', 'tot21']
     array_field = 'ARRAY[' + ','.join(['(%s).%s' % ('grgg', s) for s in subfields]) + ']'
     sql_fields = "cod_staz, data_i, '%s', %s, ((%s).flag).wht" % ('grgg', array_field, 'grgg')
-    table_records = querying.select_records(
-        conn, 'ds__grgg', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-        schema=startschema)
-    logger.info('computing aggregations...')
-    data = compute_dma_records(table_records, 'grgg', compute_grgg)
+    if pushdown:
+        logger.info('computing aggregations in the database...')
+        values = ['(grgg).%s' % s for s in subfields]
+        states = select_dma_states(
+            conn, 'ds__grgg', startschema, values, '((grgg).flag).wht', stations_ids,
+            where_sql, where_params)
+        data = compute_dma_records_from_states(states, 'grgg', finalize_grgg_states)
+    else:
+        table_records = querying.select_records(
+            conn, 'ds__grgg', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
+            schema=startschema, where_sql=where_sql, where_params=where_params)
+        logger.info('computing aggregations...')
+        data = compute_dma_records(table_records, 'grgg', compute_grgg)
+    data = filter_buckets(data, buckets)
+    delete_missing_buckets(conn, 'ds__grgg', targetschema, data, buckets)
     logger.info('setting provenienza="DAILY" for the resulting records...')
     for record in data:
         record['provenienza'] = 'DAILY'
@@ -1329,7 +2222,8 @@ def process_dma_gradi_giorno(conn, startschema, targetschema, policy, stations_i
     logger.info('end process DMA gradi giorno')
 
 
-def process_dma_pressione(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_pressione(conn, startschema, targetschema, policy, stations_ids, logger,
+                          changes=None, pushdown=False):
     """
     process the compute and update of DMA data for table of pressione
 
@@ -1339,18 +2233,33 @@ def process_dma_pressione(conn, startschema, targetschema, policy, stations_ids,
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
+    :param pushdown: if True, aggregate the decades in the database
     """
     logger.info('starting process DMA pressione atmosferica')
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, ['ds__press'], stations_ids)
     logger.info('selecting for input records...')
     # records are: (metadata, datetime object, par_code, par_value, flag)
     subfields = ['val_md', 'val_vr', 'val_mx', 'val_mn']
     array_field = 'ARRAY[' + ','.join(['(%s).%s' % ('press', s) for s in subfields]) + ']'
     sql_fields = "cod_staz, data_i, '%s', %s, ((%s).flag).wht" % ('press', array_field, 'press')
-    table_records = querying.select_records(
-        conn, 'ds__press', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-        schema=startschema)
-    logger.info('computing aggregations...')
-    data = compute_dma_records(table_records, 'press', compute_press)
+    if pushdown:
+        logger.info('computing aggregations in the database...')
+        # as in compute_press, the values are the first 3 items of the array
+        values = ['(press).%s' % s for s in subfields[:3]]
+        states = select_dma_states(
+            conn, 'ds__press', startschema, values, '((press).flag).wht', stations_ids,
+            where_sql, where_params)
+        data = compute_dma_records_from_states(states, 'press', finalize_press_states)
+    else:
+        table_records = querying.select_records(
+            conn, 'ds__press', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
+            schema=startschema, where_sql=where_sql, where_params=where_params)
+        logger.info('computing aggregations...')
+        data = compute_dma_records(table_records, 'press', compute_press)
+    data = filter_buckets(data, buckets)
+    delete_missing_buckets(conn, 'ds__press', targetschema, data, buckets)
     logger.info('setting provenienza="DAILY" for the resulting records...')
     for record in data:
         record['provenienza'] = 'DAILY'
@@ -1363,7 +2272,8 @@ def process_dma_pressione(conn, startschema, targetschema, policy, stations_ids,
     logger.info('end process DMA pressione atmosferica')
 
 
-def process_dma_umidita_relativa(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_umidita_relativa(conn, startschema, targetschema, policy, stations_ids, logger,
+                                 changes=None, pushdown=False):
     """
     process the compute and update of DMA data for table of umidità relativa
 
@@ -1373,18 +2283,33 @@ def process_dma_umidita_relativa(conn, startschema, targetschema, policy, statio
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
+    :param pushdown: if True, aggregate the decades in the database
     """
     logger.info('starting process DMA umidità relativa')
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, ['ds__urel'], stations_ids)
     logger.info('selecting for input records...')
     # records are: (metadata, datetime object, par_code, par_value, flag)
     subfields = ['val_md', 'val_vr', 'val_mx', 'val_mn']
     array_field = 'ARRAY[' + ','.join(['(%s).%s' % ('ur', s) for s in subfields]) + ']'
     sql_fields = "cod_staz, data_i, '%s', %s, ((%s).flag).wht" % ('ur', array_field, 'ur')
-    table_records = querying.select_records(
-        conn, 'ds__urel', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-        schema=startschema)
-    logger.info('computing aggregations...')
-    data = compute_dma_records(table_records, 'ur', compute_ur)
+    if pushdown:
+        logger.info('computing aggregations in the database...')
+        # as in compute_ur, the values are the items 0, 2 and 3 of the array
+        values = ['(ur).%s' % s for s in ('val_md', 'val_mx', 'val_mn')]
+        states = select_dma_states(
+            conn, 'ds__urel', startschema, values, '((ur).flag).wht', stations_ids,
+            where_sql, where_params)
+        data = compute_dma_records_from_states(states, 'ur', finalize_ur_states)
+    else:
+        table_records = querying.select_records(
+            conn, 'ds__urel', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
+            schema=startschema, where_sql=where_sql, where_params=where_params)
+        logger.info('computing aggregations...')
+        data = compute_dma_records(table_records, 'ur', compute_ur)
+    data = filter_buckets(data, buckets)
+    delete_missing_buckets(conn, 'ds__urel', targetschema, data, buckets)
     logger.info('setting provenienza="DAILY" for the resulting records...')
     for record in data:
         record['provenienza'] = 'DAILY'
@@ -1398,7 +2323,8 @@ def process_dma_umidita_relativa(conn, startschema, targetschema, policy, statio
     logger.info('end process DMA umidità relativa')
 
 
-def process_dma_bioclimatologia(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_bioclimatologia(conn, startschema, targetschema, policy, stations_ids, logger,
+                                changes=None):
     """
     process the compute and update of DMA data for table of bioclimatologia
 
@@ -1408,20 +2334,26 @@ def process_dma_bioclimatologia(conn, startschema, targetschema, policy, station
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
     """
     conn_r = db_utils.get_safe_memory_read_connection(conn)
     logger.info('starting process DMA bioclimatologia')
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, ['ds__t200', 'ds__urel'], stations_ids)
     logger.info('selecting for input records...')
-    station_ids_tuple = '(%s)' % repr(stations_ids)[1:-1]
+    stations_where, params = db_utils.stations_filter(conn_r, stations_ids)
+    if where_sql:
+        stations_where += ' AND %s' % where_sql
+        params.update(where_params)
     # records are: (metadata, datetime object, par_code, par_value, flag)
     sql = """
     SELECT cod_staz, data_i, '', ARRAY[(tmdgg1).val_md, (ur).val_md], 
             ((tmdgg1).flag).wht>0 AND ((ur).flag).wht>0 
     FROM %s.ds__t200 JOIN %s.ds__urel USING (cod_staz, data_i)
     WHERE (tmdgg1).val_md IS NOT NULL AND (ur).val_md IS NOT NULL
-    AND cod_staz in %s
-    ORDER BY cod_staz, data_i""" % (startschema, startschema, station_ids_tuple)
-    table_records = conn_r.execute(sql)
+    AND %s
+    ORDER BY cod_staz, data_i""" % (startschema, startschema, stations_where)
+    table_records = conn_r.execute(sql, **params)
     map_funct = {
         'ifs': compute_ifs,
         'ifu': compute_ifu,
@@ -1432,6 +2364,8 @@ def process_dma_bioclimatologia(conn, startschema, targetschema, policy, station
     }
     logger.info('computing aggregations...')
     data = compute_dma_records(table_records, map_funct=map_funct)
+    data = filter_buckets(data, buckets)
+    delete_missing_buckets(conn, 'ds__bioclima', targetschema, data, buckets)
     fields = upsert.expand_fields(
         ['data_i', 'cod_staz', 'cod_aggr', 'provenienza'] + list(map_funct.keys()))
     logger.info('setting provenienza="DAILY" for the resulting records...')
@@ -1445,7 +2379,99 @@ def process_dma_bioclimatologia(conn, startschema, targetschema, policy, station
     logger.info('end process DMA bioclimatologia')
 
 
-def process_dma_precipitazione(conn, startschema, targetschema, policy, stations_ids, logger):
+def compute_dma_aggregations(table_records, aggregators, accumulators=None):
+    """
+    Compute in a single pass over `table_records` the aggregations of all the `aggregators`.
+    Input records are grouped by station (at index 0), and the records of each station
+    are fanned out to every aggregator. If `accumulators` is not None, the output records
+    of each aggregator are written directly in the DmaAccumulator accumulators[name].
+    Each aggregator is a tuple (name, record_funct, compute_funct, map_funct) where:
+    ::
+
+    * record_funct: function that maps an input record to a record of kind
+      (cod_staz, datetime object, par_code, par_value, flag)
+    * compute_funct: `compute_dma_records` or `compute_year_records`
+    * map_funct: dictionary of fields and corresponding field_functions to be run
+
+    :param table_records: input records, sorted by station and date
+    :param aggregators: list of aggregators
+    :param accumulators: dictionary {aggregator name: DmaAccumulator object}
+    :return: dictionary {aggregator name: list of output records} (or `accumulators`)
+    """
+    if accumulators is None:
+        ret_value = {aggregator[0]: [] for aggregator in aggregators}
+    else:
+        ret_value = accumulators
+    group_by_station = operator.itemgetter(0)
+    for station, station_records in itertools.groupby(table_records, group_by_station):
+        station_records = list(station_records)
+        for name, record_funct, compute_funct, map_funct in aggregators:
+            records = [record_funct(r) for r in station_records]
+            output_records = compute_funct(records, map_funct=map_funct)
+            if accumulators is None:
+                ret_value[name].extend(output_records)
+            else:
+                accumulators[name].add(output_records)
+    return ret_value
+
+
+def process_dma_family(conn, source_table, sql_fields, aggregators, targets, startschema,
+                       targetschema, policy, stations_ids, logger,
+                       batch_size=DMA_STATIONS_BATCH_SIZE, changes=None):
+    """
+    Process the compute and update of DMA data for the aggregations that share the same
+    source table `source_table`. The source table is read only once for each batch of
+    stations, and the results of the aggregators are merged in a DmaAccumulator for each
+    target table and upserted.
+    Each target is a tuple (table name, list of aggregator names, list of fields).
+
+    :param conn: db connection object
+    :param source_table: name of the table of the input records
+    :param sql_fields: sql string of field selection of the input records
+    :param aggregators: list of aggregators (see `compute_dma_aggregations`)
+    :param targets: list of targets
+    :param startschema: db start schema
+    :param targetschema: db target schema
+    :param policy: onlyinsert or upsert
+    :param stations_ids: list of station ids to consider
+    :param logger: logging object for function reporting
+    :param batch_size: number of stations to process at once
+    :param changes: if not None, process only the changes of `load_dma_changes`
+    """
+    stations_ids, where_sql, where_params, buckets = changed_selection(
+        changes, [source_table], stations_ids)
+    if stations_ids is None:
+        stations_batches = [None]
+    else:
+        stations_batches = list(utils.chunked_iterable(sorted(stations_ids), batch_size))
+    num_batches = len(stations_batches)
+    for num_batch, stations_batch in enumerate(stations_batches, 1):
+        logger.info('selecting input records from %s (stations batch %s/%s)...'
+                    % (source_table, num_batch, num_batches))
+        table_records = querying.select_records(
+            conn, source_table, fields=[], sql_fields=sql_fields, stations_ids=stations_batch,
+            schema=startschema, where_sql=where_sql, where_params=where_params)
+        logger.info('computing aggregations %s...' % ', '.join([a[0] for a in aggregators]))
+        target_accumulators = [DmaAccumulator() for target in targets]
+        accumulators = dict()
+        for (target_table, names, fields), accumulator in zip(targets, target_accumulators):
+            accumulators.update({name: accumulator for name in names})
+        compute_dma_aggregations(table_records, aggregators, accumulators)
+        for (target_table, names, fields), accumulator in zip(targets, target_accumulators):
+            data = filter_buckets(accumulator.records(), buckets)
+            delete_missing_buckets(conn, target_table, targetschema, data, buckets, stations_batch)
+            for record in data:
+                record['provenienza'] = 'DAILY'
+            logger.info('update records of table %s...' % target_table)
+            fields = upsert.expand_fields(fields)
+            for sub_data in utils.chunked_iterable(data, 10000):
+                sql = upsert.create_upsert(target_table, targetschema, fields, sub_data, policy)
+                if sql:
+                    conn.execute(sql)
+
+
+def process_dma_precipitazione(conn, startschema, targetschema, policy, stations_ids, logger,
+                               changes=None):
     """
     process the compute and update of DMA data for table of precipitazione
 
@@ -1455,10 +2481,9 @@ def process_dma_precipitazione(conn, startschema, targetschema, policy, stations
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
     """
     logger.info('starting process DMA precipitazione')
-    logger.info('selecting for input records...')
-
     sql_fields = "cod_staz, data_i, " \
                  "(prec01).val_mx, ((prec01).flag).wht, " \
                  "(prec24).val_tot, ((prec24).flag).wht, " \
@@ -1470,98 +2495,33 @@ def process_dma_precipitazione(conn, startschema, targetschema, policy, stations
                  "(cl_prec12).dry, (cl_prec12).wet_01, " \
                  "(cl_prec12).wet_02, (cl_prec12).wet_03, " \
                  "(cl_prec12).wet_04, (cl_prec12).wet_05"
-
-    logger.info('computing aggregations for prec01...')
-
-    def get_table_records():
-        table_records = querying.select_records(
-            conn, 'ds__preci', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-            schema=startschema)
-        return table_records
-
-    def get_prec01_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'prec01', (r[2],), r[3]]
-    prec01_records = get_prec01_records()
-    data_prec01 = compute_dma_records(prec01_records, 'prec01', compute_prec01_06_12)
-
-    logger.info('selecting for input records (prec24) ...')
-
-    def get_prec24_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'prec24', r[4], r[5]]
-    prec24_records = get_prec24_records()
-    map_funct = {
-        'prec24': compute_prec24,
-        'cl_prec24': compute_cl_prec24,
-    }
-    logger.info('computing aggregations for prec24...')
-    data_prec24 = compute_dma_records(prec24_records, map_funct=map_funct)
-
-    logger.info('computing aggregations for persistenza precipitazione')
-    prec24_records = get_prec24_records()
-    data_prs_prec = compute_year_records(prec24_records, 'prs_prec', compute_prs_prec)
-    logger.info('setting provenienza="DAILY" for the resulting records...')
-    for record in data_prs_prec:
-        record['provenienza'] = 'DAILY'
-
-    logger.info('selecting for input records (prec12) ...')
-
-    def get_prec12_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'prec12', ([r[6]]+r[16:]), r[7]]
-    prec12_records = get_prec12_records()
-    map_funct = {
-        'prec12': compute_prec01_06_12,
-        'cl_prec12': compute_cl_prec_06_12,
-    }
-    logger.info('computing aggregations for prec12...')
-    data_prec12 = compute_dma_records(prec12_records, map_funct=map_funct)
-
-    logger.info('selecting for input records (prec06) ...')
-
-    def get_data_prec06():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'prec06', ([r[8]]+r[10:16]), r[9]]
-    data_prec06 = get_data_prec06()
-
-    map_funct = {
-        'prec06': compute_prec01_06_12,
-        'cl_prec06': compute_cl_prec_06_12,
-    }
-    logger.info('computing aggregations for prec06...')
-    data_prec06 = compute_dma_records(data_prec06, map_funct=map_funct)
-
-    logger.info('updating table ds__prs_prec')
-    fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'prs_prec', 'provenienza'])
-    for sub_data_prs_prec in utils.chunked_iterable(data_prs_prec, 10000):
-        sql = upsert.create_upsert('ds__prs_prec', targetschema, fields, sub_data_prs_prec, policy)
-        if sql:
-            conn.execute(sql)
-
-    logger.info('merging records before update of table ds__prec...')
-    data = functools.reduce(merge_data_items, [data_prec01, data_prec24, data_prec12, data_prec06])
-    logger.info('setting provenienza="DAILY" for the resulting records...')
-    for record in data:
-        record['provenienza'] = 'DAILY'
-
-    logger.info('update records for table ds__prec...')
-    fields = upsert.expand_fields(
-        ['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'prec01', 'prec24', 'cl_prec24',
-         'prec12', 'cl_prec12', 'prec06', 'cl_prec06'])
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__preci', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
-
+    aggregators = [
+        ('prec01', lambda r: [r[0], r[1], 'prec01', (r[2],), r[3]], compute_dma_records,
+         {'prec01': compute_prec01_06_12}),
+        ('prec24', lambda r: [r[0], r[1], 'prec24', r[4], r[5]], compute_dma_records,
+         {'prec24': compute_prec24, 'cl_prec24': compute_cl_prec24}),
+        ('prs_prec', lambda r: [r[0], r[1], 'prec24', r[4], r[5]], compute_year_records,
+         {'prs_prec': compute_prs_prec}),
+        ('prec12', lambda r: [r[0], r[1], 'prec12', ([r[6]]+r[16:]), r[7]], compute_dma_records,
+         {'prec12': compute_prec01_06_12, 'cl_prec12': compute_cl_prec_06_12}),
+        ('prec06', lambda r: [r[0], r[1], 'prec06', ([r[8]]+r[10:16]), r[9]],
+         compute_dma_records,
+         {'prec06': compute_prec01_06_12, 'cl_prec06': compute_cl_prec_06_12}),
+    ]
+    targets = [
+        ('ds__prs_prec', ['prs_prec'], ['data_i', 'cod_staz', 'cod_aggr', 'prs_prec',
+                                        'provenienza']),
+        ('ds__preci', ['prec01', 'prec24', 'prec12', 'prec06'],
+         ['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'prec01', 'prec24', 'cl_prec24',
+          'prec12', 'cl_prec12', 'prec06', 'cl_prec06']),
+    ]
+    process_dma_family(conn, 'ds__preci', sql_fields, aggregators, targets, startschema,
+                       targetschema, policy, stations_ids, logger, changes=changes)
     logger.info('end process DMA precipitazione')
 
 
-def process_dma_vento(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_vento(conn, startschema, targetschema, policy, stations_ids, logger,
+                      changes=None):
     """
     process the compute and update of DMA data for table of vento
 
@@ -1571,10 +2531,9 @@ def process_dma_vento(conn, startschema, targetschema, policy, stations_ids, log
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
     """
     logger.info('starting process DMA vento')
-    logger.info('selecting for input records...')
-    data_items = dict()
     wind_subfields = ['frq_s%02.dc%d' % (i, j) for i in range(1, 17) for j in range(1, 5)]
     vnt_array_field = 'ARRAY[(vnt).frq_calme,' + \
                       ','.join(['(vnt).%s' % s for s in wind_subfields]) + ']'
@@ -1583,60 +2542,25 @@ def process_dma_vento(conn, startschema, targetschema, policy, stations_ids, log
                  "ARRAY[(vntmxgg).ff,(vntmxgg).dd], " \
                  "ARRAY[((vntmxgg).flag).ndati,((vntmxgg).flag).wht]," \
                  "%s, ARRAY[((vnt).flag).ndati, ((vnt).flag).wht]" % vnt_array_field
-
-    def get_table_records():
-        table_records = querying.select_records(
-            conn, 'ds__vnt10', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-            schema=startschema)
-        return table_records
-
-    def get_vntmx_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'vntmxgg', r[4], r[5]]
-
-    logger.info('selecting for input records (vntmxgg)...')
-    vntmx_records = get_vntmx_records()
-    logger.info('computing aggregations (vntmd)...')
-    data_items['vntmxgg'] = compute_dma_records(vntmx_records, 'vntmxgg', compute_vntmxgg)
-
-    logger.info('selecting for input records (vnt)...')
-
-    def get_vnt_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'vnt', r[6], r[7]]
-
-    vnt_records = get_vnt_records()
-    logger.info('computing aggregations (vnt)...')
-    data_items['vnt'] = compute_dma_records(vnt_records, 'vnt', compute_vnt)
-
-    logger.info('computing aggregations (vntmd)...')
-
-    def get_vntmd_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'vntmd', r[2], r[3]]
-
-    vntmd_records = get_vntmd_records()
-    data_items['vntmd'] = compute_dma_records(vntmd_records, 'vntmd', compute_vntmd)
-
-    logger.info('merging records before update of table ds__prec...')
-    data = functools.reduce(merge_data_items, data_items.values())
-    logger.info('setting provenienza="DAILY" for the resulting records...')
-    for record in data:
-        record['provenienza'] = 'DAILY'
-    logger.info('update records...')
-    fields = upsert.expand_fields(
-        ['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'vntmxgg', 'vntmd', 'vnt'])
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__vnt10', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    aggregators = [
+        ('vntmxgg', lambda r: [r[0], r[1], 'vntmxgg', r[4], r[5]], compute_dma_records,
+         {'vntmxgg': compute_vntmxgg}),
+        ('vnt', lambda r: [r[0], r[1], 'vnt', r[6], r[7]], compute_dma_records,
+         {'vnt': compute_vnt}),
+        ('vntmd', lambda r: [r[0], r[1], 'vntmd', r[2], r[3]], compute_dma_records,
+         {'vntmd': compute_vntmd}),
+    ]
+    targets = [
+        ('ds__vnt10', ['vntmxgg', 'vnt', 'vntmd'],
+         ['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'vntmxgg', 'vntmd', 'vnt']),
+    ]
+    process_dma_family(conn, 'ds__vnt10', sql_fields, aggregators, targets, startschema,
+                       targetschema, policy, stations_ids, logger, changes=changes)
     logger.info('end process DMA vento')
 
 
-def process_dma_temperatura(conn, startschema, targetschema, policy, stations_ids, logger):
+def process_dma_temperatura(conn, startschema, targetschema, policy, stations_ids, logger,
+                            changes=None):
     """
     process the compute and update of DMA data for table of temperature
 
@@ -1646,104 +2570,35 @@ def process_dma_temperatura(conn, startschema, targetschema, policy, stations_id
     :param policy: onlyinsert or upsert
     :param stations_ids: list of station ids to consider
     :param logger: logging object for function reporting
+    :param changes: if not None, process only the changes of `load_dma_changes`
     """
     logger.info('starting process DMA temperatura')
-    logger.info('selecting for input records...')
-    data_items = dict()
     sql_fields = "cod_staz, data_i, " \
                  "(tmxgg).val_md, ((tmxgg).flag).wht, " \
                  "(tmngg).val_md, ((tmngg).flag).wht, " \
                  "(tmdgg).val_md, ((tmdgg).flag).wht"
-
-    def get_table_records():
-        table_records = querying.select_records(
-            conn, 'ds__t200', fields=[], sql_fields=sql_fields, stations_ids=stations_ids,
-            schema=startschema)
-        return table_records
-
-    logger.info('computing aggregations (persistenza temperatura tmax)...')
-
-    def get_tmax_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'tmax', r[2], r[3]]
-
-    tmax_records = get_tmax_records()
-    prs_t200mx = compute_year_records(tmax_records, 'prs_t200mx', compute_prs_t200mx)
-
-    logger.info('computing aggregations (persistenza temperatura tmin)...')
-
-    def get_tmin_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'tmin', r[4], r[5]]
-
-    tmin_records = get_tmin_records()
-    prs_t200mn = compute_year_records(tmin_records, 'prs_t200mn', compute_prs_t200mn)
-
-    logger.info('merging records before update of table ds__prs_t200...')
-    data_prs = functools.reduce(merge_data_items, [prs_t200mx, prs_t200mn])
-    logger.info('setting provenienza="DAILY" for the resulting records...')
-    for record in data_prs:
-        record['provenienza'] = 'DAILY'
-    logger.info('update records of table ds__prs_t200...')
-    fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'prs_t200mx',
-                                   'prs_t200mn'])
-    for sub_data_prs in utils.chunked_iterable(data_prs, 10000):
-        sql = upsert.create_upsert('ds__prs_t200', targetschema, fields, sub_data_prs, policy)
-        if sql:
-            logger.info('updating DMA table %s.%s' % (targetschema, 'ds__prs_t200'))
-            conn.execute(sql)
-
-    logger.info('computing aggregations (tmdgg)...')
-
-    def get_tmd_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'tmdgg', r[6], r[7]]
-
-    tmd_records = get_tmd_records()
-    data_items['tmdgg'] = compute_dma_records(tmd_records, 'tmdgg', compute_tmdgg)
-    logger.info('computing aggregations (tmxgg)...')
-    tmax_records = get_tmax_records()
-    data_items['tmxgg'] = compute_dma_records(tmax_records, 'tmxgg', compute_tmxgg)
-    logger.info('computing aggregations (tmngg)...')
-    tmin_records = get_tmin_records()
-    data_items['tmngg'] = compute_dma_records(tmin_records, 'tmngg', compute_tmngg)
-    logger.info('computing aggregations (cl_tmxgg)...')
-    tmax_records = get_tmax_records()
-    data_items['c_tmxgg'] = compute_dma_records(tmax_records, 'cl_tmxgg', compute_cl_tmxgg)
-    logger.info('computing aggregations (cl_tmngg)...')
-    tmin_records = get_tmin_records()
-    data_items['c_tmngg'] = compute_dma_records(tmin_records, 'cl_tmngg', compute_cl_tmngg)
-    logger.info('computing aggregations (tmdgg1)...')
-
-    def get_tmdgg1_records():
-        table_records = get_table_records()
-        for r in table_records:
-            yield [r[0], r[1], 'tmdgg1', [r[2], r[4]], r[3] and r[5]]
-
-    tmdgg1_records = get_tmdgg1_records()
-    data_items['tmdgg1'] = compute_dma_records(tmdgg1_records, 'tmdgg1', compute_tmdgg1)
-    logger.info('computing aggregations (deltagg)...')
-    tmdgg1_records = get_tmdgg1_records()
-    data_items['deltagg'] = compute_dma_records(tmdgg1_records, 'deltagg', compute_deltagg)
-    logger.info('computing aggregations (day_gelo)...')
-    tmax_records = get_tmax_records()
-    data_items['day_gelo'] = compute_dma_records(tmax_records, 'day_gelo', compute_day_gelo)
-
-    logger.info('merging records before update of table ds__t200...')
-    data = functools.reduce(merge_data_items, data_items.values())
-    logger.info('setting provenienza="DAILY" for the resulting records...')
-    for record in data:
-        record['provenienza'] = 'DAILY'
-
-    logger.info('update records of table ds__t200...')
-    fields = upsert.expand_fields(['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'tmdgg',
-                                   'tmxgg', 'tmngg', 'cl_tmxgg', 'cl_tmngg', 'tmdgg1', 'deltagg',
-                                   'day_gelo'])
-    for sub_data in utils.chunked_iterable(data, 10000):
-        sql = upsert.create_upsert('ds__t200', targetschema, fields, sub_data, policy)
-        if sql:
-            conn.execute(sql)
+    tmax_record = lambda r: [r[0], r[1], 'tmax', r[2], r[3]]
+    tmin_record = lambda r: [r[0], r[1], 'tmin', r[4], r[5]]
+    tmdgg1_record = lambda r: [r[0], r[1], 'tmdgg1', [r[2], r[4]], r[3] and r[5]]
+    aggregators = [
+        ('prs_t200mx', tmax_record, compute_year_records, {'prs_t200mx': compute_prs_t200mx}),
+        ('prs_t200mn', tmin_record, compute_year_records, {'prs_t200mn': compute_prs_t200mn}),
+        ('tmdgg', lambda r: [r[0], r[1], 'tmdgg', r[6], r[7]], compute_dma_records,
+         {'tmdgg': compute_tmdgg}),
+        ('tmxgg', tmax_record, compute_dma_records,
+         {'tmxgg': compute_tmxgg, 'cl_tmxgg': compute_cl_tmxgg, 'day_gelo': compute_day_gelo}),
+        ('tmngg', tmin_record, compute_dma_records,
+         {'tmngg': compute_tmngg, 'cl_tmngg': compute_cl_tmngg}),
+        ('tmdgg1', tmdgg1_record, compute_dma_records,
+         {'tmdgg1': compute_tmdgg1, 'deltagg': compute_deltagg}),
+    ]
+    targets = [
+        ('ds__prs_t200', ['prs_t200mx', 'prs_t200mn'],
+         ['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'prs_t200mx', 'prs_t200mn']),
+        ('ds__t200', ['tmdgg', 'tmxgg', 'tmngg', 'tmdgg1'],
+         ['data_i', 'cod_staz', 'cod_aggr', 'provenienza', 'tmdgg', 'tmxgg', 'tmngg',
+          'cl_tmxgg', 'cl_tmngg', 'tmdgg1', 'deltagg', 'day_gelo']),
+    ]
+    process_dma_family(conn, 'ds__t200', sql_fields, aggregators, targets, startschema,
+                       targetschema, policy, stations_ids, logger, changes=changes)
     logger.info('end process DMA temperatura')
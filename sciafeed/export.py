@@ -16,6 +16,8 @@ from datetime import datetime
 import operator
 
 ROUND_PRECISION = 1
+# columns of the CSV files of `export2csv` that identify a station
+STATION_FIELDS = ('cod_utente', 'cod_rete', 'lat', 'lon', 'format', 'source')
 
 
 def export2csv(data, out_filepath, omit_parameters=(), omit_missing=True):
@@ -59,14 +61,13 @@ def export2csv(data, out_filepath, omit_parameters=(), omit_missing=True):
             writer.writerow(row)
 
 
-def csv2data(csv_path):
+def iter_csv_data(csv_path):
     """
-    inverse of function `export2csv`.
+    Yield the measures of the CSV written by `export2csv`, one row at a time.
 
     :param csv_path: file to the CSV containing the data
-    :return: the data object
+    :return: iterable of the measures
     """
-    data = []
     with open(csv_path) as csv_in_file:
         reader = csv.DictReader(csv_in_file, delimiter=';')
         for row in reader:
@@ -91,10 +92,47 @@ def csv2data(csv_path):
             par_value = par_value
             par_flag = row['valid'] == '1' and True or False
             measure = metadata, current_date, par_code, par_value, par_flag
-            data.append(measure)
+            yield measure
+
+
+def csv2data(csv_path):
+    """
+    inverse of function `export2csv`.
+
+    :param csv_path: file to the CSV containing the data
+    :return: the data object
+    """
+    data = list(iter_csv_data(csv_path))
     return data
 
 
+def csv2stations(csv_path):
+    """
+    Read only the station columns of a CSV written by `export2csv`, and return
+    the number of records and the distinct stations found, as a dictionary
+    {(cod_utente, cod_rete, lat, lon): station metadata}. The metadata are the ones of the
+    first record of the station, with keys as in the output of `csv2data`.
+
+    :param csv_path: file to the CSV containing the data
+    :return: (number of records, dictionary of the stations)
+    """
+    num_records = 0
+    stations = dict()
+    with open(csv_path) as csv_in_file:
+        reader = csv.reader(csv_in_file, delimiter=';')
+        header = next(reader, None)
+        if header is None:
+            return num_records, stations
+        indexes = [header.index(field) for field in STATION_FIELDS]
+        key_indexes = indexes[:4]
+        for row in reader:
+            num_records += 1
+            station_key = tuple([row[i] for i in key_indexes])
+            if station_key not in stations:
+                stations[station_key] = {f: row[i] for f, i in zip(STATION_FIELDS, indexes)}
+    return num_records, stations
+
+
 def stations2csv(stations, stations_path, extra_fields=()):
     """
     Export the list of information about stations into a CSV located at `stations_path`.
@@ -123,23 +161,23 @@ def stations2csv(stations, stations_path, extra_fields=()):
             writer.writerow(row)
 
 
-def csv2items(csv_path, required_fields=(), ignore_fields=(), ignore_empty_fields=False,
-              stations_ids=None):
+def iter_csv_items(csv_path, required_fields=(), ignore_fields=(), ignore_empty_fields=False,
+                   stations_ids=None):
     """
-    Get a CSV located at `csv_path` and return a list of dictionaries according to the CSV rows.
+    Get a CSV located at `csv_path` and yield a dictionary for each of the CSV rows,
+    without loading the whole file in memory.
     If some required fields are missing, raise an error.
-    If only_stats is not None but a list, get only rows with `cod_staz` in the list.
+    If stations_ids is not None, get only rows with `cod_staz` in it.
 
     :param csv_path: CSV path
     :param required_fields: list of required fields (if black, raise ValueError)
     :param ignore_fields: list of fields to ignore
     :param ignore_empty_fields: if True, ignore the empty fields
     :param stations_ids: if not None, the list of cod_staz' to select rows in the CSV
-    :return: a list of of dictionaries according to the CSV rows
+    :return: iterable of dictionaries according to the CSV rows
     """
-    items = []
     if stations_ids is not None:
-        stations_ids = list(map(str, stations_ids))
+        stations_ids = set(map(str, stations_ids))
     with open(csv_path) as csv_in_file:
         reader = csv.DictReader(csv_in_file, delimiter=';')
         for i, row in enumerate(reader):
@@ -159,5 +197,73 @@ def csv2items(csv_path, required_fields=(), ignore_fields=(), ignore_empty_field
                                          % (i, csv_path, field_name))
                 else:
                     item[field_name] = value
-            items.append(item)
+            yield item
+
+
+def csv2items(csv_path, required_fields=(), ignore_fields=(), ignore_empty_fields=False,
+              stations_ids=None):
+    """
+    Get a CSV located at `csv_path` and return a list of dictionaries according to the CSV rows.
+    If some required fields are missing, raise an error.
+    If only_stats is not None but a list, get only rows with `cod_staz` in the list.
+
+    :param csv_path: CSV path
+    :param required_fields: list of required fields (if black, raise ValueError)
+    :param ignore_fields: list of fields to ignore
+    :param ignore_empty_fields: if True, ignore the empty fields
+    :param stations_ids: if not None, the list of cod_staz' to select rows in the CSV
+    :return: a list of of dictionaries according to the CSV rows
+    """
+    items = list(iter_csv_items(csv_path, required_fields, ignore_fields, ignore_empty_fields,
+                                stations_ids))
     return items
+
+
+class UngroupedItemsError(ValueError):
+    """
+    Error raised by `iter_grouped_items` on items not grouped by station and sorted by day.
+    """
+
+
+def iter_grouped_items(items):
+    """
+    Yield the `items` (dictionaries with keys 'cod_staz' and 'data_i') checking that they are
+    grouped by station and sorted by day inside each station, as the indicators files written
+    by `compute.compute_and_store`. Raise UngroupedItemsError at the first item out of order.
+
+    :param items: iterable of dictionaries
+    :return: iterable of the same dictionaries
+    """
+    seen_stations = set()
+    current_station = None
+    last_day = None
+    for item in items:
+        station, day = item['cod_staz'], item['data_i']
+        if station != current_station:
+            if station in seen_stations:
+                raise UngroupedItemsError('rows of station %s are not grouped' % station)
+            seen_stations.add(station)
+            current_station = station
+        elif day < last_day:
+            raise UngroupedItemsError('rows of station %s are not sorted by day' % station)
+        last_day = day
+        yield item
+
+
+def csv_grouped_by_station(csv_path):
+    """
+    Return True if the rows of the CSV located at `csv_path` are grouped by station
+    (column 'cod_staz') and sorted by day (column 'data_i') inside each station
+    (see `iter_grouped_items`).
+
+    :param csv_path: CSV path
+    :return: True if the rows are grouped by station and sorted by day, False otherwise
+    """
+    with open(csv_path) as csv_in_file:
+        reader = csv.DictReader(csv_in_file, delimiter=';')
+        try:
+            for _ in iter_grouped_items(reader):
+                pass
+        except UngroupedItemsError:
+            return False
+    return True
@@ -96,6 +96,7 @@ class ProcessDMA(QtGui.QMainWindow, Ui_process_dma_form):
             kwargs['policy'] = 'upsert'
         report_path = str(self.input_report.text()).strip()
         kwargs['report_path'] = report_path
+        kwargs['workers'] = self.input_workers.value()
         return kwargs
 
     def generate_cmd(self, bin_path, kwargs):
@@ -111,6 +112,8 @@ class ProcessDMA(QtGui.QMainWindow, Ui_process_dma_form):
             args += ['-p', kwargs['policy']]
         if kwargs['report_path']:
             args += ['-r', kwargs['report_path']]
+        if kwargs['workers'] > 1:
+            args += ['--workers', str(kwargs['workers'])]
         return cmd, args
 
 
@@ -3,9 +3,15 @@ This module contains functions and utilities that involve more components of sci
 """
 
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import operator
-from os import listdir
-from os.path import isfile, join, splitext
+import math
+from os import listdir, mkdir, remove, truncate
+from os.path import getsize, isfile, join, splitext
+import pickle
+import tempfile
+
+import numpy as np
 
 from sciafeed import LOG_NAME
 from sciafeed import checks
@@ -18,6 +24,45 @@ from sciafeed import querying
 from sciafeed import utils
 from sciafeed import upsert
 
+# process_dma_* functions of module dma, in order of processing
+DMA_FAMILIES = (
+    'process_dma_bagnatura',
+    'process_dma_bilancio_idrico',
+    'process_dma_eliofania',
+    'process_dma_radiazione_globale',
+    'process_dma_evapotraspirazione',
+    'process_dma_gradi_giorno',
+    'process_dma_pressione',
+    'process_dma_umidita_relativa',
+    'process_dma_bioclimatologia',
+    'process_dma_precipitazione',
+    'process_dma_vento',
+    'process_dma_temperatura',
+)
+# families with the biggest input tables, split in station batches when processed in parallel
+LARGE_DMA_FAMILIES = (
+    'process_dma_precipitazione',
+    'process_dma_vento',
+    'process_dma_temperatura',
+)
+# families that can aggregate the decades in the database (option `pushdown` of process_dma)
+PUSHDOWN_DMA_FAMILIES = (
+    'process_dma_bagnatura',
+    'process_dma_bilancio_idrico',
+    'process_dma_eliofania',
+    'process_dma_radiazione_globale',
+    'process_dma_evapotraspirazione',
+    'process_dma_gradi_giorno',
+    'process_dma_pressione',
+    'process_dma_umidita_relativa',
+)
+# number of measures read by `partition_by_station` before appending them to the partitions
+PARTITION_BUFFER_SIZE = 100000
+# connection, logger and options of a DMA worker process (see `init_dma_worker`)
+DMA_WORKER_CONN = None
+DMA_WORKER_LOGGER = None
+DMA_WORKER_OPTIONS = dict()
+
 
 def make_report(in_filepath, outdata_filepath=None, parameters_filepath=None, logger=None,
                 do_checks=True, limiting_params=None):
@@ -73,40 +118,248 @@ def make_report(in_filepath, outdata_filepath=None, parameters_filepath=None, lo
     return data
 
 
-def compute_daily_indicators(conn, data_folder, indicators_folder=None, logger=None):
+def station_key(measure):
+    """
+    Return the key (cod_utente, cod_rete, lat, lon) of the station of a measure.
+
+    :param measure: a measure of kind (metadata, datetime object, par_code, par_value, flag)
+    :return: the station key
+    """
+    metadata = measure[0]
+    return metadata['cod_utente'], metadata['cod_rete'], metadata['lat'], metadata['lon']
+
+
+def flush_partitions(buffers, partitions, partitions_folder, sizes):
+    """
+    Append the measures of `buffers` {station key: measures} to the partition files of
+    `partitions`, creating the ones of the new stations, and empty `buffers`.
+    The size of each partition file before its first append is recorded in `sizes`
+    (None for a new partition).
+
+    :param buffers: dictionary of the measures to write
+    :param partitions: dictionary of the partitions {station key: partition path}
+    :param partitions_folder: folder path where to write the partitions
+    :param sizes: dictionary {station key: size} of the partitions before the appends
+    """
+    for key, measures in buffers.items():
+        if key not in partitions:
+            sizes.setdefault(key, None)
+            partitions[key] = join(partitions_folder, 'station_%s.pickle' % len(partitions))
+        else:
+            sizes.setdefault(key, getsize(partitions[key]))
+        with open(partitions[key], 'ab') as fp:
+            pickle.dump(measures, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    buffers.clear()
+
+
+def partition_by_station(data_folder, partitions_folder, logger):
+    """
+    Read each CSV file located inside `data_folder` and append its measures to partition files
+    inside `partitions_folder`, one file for each station.
+    The rows are streamed: at most PARTITION_BUFFER_SIZE measures are kept in memory.
+    The measures of a file that is not parsable are removed from the partitions.
+    Return the dictionary {station key: partition path}.
+
+    :param data_folder: folder path containing input data
+    :param partitions_folder: folder path where to write the partitions
+    :param logger: logging object where to report actions
+    :return: the dictionary of the partitions
+    """
+    partitions = dict()
+    for file_name in listdir(data_folder):
+        csv_path = join(data_folder, file_name)
+        if not isfile(csv_path) or splitext(file_name.lower())[1] != '.csv':
+            continue
+        logger.info("reading data from %r" % csv_path)
+        buffers = dict()
+        sizes = dict()
+        try:
+            for i, measure in enumerate(export.iter_csv_data(csv_path), 1):
+                buffers.setdefault(station_key(measure), []).append(measure)
+                if i % PARTITION_BUFFER_SIZE == 0:
+                    flush_partitions(buffers, partitions, partitions_folder, sizes)
+        except:
+            logger.error('CSV file %r not parsable' % csv_path)
+            for key, size in sizes.items():
+                if size is None:
+                    remove(partitions.pop(key))
+                else:
+                    truncate(partitions[key], size)
+            continue
+        flush_partitions(buffers, partitions, partitions_folder, sizes)
+    return partitions
+
+
+def load_partition(partition_path):
+    """
+    Return the measures written by `partition_by_station` in a partition file.
+
+    :param partition_path: path of the partition file
+    :return: the list of measures
+    """
+    data = []
+    with open(partition_path, 'rb') as fp:
+        while True:
+            try:
+                data.extend(pickle.load(fp))
+            except EOFError:
+                break
+    return data
+
+
+def load_partition_metadata(partition_path):
+    """
+    Return the metadata of the first measure of a partition file.
+
+    :param partition_path: path of the partition file
+    :return: the metadata of the station
+    """
+    with open(partition_path, 'rb') as fp:
+        return pickle.load(fp)[0][0]
+
+
+def run_indicators_task(task):
+    """
+    Compute the indicators of a group of stations in a worker process, writing them on
+    the CSV files of the shard folder (if not None) and on the database (if `db_options`
+    is not None). Return the number of stations computed: the indicators are not sent back
+    to the parent process.
+
+    :param task: (shard_folder, [(cod_staz, partition_path), ...], db_options), where
+        db_options is None or (db_uri, schema, policy)
+    :return: the number of stations computed
+    """
+    shard_folder, stations, db_options = task
+    writers = dict()
+    conn = None
+    if shard_folder is not None:
+        mkdir(shard_folder)
+        writers = utils.open_csv_writers(shard_folder, compute.INDICATORS_TABLES)
+    if db_options is not None:
+        db_uri, schema, policy = db_options
+        db_utils.configure(db_uri)
+        conn = db_utils.ensure_connection()
+        writers = upsert.open_db_writers(
+            conn, schema, compute.INDICATORS_TABLES, policy, writers)
+    for cod_staz, partition_path in stations:
+        data = load_partition(partition_path)
+        compute.compute_station_indicators(cod_staz, data, writers, compute.INDICATORS_TABLES)
+    utils.close_csv_writers(writers)
+    if conn is not None:
+        conn.close()
+    return len(stations)
+
+
+def merge_indicators_shard(shard_folder, writers):
+    """
+    Append the rows of the CSV files of a shard folder to the CSV files of `writers`.
+
+    :param shard_folder: folder of the shard written by `run_indicators_task`
+    :param writers: dictionary of CSV writers
+    """
+    for table, (_, fp) in writers.items():
+        with open(join(shard_folder, '%s.csv' % table), newline='') as shard_fp:
+            shard_fp.readline()  # header
+            fp.write(shard_fp.read())
+
+
+def compute_indicators_parallel(conn, partitions, writers, workers, partitions_folder, logger,
+                                db_options=None):
+    """
+    Compute the indicators of the stations partitioned by `partition_by_station` on a pool
+    of `workers` processes. The stations are resolved up front and split in groups of
+    consecutive stations; each group is written on its own shard, and the shards are merged
+    in order, so the result is the same of the sequential computation.
+    If `db_options` is not None, each worker also writes its indicators on the database.
+
+    :param conn: db connection object
+    :param partitions: dictionary of the partitions {station key: partition path}
+    :param writers: dictionary of CSV writers (if empty, no CSV shard is written)
+    :param workers: number of worker processes
+    :param partitions_folder: folder path of the partitions, where to write the shards
+    :param logger: logging object where to report actions
+    :param db_options: None or (db_uri, schema, policy) of the database where to write
+    :return: the number of stations computed
+    """
+    registry = querying.get_station_registry(conn)
+    stations = []
+    for key in sorted(partitions):
+        cod_utente, cod_rete = key[:2]
+        station_md = load_partition_metadata(partitions[key])
+        cod_staz = compute.find_station_id(registry, station_md)
+        if cod_staz is None:
+            logger.error('station not found: cod_utente=%s cod_rete=%s' % (cod_utente, cod_rete))
+            continue
+        stations.append((cod_staz, partitions[key]))
+    group_size = max(math.ceil(len(stations) / (workers * 4)), 1)
+    tasks = []
+    for i, group in enumerate(utils.chunked_iterable(stations, group_size)):
+        shard_folder = writers and join(partitions_folder, 'shard_%s' % i) or None
+        tasks.append((shard_folder, list(group), db_options))
+    logger.info('computing indicators of %s stations with %s workers'
+                % (len(stations), workers))
+    computed_stations = 0
+    with db_utils.MP_CONTEXT.Pool(workers) as pool:
+        for (shard_folder, _, _), shard_stations in zip(
+                tasks, pool.imap(run_indicators_task, tasks)):
+            if shard_folder is not None:
+                merge_indicators_shard(shard_folder, writers)
+            computed_stations += shard_stations
+    return computed_stations
+
+
+def compute_daily_indicators(conn, data_folder, indicators_folder=None, logger=None,
+                             workers=1, direct=False, schema='dailypdbanpacarica',
+                             policy='upsert', keep_indicators=False):
     """
     Read each file located inside `data_folder` and generate indicators
     and a report of the processing.
     If the path `indicators_folder` is defined, a file with the indicators
     is created at the path.
-    Return the the report strings (list) and the computed indicators (dictionary).
+    If `direct` is True, the indicators are also written on the tables of the database schema
+    `schema`, without passing through the CSV files.
+    If `keep_indicators` is True (only with 1 worker), return the computed indicators
+    (dictionary); otherwise they are not kept in memory, and an empty dictionary is returned.
+    The measures are first partitioned by station in temporary files, so the indicators
+    are computed loading one station at a time.
 
     :param conn: db connection object
     :param data_folder: folder path containing input data
     :param indicators_folder: path of the output data
     :param logger: logging object where to report actions
+    :param workers: number of processes computing the stations in parallel
+    :param direct: if True, write the indicators on the database
+    :param schema: database schema where to write the indicators (if `direct`)
+    :param policy: 'onlyinsert' or 'upsert' (if `direct`)
+    :param keep_indicators: if True, return the computed indicators
     :return: computed_indicators
     """
+    if keep_indicators and workers > 1:
+        raise ValueError('the computed indicators can be kept only with 1 worker')
     if logger is None:
         logger = logging.getLogger(LOG_NAME)
     computed_indicators = dict()
-    writers = utils.open_csv_writers(indicators_folder, compute.INDICATORS_TABLES)
-    block_data = []
-    for i, file_name in enumerate(listdir(data_folder), 1):
-        csv_path = join(data_folder, file_name)
-        if not isfile(csv_path) or splitext(file_name.lower())[1] != '.csv':
-            continue
-        logger.info("reading data from %r" % csv_path)
-        try:
-            data = export.csv2data(csv_path)
-        except:
-            logger.error('CSV file %r not parsable' % csv_path)
-            continue
-        block_data.extend(data)
-    logger.info("computing daily indicators...")
-    if block_data:
-        computed_indicators = compute.compute_and_store(
-            conn, block_data, writers, compute.INDICATORS_TABLES, logger)
+    writers = dict()
+    if indicators_folder:
+        writers = utils.open_csv_writers(indicators_folder, compute.INDICATORS_TABLES)
+    with tempfile.TemporaryDirectory() as partitions_folder:
+        partitions = partition_by_station(data_folder, partitions_folder, logger)
+        logger.info("computing daily indicators...")
+        if workers > 1:
+            db_options = direct and (str(conn.engine.url), schema, policy) or None
+            computed_stations = compute_indicators_parallel(
+                conn, partitions, writers, workers, partitions_folder, logger, db_options)
+            logger.info('computed indicators of %s stations' % computed_stations)
+        else:
+            if direct:
+                writers = upsert.open_db_writers(
+                    conn, schema, compute.INDICATORS_TABLES, policy, writers)
+            for key in sorted(partitions):
+                data = load_partition(partitions[key])
+                station_indicators = compute.compute_and_store(
+                    conn, data, writers, compute.INDICATORS_TABLES, logger)
+                if keep_indicators:
+                    computed_indicators.update(station_indicators)
     utils.close_csv_writers(writers)
     return computed_indicators
 
@@ -116,16 +369,11 @@ def process_checks_preci(conn, stations_ids, schema, logger, temp_records=None):
 
     # initial reset of flags to 1 of records invalidated by previous check chains (flags <= -10)
     logger.info('* initial reset to 1 of flags <= -10 or null')
-    if stations_ids is None:
-        stations_where = '1=1'
-    elif len(stations_ids) == 0:
-        stations_where = 'cod_staz IN (NULL)'
-    else:
-        stations_where = 'cod_staz IN (%s)' % repr(list(stations_ids))[1:-1]
+    stations_where, params = db_utils.stations_filter(conn, stations_ids)
     sql_reset = "UPDATE %s.ds__preci SET prec24.flag.wht = 1 WHERE %s AND (" \
                 "((prec24).flag).wht <= -10 OR ((prec24).flag).wht IS NULL )" \
                 % (schema, stations_where)
-    conn.execute(sql_reset)
+    conn.execute(sql_reset, **params)
 
     logger.info('* query to get records...')
     sql_fields = "cod_staz, data_i, (prec24).val_tot, ((prec24).flag).wht"
@@ -175,17 +423,12 @@ def process_checks_t200(conn, stations_ids, schema, logger):
 
     # initial reset of flags to 1 of records invalidated by previous check chains (flags <= -10)
     logger.info('* initial reset to 1 of flags <= -10 or null')
-    if stations_ids is None:
-        stations_where = '1=1'
-    elif len(stations_ids) == 0:
-        stations_where = 'cod_staz IN (NULL)'
-    else:
-        stations_where = 'cod_staz IN (%s)' % repr(list(stations_ids))[1:-1]
+    stations_where, params = db_utils.stations_filter(conn, stations_ids)
     for field in ['tmxgg', 'tmngg', 'tmdgg']:
         sql_reset = "UPDATE %s.ds__t200 SET %s.flag.wht = 1 WHERE %s AND (" \
                     "((%s).flag).wht <= -10 OR ((%s).flag).wht IS NULL )" \
                     % (schema, field, stations_where, field, field)
-        conn.execute(sql_reset)
+        conn.execute(sql_reset, **params)
 
     logger.info('* query to get records...')
     sql_fields = "cod_staz, data_i, " \
@@ -264,16 +507,11 @@ def process_checks_bagna(conn, stations_ids, schema, logger):
 
     # initial reset of flags to 1 of records invalidated by previous check chains (flags <= -10)
     logger.info('* initial reset to 1 of flags <= -10 or null')
-    if stations_ids is None:
-        stations_where = '1=1'
-    elif len(stations_ids) == 0:
-        stations_where = 'cod_staz IN (NULL)'
-    else:
-        stations_where = 'cod_staz IN (%s)' % repr(list(stations_ids))[1:-1]
+    stations_where, params = db_utils.stations_filter(conn, stations_ids)
     sql_reset = "UPDATE %s.%s SET %s.flag.wht = 1 WHERE %s AND (" \
                 "((%s).flag).wht <= -10 OR ((%s).flag).wht IS NULL )" \
                 % (schema, table, main_field, stations_where, main_field, main_field)
-    conn.execute(sql_reset)
+    conn.execute(sql_reset, **params)
 
     logger.info('* query to get records...')
     sql_fields = "cod_staz, data_i, (%s).%s, ((%s).flag).wht" % (main_field, sub_field, main_field)
@@ -301,16 +539,11 @@ def process_checks_elio(conn, stations_ids, schema, logger):
 
     # initial reset of flags to 1 of records invalidated by previous check chains (flags <= -10)
     logger.info('* initial reset to 1 of flags <= -10 or null')
-    if stations_ids is None:
-        stations_where = '1=1'
-    elif len(stations_ids) == 0:
-        stations_where = 'cod_staz IN (NULL)'
-    else:
-        stations_where = 'cod_staz IN (%s)' % repr(list(stations_ids))[1:-1]
+    stations_where, params = db_utils.stations_filter(conn, stations_ids)
     sql_reset = "UPDATE %s.%s SET %s.flag.wht = 1 WHERE %s AND (" \
                 "((%s).flag).wht <= -10 OR ((%s).flag).wht IS NULL )" \
                 % (schema, table, main_field, stations_where, main_field, main_field)
-    conn.execute(sql_reset)
+    conn.execute(sql_reset, **params)
 
     logger.info('* query to get records...')
     sql_fields = "cod_staz, data_i, (%s).%s, case when ((%s).flag).wht=5 then 5 else 1 end" \
@@ -339,16 +572,11 @@ def process_checks_radglob(conn, stations_ids, schema, logger):
 
     # initial reset of flags to 1 of records invalidated by previous check chains (flags <= -10)
     logger.info('* initial reset to 1 of flags <= -10 or null')
-    if stations_ids is None:
-        stations_where = '1=1'
-    elif len(stations_ids) == 0:
-        stations_where = 'cod_staz IN (NULL)'
-    else:
-        stations_where = 'cod_staz IN (%s)' % repr(list(stations_ids))[1:-1]
+    stations_where, params = db_utils.stations_filter(conn, stations_ids)
     sql_reset = "UPDATE %s.%s SET %s.flag.wht = 1 WHERE %s AND (" \
                 "((%s).flag).wht <= -10 OR ((%s).flag).wht IS NULL )" \
                 % (schema, table, main_field, stations_where, main_field, main_field)
-    conn.execute(sql_reset)
+    conn.execute(sql_reset, **params)
 
     logger.info('* query to get records...')
     sql_fields = "cod_staz, data_i, (%s).%s, case when ((%s).flag).wht=5 then 5 else 1 end" \
@@ -375,16 +603,11 @@ def process_checks_press(conn, stations_ids, schema, logger):
 
     # initial reset of flags to 1 of records invalidated by previous check chains (flags <= -10)
     logger.info('* initial reset to 1 of flags <= -10 or null')
-    if stations_ids is None:
-        stations_where = '1=1'
-    elif len(stations_ids) == 0:
-        stations_where = 'cod_staz IN (NULL)'
-    else:
-        stations_where = 'cod_staz IN (%s)' % repr(list(stations_ids))[1:-1]
+    stations_where, params = db_utils.stations_filter(conn, stations_ids)
     sql_reset = "UPDATE %s.ds__press SET press.flag.wht = 1 WHERE %s AND (" \
                 "((press).flag).wht <= -10 OR ((press).flag).wht IS NULL )" \
                 % (schema, stations_where)
-    conn.execute(sql_reset)
+    conn.execute(sql_reset, **params)
 
     logger.info('* query to get records...')
     sql_fields = "cod_staz, data_i, " \
@@ -424,15 +647,10 @@ def process_checks_urel(conn, stations_ids, schema, logger):
 
     # initial reset of flags to 1 of records invalidated by previous check chains (flags <= -10)
     logger.info('* initial reset to 1 of flags <= -10 or null')
-    if stations_ids is None:
-        stations_where = '1=1'
-    elif len(stations_ids) == 0:
-        stations_where = 'cod_staz IN (NULL)'
-    else:
-        stations_where = 'cod_staz IN (%s)' % repr(list(stations_ids))[1:-1]
+    stations_where, params = db_utils.stations_filter(conn, stations_ids)
     sql_reset = "UPDATE %s.ds__urel SET ur.flag.wht = 1 WHERE %s AND (" \
                 "((ur).flag).wht <= -10 OR ((ur).flag).wht IS NULL )" % (schema, stations_where)
-    conn.execute(sql_reset)
+    conn.execute(sql_reset, **params)
 
     logger.info('* query to get records...')
     sql_fields = "cod_staz, data_i, " \
@@ -468,17 +686,12 @@ def process_checks_wind(conn, stations_ids, schema, logger):
 
     # initial reset of flags to 1 of records invalidated by previous check chains (flags <= -10)
     logger.info('* initial reset to 1 of flags <= -10 or null')
-    if stations_ids is None:
-        stations_where = '1=1'
-    elif len(stations_ids) == 0:
-        stations_where = 'cod_staz IN (NULL)'
-    else:
-        stations_where = 'cod_staz IN (%s)' % repr(list(stations_ids))[1:-1]
+    stations_where, params = db_utils.stations_filter(conn, stations_ids)
     for field in ['vntmd', 'vntmxgg']:
         sql_reset = "UPDATE %s.ds__vnt10 SET %s.flag.wht = 1 WHERE %s AND (" \
                     "((%s).flag).wht <= -10 OR ((%s).flag).wht IS NULL )" \
                     % (schema, field, stations_where, field, field)
-        conn.execute(sql_reset)
+        conn.execute(sql_reset, **params)
 
     logger.info('* query to get records...')
     sql_fields = "cod_staz, data_i, " \
@@ -568,6 +781,84 @@ def process_checks_chain(dburi, stations_ids=None, schema='dailypdbanpacarica',
     logger.info('== End process ==')
 
 
+def write_items(conn, schema, table_name, items, policy='upsert', batch_size=10000):
+    """
+    Write on the table `table_name` a list of items (dictionaries with the same keys),
+    binding the values in multi-row statements of `batch_size` items
+    (see `upsert.execute_upsert`).
+
+    :param conn: db connection object
+    :param schema: db schema to consider
+    :param table_name: name of the table
+    :param items: list of the items to write
+    :param policy: 'onlyinsert' or 'upsert'
+    :param batch_size: number of items written by each statement
+    """
+    if not items:
+        return
+    fields = list(items[0].keys())
+    upsert.execute_upsert(conn, table_name, schema, fields, items, policy, page_size=batch_size)
+
+
+def compute_temperature_items(store):
+    """
+    Compute the items of the temperature indicators (tmdgg1/deltagg, grgg and etp) on a
+    RecordStore of the records [cod_staz, data_i, lat, tmxgg, flag, tmngg, flag, ...].
+    If tmax and tmin are exact decimals, tmdgg1, deltagg and grgg are rounded to the digits
+    of the Decimal arithmetic (one more than the inputs for the halves).
+
+    :param store: the RecordStore object
+    :return: the tuple (temp_items, grgg_items, etp_items)
+    """
+    temp_items = []
+    grgg_items = []
+    etp_items = []
+    if not len(store):
+        return temp_items, grgg_items, etp_items
+    lat, tmax, tmax_flag, tmin, tmin_flag = [store.float_column(i) for i in range(5)]
+    with np.errstate(invalid='ignore'):
+        allowed = np.flatnonzero(
+            ~np.isnan(tmax) & (tmax_flag > 0) & ~np.isnan(tmin) & (tmin_flag > 0))
+    tmax, tmin, lat = tmax[allowed], tmin[allowed], lat[allowed]
+    stations = store.stations[allowed].tolist()
+    days = store.days[allowed]
+    dates = [store.date_class.fromordinal(d) for d in days.tolist()]
+    # escursione termica e t.media
+    deltagg = tmax - tmin
+    tmdgg1 = (tmax + tmin) / 2
+    grgg = compute.compute_grgg_array(tmdgg1)
+    scales = [store.columns[1].scale, store.columns[3].scale]
+    if None not in scales:
+        digits = max(scales)
+        deltagg = np.array(compute.round_array(deltagg, digits))
+        tmdgg1 = np.array(compute.round_array(tmdgg1, digits + 1))
+        grgg = np.array(compute.round_array(grgg.ravel(), digits + 1)).reshape(grgg.shape)
+    for cod_staz, data_i, tmdgg1_value, deltagg_value in zip(
+            stations, dates, tmdgg1.tolist(), deltagg.tolist()):
+        temp_items.append({
+            'data_i': data_i, 'cod_staz': cod_staz, 'cod_aggr': 4,
+            'tmdgg1.val_md': tmdgg1_value, 'tmdgg1.flag.wht': 1,
+            'deltagg.val_md': deltagg_value, 'deltagg.flag.wht': 1})
+    # gradi giorno
+    for cod_staz, data_i, (grgg1, grgg2, grgg3, grgg4, grgg5) in zip(
+            stations, dates, grgg.tolist()):
+        grgg_items.append({
+            'data_i': data_i, 'cod_staz': cod_staz, 'cod_aggr': 4,
+            'grgg.flag.wht': 1, 'grgg.tot00': grgg1, 'grgg.tot05': grgg2,
+            'grgg.tot10': grgg3, 'grgg.tot15': grgg4, 'grgg.tot21': grgg5})
+    # evapotraspirazione potenziale
+    with np.errstate(invalid='ignore'):
+        etp_indexes = np.flatnonzero(~np.isnan(lat) & (deltagg >= 0))
+    etp_values = compute.compute_etp_array(
+        tmax[etp_indexes], tmin[etp_indexes], lat[etp_indexes],
+        compute.day_of_year_array(days[etp_indexes]))
+    for index, etp in zip(etp_indexes.tolist(), compute.round_array(etp_values)):
+        etp_items.append({
+            'data_i': dates[index], 'cod_staz': stations[index], 'cod_aggr': 4,
+            'etp.val_md': etp, 'etp.flag.wht': 1})
+    return temp_items, grgg_items, etp_items
+
+
 def compute_daily_indicators2(conn, schema, stations_ids, logger):
     """
     Compute secondary indicators.
@@ -581,7 +872,7 @@ def compute_daily_indicators2(conn, schema, stations_ids, logger):
     conn_r = db_utils.get_safe_memory_read_connection(conn)
     if logger is None:
         logger = logging.getLogger(LOG_NAME)
-    station_ids_tuple = '(%s)' % repr(stations_ids)[1:-1]
+    stations_where, params = db_utils.stations_filter(conn_r, stations_ids)
     logger.info('* querying ds__t200 for compute temperature indicators...')
     sql = """
     SELECT cod_staz, data_i, lat,
@@ -589,64 +880,19 @@ def compute_daily_indicators2(conn, schema, stations_ids, logger):
     (tmngg).val_md, ((tmngg).flag).wht,
     (tmdgg).val_md, ((tmdgg).flag).wht
     FROM %s.ds__t200 LEFT JOIN dailypdbadmclima.anag__stazioni ON cod_staz=id_staz
-    WHERE cod_staz in %s""" % (schema, station_ids_tuple)
-    temp_records = db_utils.results_list(conn_r.execute(sql))
+    WHERE %s""" % (schema, stations_where)
+    store = db_utils.RecordStore.from_results(conn_r.execute(sql, **params))
 
     logger.info('* computing temperature indicators...')
-    temp_items = []
-    grgg_items = []
-    etp_items = []
+    temp_items, grgg_items, etp_items = compute_temperature_items(store)
 
-    for record in temp_records:
-        cod_staz, data_i, lat = record[0:3]
-        base_item = {'data_i': data_i, 'cod_staz': cod_staz,  'cod_aggr': 4}
-        tmax, tmax_flag = record[3:5]
-        tmin, tmin_flag = record[5:7]
-        tmedia, tmedia_flag = record[7:9]
-        allow_compute = tmax is not None and tmax_flag is not None and tmax_flag > 0 and \
-            tmin is not None and tmin_flag is not None and tmin_flag > 0
-        if allow_compute:
-            # escursione termica e t.media
-            deltagg = tmax - tmin
-            tmdgg1 = (tmax + tmin) / 2
-            temp_item = base_item.copy()
-            temp_item.update({'tmdgg1.val_md': tmdgg1, 'tmdgg1.flag.wht': 1,
-                              'deltagg.val_md': deltagg, 'deltagg.flag.wht': 1})
-            temp_items.append(temp_item)
-            # gradi giorno
-            grgg_flag, grgg1, grgg2, grgg3, grgg4, grgg5 = compute.compute_grgg(tmdgg1)
-            grgg_item = base_item.copy()
-            grgg_item.update({
-                'grgg.flag.wht': grgg_flag[1], 'grgg.tot00': grgg1, 'grgg.tot05': grgg2,
-                'grgg.tot10': grgg3, 'grgg.tot15': grgg4, 'grgg.tot21': grgg5})
-            grgg_items.append(grgg_item)
-            # evapotraspirazione potenziale
-            if lat is not None and deltagg >= 0:
-                jd = int(data_i.strftime('%j'))
-                etp = compute.compute_etp(tmax, tmin, lat, jd)
-                etp_item = base_item.copy()
-                etp_item.update({'etp.val_md': etp[1], 'etp.flag.wht': etp[0][1]})
-                etp_items.append(etp_item)
-
-    temp_fields = []
-    if temp_items:
-        temp_fields = list(temp_items[0].keys())
-    etp_fields = []
-    if etp_items:
-        etp_fields = list(etp_items[0].keys())
-    grgg_fields = []
-    if grgg_items:
-        grgg_fields = list(grgg_items[0].keys())
-    for table_name, fields, data in [
-        ('ds__t200', temp_fields, temp_items),
-        ('ds__etp', etp_fields, etp_items),
-        ('ds__grgg', grgg_fields, grgg_items),
+    for table_name, data in [
+        ('ds__t200', temp_items),
+        ('ds__etp', etp_items),
+        ('ds__grgg', grgg_items),
     ]:
         logger.info('updating temperature indicators on table %s.%s' % (schema, table_name))
-        for sub_data in utils.chunked_iterable(data, 10000):
-            sql = upsert.create_upsert(table_name, schema, fields, sub_data, 'upsert')
-            if sql:
-                conn.execute(sql)
+        write_items(conn, schema, table_name, data)
 
     logger.info('* computing bilancio idrico...')
     sql = """
@@ -654,34 +900,120 @@ def compute_daily_indicators2(conn, schema, stations_ids, logger):
     FROM %s.ds__etp a JOIN %s.ds__preci b USING (cod_staz,data_i) 
     WHERE ((prec24).flag).wht > 0 AND ((etp).flag).wht > 0 
     AND (prec24).val_tot IS NOT NULL AND (etp).val_md IS NOT NULL
-    AND cod_staz in %s
-    """ % (schema, schema, station_ids_tuple)
-    idro_records = db_utils.results_list(conn_r.execute(sql))
+    AND %s
+    """ % (schema, schema, stations_where)
+    store = db_utils.RecordStore.from_results(conn_r.execute(sql, **params))
 
     idro_items = []
-    for idro_record in idro_records:
-        cod_staz, data_i, lat = idro_record[0:3]
-        base_item = {'data_i': data_i, 'cod_staz': cod_staz, 'cod_aggr': 4}
-        prec24, etp = idro_record[2:4]
-        deltaidro = compute.compute_deltaidro(prec24, etp)
-        idro_item = base_item.copy()
-        idro_item.update({'deltaidro.flag.wht': deltaidro[0][1], 'deltaidro.val_md': deltaidro[1]})
-        idro_items.append(idro_item)
+    if len(store):
+        prec24, etp = [store.float_column(i) for i in range(2)]
+        deltaidro = compute.round_array(prec24 - etp)
+        for cod_staz, day, deltaidro_value in zip(
+                store.stations.tolist(), store.days.tolist(), deltaidro):
+            idro_items.append({
+                'data_i': store.date_class.fromordinal(day), 'cod_staz': cod_staz,
+                'cod_aggr': 4, 'deltaidro.flag.wht': 1, 'deltaidro.val_md': deltaidro_value})
 
     logger.info('updating bilancio idrico on table %s.%s' % (schema, 'ds__delta_idro'))
-    idro_fields = []
-    if idro_items:
-        idro_fields = list(idro_items[0].keys())
-    for sub_data in utils.chunked_iterable(idro_items, 10000):
-        sql = upsert.create_upsert('ds__delta_idro', schema, idro_fields, sub_data, 'upsert')
-        if sql:
-            conn.execute(sql)
+    write_items(conn, schema, 'ds__delta_idro', idro_items)
+
 
+def dma_tasks(stations_ids, startschema, targetschema, policy, workers):
+    """
+    Return the list of tasks to run by `run_dma_task` for processing DMA with `workers` processes.
+    Each task is (family, stations_ids, startschema, targetschema, policy), where family is the
+    name of a process_dma_* function of module dma. The families in LARGE_DMA_FAMILIES are
+    split in station batches (and scheduled first), the others are a task each.
+
+    :param stations_ids: list of station ids to consider
+    :param startschema: db schema to consider for input records
+    :param targetschema: db schema to consider for output records
+    :param policy: 'onlyinsert' or 'upsert'
+    :param workers: number of worker processes
+    :return: the list of tasks
+    """
+    batches = [stations_ids]
+    if stations_ids is not None and workers > 1:
+        sorted_ids = sorted(set(stations_ids))
+        batch_size = max(1, -(-len(sorted_ids) // workers))
+        batches = [sorted_ids[i:i+batch_size]
+                   for i in range(0, len(sorted_ids), batch_size)] or [stations_ids]
+    tasks = []
+    for family in LARGE_DMA_FAMILIES:
+        for batch in batches:
+            tasks.append((family, batch, startschema, targetschema, policy))
+    for family in DMA_FAMILIES:
+        if family not in LARGE_DMA_FAMILIES:
+            tasks.append((family, stations_ids, startschema, targetschema, policy))
+    return tasks
+
+
+def dma_family_options(family, changes=None, pushdown=False):
+    """
+    Return the keyword arguments of the process_dma_* function `family` of module dma.
+
+    :param family: name of the process_dma_* function
+    :param changes: if not None, process only the changes of `dma.load_dma_changes`
+    :param pushdown: if True, aggregate in the database the families that support it
+    :return: the dictionary of keyword arguments
+    """
+    options = {'changes': changes}
+    if pushdown and family in PUSHDOWN_DMA_FAMILIES:
+        options['pushdown'] = True
+    return options
+
+
+def init_dma_worker(db_uri, read_db_uri, log_queue, changes=None, pushdown=False,
+                    reflection_cache_folder=None):
+    """
+    Initialize a worker process of `process_dma`: configure the database, open the connection
+    of the worker and send the logging to the queue `log_queue`.
+
+    :param db_uri: connection URI of the database
+    :param read_db_uri: if not None, connection URI of the read-replica
+    :param log_queue: queue of the log records, consumed by the main process
+    :param changes: if not None, process only the changes of `dma.load_dma_changes`
+    :param pushdown: if True, aggregate in the database the families that support it
+    :param reflection_cache_folder: if not None, folder where the reflected tables are persisted
+    """
+    global DMA_WORKER_CONN, DMA_WORKER_LOGGER, DMA_WORKER_OPTIONS
+    DMA_WORKER_OPTIONS = {'changes': changes, 'pushdown': pushdown}
+    db_utils.configure(db_uri, reflection_cache_folder=reflection_cache_folder,
+                       read_db_uri=read_db_uri)
+    DMA_WORKER_CONN = db_utils.ensure_connection()
+    DMA_WORKER_LOGGER = logging.getLogger(LOG_NAME + '.dma_worker')
+    DMA_WORKER_LOGGER.setLevel(logging.DEBUG)
+    DMA_WORKER_LOGGER.handlers = [QueueHandler(log_queue)]
+    DMA_WORKER_LOGGER.propagate = False
+
+
+def run_dma_task(task):
+    """
+    Run a task of `dma_tasks` in a worker process.
 
-def process_dma(conn, startschema, targetschema, policy, stations_ids, logger):
+    :param task: (family, stations_ids, startschema, targetschema, policy)
+    :return: (family, number of stations processed)
+    """
+    family, stations_ids, startschema, targetschema, policy = task
+    process_funct = getattr(dma, family)
+    process_funct(DMA_WORKER_CONN, startschema, targetschema, policy, stations_ids,
+                  DMA_WORKER_LOGGER, **dma_family_options(family, **DMA_WORKER_OPTIONS))
+    return family, stations_ids is not None and len(stations_ids) or 0
+
+
+def process_dma(conn, startschema, targetschema, policy, stations_ids, logger, workers=1,
+                incremental=False, pushdown=False):
     """
     Compute DMA aggregations reading records from db schema `startschema` and writing results
     on db schema `targetschema`.
+    If `workers` > 1, the families of DMA tables are processed concurrently by a pool of
+    `workers` processes (with a connection each), splitting the large families in batches
+    of stations.
+    If `incremental` is True, only the decades, months and years including the records
+    changed since the last incremental run are computed (the first run creates the changes
+    log on `startschema` and computes everything).
+    If `pushdown` is True, the families in PUSHDOWN_DMA_FAMILIES are aggregated by decades
+    in the database (the others are computed in python from the daily records).
 
     :param conn: db connection object
     :param startschema: db schema to consider for input records
@@ -689,21 +1021,65 @@ def process_dma(conn, startschema, targetschema, policy, stations_ids, logger):
     :param policy: 'onlyinsert' or 'upsert'
     :param stations_ids: list of station ids to consider
     :param logger: logger object for reporting
+    :param workers: number of worker processes
+    :param incremental: if True, process only the changed records
+    :param pushdown: if True, aggregate in the database the families that support it
     """
     if logger is None:
         logger = logging.getLogger(LOG_NAME)
+    change_ids = changes = None
+    if incremental:
+        change_ids, changes = dma.load_dma_changes(conn, startschema, stations_ids)
+        if change_ids is None:
+            logger.info('creating the changes log on schema %s: all records will be processed'
+                        % startschema)
+            dma.create_dma_changes_log(conn, startschema)
+            changes = None
+        else:
+            num_changes = sum([len(c) for c in changes.values()])
+            logger.info('found %s changed records to process' % num_changes)
+
+    if workers <= 1:
+        for family in DMA_FAMILIES:
+            process_funct = getattr(dma, family)
+            options = dma_family_options(family, changes, pushdown)
+            process_funct(conn, startschema, targetschema, policy, stations_ids, logger, **options)
+    else:
+        process_dma_parallel(conn, startschema, targetschema, policy, stations_ids, logger,
+                             workers, changes, pushdown)
+    if change_ids:
+        dma.clear_dma_changes(conn, startschema, change_ids)
+
+
+def process_dma_parallel(conn, startschema, targetschema, policy, stations_ids, logger,
+                         workers, changes=None, pushdown=False):
+    """
+    Run `process_dma` on a pool of `workers` processes.
 
-    dma.process_dma_bagnatura(conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_bilancio_idrico(conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_eliofania(conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_radiazione_globale(
-        conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_evapotraspirazione(
-        conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_gradi_giorno(conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_pressione(conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_umidita_relativa(conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_bioclimatologia(conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_precipitazione(conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_vento(conn, startschema, targetschema, policy, stations_ids, logger)
-    dma.process_dma_temperatura(conn, startschema, targetschema, policy, stations_ids, logger)
+    :param conn: db connection object
+    :param startschema: db schema to consider for input records
+    :param targetschema: db schema to consider for output records
+    :param policy: 'onlyinsert' or 'upsert'
+    :param stations_ids: list of station ids to consider
+    :param logger: logger object for reporting
+    :param workers: number of worker processes
+    :param changes: if not None, process only the changes of `dma.load_dma_changes`
+    :param pushdown: if True, aggregate in the database the families that support it
+    """
+    tasks = dma_tasks(stations_ids, startschema, targetschema, policy, workers)
+    db_uri = str(conn.engine.url)
+    read_db_uri = db_utils.READ_ENGINE is not None and str(db_utils.READ_ENGINE.url) or None
+    log_queue = db_utils.MP_CONTEXT.Queue()
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    listener.start()
+    logger.info('processing %s DMA tasks with %s workers' % (len(tasks), workers))
+    try:
+        initargs = (db_uri, read_db_uri, log_queue, changes, pushdown,
+                    db_utils.REFLECTION_CACHE_FOLDER)
+        with db_utils.MP_CONTEXT.Pool(workers, init_dma_worker, initargs) as pool:
+            results = pool.imap_unordered(run_dma_task, tasks)
+            for num, (family, num_stations) in enumerate(results, 1):
+                logger.info('DMA task %s/%s done: %s on %s stations'
+                            % (num, len(tasks), family, num_stations))
+    finally:
+        listener.stop()
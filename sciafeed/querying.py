@@ -3,15 +3,261 @@ This module contains functions and utilities that extracts information from SCIA
 """
 import functools
 import itertools
+import math
 import operator
 from os import listdir
 from os.path import isfile, join, splitext
 
 from sqlalchemy.sql import select, and_, literal, func
-from sqlalchemy import MetaData, Table
 
 from sciafeed import db_utils
 from sciafeed import export
+from sciafeed import utils
+
+STATION_REGISTRIES = dict()
+
+
+class StationRegistry(object):
+    """
+    In-memory index of the stations of the table dailypdbadmclima.anag__stazioni.
+    Stations are indexed by id_staz, by (cod_rete, cod_utente) and by (cod_rete, nome)
+    (case insensitive), so that each lookup is a dictionary hit instead of a query.
+    """
+    def __init__(self, stations=()):
+        """
+        :param stations: iterable of station objects (rows of anag__stazioni)
+        """
+        self.stations = []
+        self.by_id = dict()
+        self.by_code = dict()
+        self.by_name = dict()
+        self.load(stations)
+
+    @staticmethod
+    def normalize(col_name, col_value):
+        """
+        Return the value `col_value` of the column `col_name` in a comparable form.
+
+        :param col_name: name of the column
+        :param col_value: value of the column
+        :return: the normalized value
+        """
+        if col_value is None:
+            return None
+        if col_name == 'nome':
+            return str(col_value).lower()
+        if col_name in ('lat', 'lon'):
+            return float(col_value)
+        return str(col_value)
+
+    def load(self, stations):
+        """
+        Rebuild the indexes from the iterable of station objects `stations`.
+
+        :param stations: iterable of station objects (rows of anag__stazioni)
+        """
+        self.stations = list(stations)
+        self.by_id = dict()
+        self.by_code = dict()
+        self.by_name = dict()
+        for station in self.stations:
+            cod_rete = self.normalize('cod_rete', station['cod_rete'])
+            id_key = self.normalize('id_staz', station['id_staz'])
+            code_key = (cod_rete, self.normalize('cod_utente', station['cod_utente']))
+            name_key = (cod_rete, self.normalize('nome', station['nome']))
+            self.by_id.setdefault(id_key, []).append(station)
+            self.by_code.setdefault(code_key, []).append(station)
+            self.by_name.setdefault(name_key, []).append(station)
+
+    def refresh(self, conn):
+        """
+        Reload the stations from the database.
+
+        :param conn: db connection object
+        """
+        sql = "SELECT * FROM dailypdbadmclima.anag__stazioni"
+        self.load(conn.execute(sql).fetchall())
+
+    def candidates(self, **kwargs):
+        """
+        Return the stations of the smallest index bucket compatible with `kwargs`.
+
+        :param kwargs: dictionary of column values (not None)
+        :return: list of station objects
+        """
+        norm = self.normalize
+        if 'id_staz' in kwargs:
+            return self.by_id.get(norm('id_staz', kwargs['id_staz']), [])
+        if 'cod_rete' in kwargs and 'cod_utente' in kwargs:
+            key = (norm('cod_rete', kwargs['cod_rete']), norm('cod_utente', kwargs['cod_utente']))
+            return self.by_code.get(key, [])
+        if 'cod_rete' in kwargs and 'nome' in kwargs:
+            key = (norm('cod_rete', kwargs['cod_rete']), norm('nome', kwargs['nome']))
+            return self.by_name.get(key, [])
+        return self.stations
+
+    def find(self, **kwargs):
+        """
+        Return all the stations matching the column values in `kwargs`.
+        The match on the column 'nome' is case insensitive, None values are ignored.
+
+        :param kwargs: dictionary of column values
+        :return: list of station objects
+        """
+        props = {k: v for k, v in kwargs.items() if v is not None}
+        ret_value = []
+        for station in self.candidates(**props):
+            for col_name, col_value in props.items():
+                if self.normalize(col_name, station[col_name]) \
+                        != self.normalize(col_name, col_value):
+                    break
+            else:
+                ret_value.append(station)
+        return ret_value
+
+    def get(self, **kwargs):
+        """
+        Get a station object by its properties. Same semantic of `get_db_station`.
+
+        :param kwargs: dictionary of column values
+        :return: the station object (if found and unique), otherwise None
+        """
+        results = self.find(**kwargs)
+        if len(results) == 1:
+            return results[0]
+        return None
+
+
+class StationSpatialIndex(object):
+    """
+    In-memory grid index on (lon, lat) of a set of stations, answering radius and
+    nearest-neighbour queries with the haversine distance (the same of ST_DistanceSphere).
+    """
+    def __init__(self, stations=(), cell_size=0.1):
+        """
+        :param stations: iterable of station objects (with attributes lon and lat)
+        :param cell_size: size of the cells of the grid (degrees)
+        """
+        self.cell_size = cell_size
+        self.cells = dict()
+        self.num_stations = 0
+        for station in stations:
+            if station['lat'] is None or station['lon'] is None:
+                continue
+            lon, lat = float(station['lon']), float(station['lat'])
+            self.cells.setdefault(self.cell_of(lon, lat), []).append((lon, lat, station))
+            self.num_stations += 1
+
+    def cell_of(self, lon, lat):
+        """
+        Return the cell of the grid containing the point (lon, lat).
+
+        :param lon: longitude (degrees)
+        :param lat: latitude (degrees)
+        :return: the cell indexes (i, j)
+        """
+        return math.floor(lon / self.cell_size), math.floor(lat / self.cell_size)
+
+    def ring(self, cell, k):
+        """
+        Return the stations inside the cells at distance `k` (in cells) from `cell`.
+
+        :param cell: the center cell (i, j)
+        :param k: number of cells from the center
+        :return: list of (lon, lat, station)
+        """
+        ret_value = []
+        i0, j0 = cell
+        for i in range(i0 - k, i0 + k + 1):
+            for j in range(j0 - k, j0 + k + 1):
+                if max(abs(i - i0), abs(j - j0)) == k:
+                    ret_value.extend(self.cells.get((i, j), []))
+        return ret_value
+
+    def within(self, lon, lat, radius):
+        """
+        Return the stations with distance from (lon, lat) less than `radius`, ordered
+        by distance.
+
+        :param lon: longitude (degrees)
+        :param lat: latitude (degrees)
+        :param radius: radius in meters
+        :return: list of (distance, station)
+        """
+        lon, lat = float(lon), float(lat)
+        delta_lat = math.degrees(radius / utils.EARTH_RADIUS)
+        cos_lat = math.cos(math.radians(min(abs(lat) + delta_lat, 89.9)))
+        delta_lon = min(delta_lat / cos_lat, 180)
+        i_min, j_min = self.cell_of(lon - delta_lon, lat - delta_lat)
+        i_max, j_max = self.cell_of(lon + delta_lon, lat + delta_lat)
+        ret_value = []
+        for i in range(i_min, i_max + 1):
+            for j in range(j_min, j_max + 1):
+                for s_lon, s_lat, station in self.cells.get((i, j), []):
+                    distance = utils.distance_sphere(s_lon, s_lat, lon, lat)
+                    if distance < radius:
+                        ret_value.append((distance, station))
+        ret_value.sort(key=operator.itemgetter(0))
+        return ret_value
+
+    def nearest(self, lon, lat):
+        """
+        Return the nearest station to the point (lon, lat).
+
+        :param lon: longitude (degrees)
+        :param lat: latitude (degrees)
+        :return: (distance, station) or (None, None) if the index is empty
+        """
+        lon, lat = float(lon), float(lat)
+        best = (None, None)
+        if not self.num_stations:
+            return best
+        cell = self.cell_of(lon, lat)
+        max_k = max(max(abs(i - cell[0]), abs(j - cell[1])) for i, j in self.cells)
+        # lower bound of the distance covered by each ring of cells
+        cell_meters = math.radians(self.cell_size) * utils.EARTH_RADIUS \
+            * math.cos(math.radians(min(abs(lat) + self.cell_size * max_k, 89.9)))
+        for k in range(max_k + 1):
+            if best[0] is not None and best[0] <= (k - 1) * cell_meters:
+                break
+            for s_lon, s_lat, station in self.ring(cell, k):
+                distance = utils.distance_sphere(s_lon, s_lat, lon, lat)
+                if best[0] is None or distance < best[0]:
+                    best = (distance, station)
+        return best
+
+
+def get_station_registry(conn, refresh=False):
+    """
+    Return the registry of the stations of the database of the connection `conn`.
+    The stations are loaded only the first time (or if `refresh` is True).
+
+    :param conn: db connection object
+    :param refresh: if True, reload the stations from the database
+    :return: the StationRegistry instance
+    """
+    key = str(conn.engine.url)
+    registry = STATION_REGISTRIES.get(key)
+    if registry is None:
+        registry = StationRegistry()
+        registry.refresh(conn)
+        STATION_REGISTRIES[key] = registry
+    elif refresh:
+        registry.refresh(conn)
+    return registry
+
+
+def invalidate_station_registry(conn=None):
+    """
+    Discard the loaded registry of the stations of the database of the connection `conn`
+    (of all the databases if `conn` is None), so the next lookup will reload it.
+
+    :param conn: db connection object
+    """
+    if conn is None:
+        STATION_REGISTRIES.clear()
+    else:
+        STATION_REGISTRIES.pop(str(conn.engine.url), None)
 
 
 @functools.lru_cache(maxsize=None)
@@ -44,9 +290,14 @@ def get_db_station(conn, anag_table, **kwargs):
     return None
 
 
-def get_er_station(conn, anag_table, **station_props):
+def get_er_station(registry, spatial_index, **station_props):
     """
     debugger log on ER stations
+
+    :param registry: StationRegistry instance
+    :param spatial_index: StationSpatialIndex instance on the same stations
+    :param station_props: properties of the station to look for
+    :return: list of report messages
     """
     new_messages = []
     thestations1 = []
@@ -54,47 +305,38 @@ def get_er_station(conn, anag_table, **station_props):
     thestations3 = []
     if station_props['lat'] and station_props['lon']:
         # list the nearest stations inside a circle of radius meters
-        radius = '1000'
-        sql = """
-        SELECT * FROM ( SELECT id_staz, nome, lon, lat, cod_rete,
-        ST_DistanceSphere(ST_MakePoint(lon, lat), ST_MakePoint(%s, %s))  as distance 
-        FROM dailypdbadmclima.anag__stazioni ORDER BY distance) as t WHERE t.distance < %s
-        and cod_rete = %s
-        """ % (station_props['lon'], station_props['lat'], radius, station_props['cod_rete'])
-        results1 = conn.execute(sql).fetchall()
+        radius = 1000
+        cod_rete = StationRegistry.normalize('cod_rete', station_props['cod_rete'])
+        results1 = [
+            station for distance, station in spatial_index.within(
+                station_props['lon'], station_props['lat'], radius)
+            if StationRegistry.normalize('cod_rete', station['cod_rete']) == cod_rete
+        ]
         if not results1:
             msg = "not found any station near this (radius %s)" % radius
         else:
-            thestations1 = [r[0] for r in results1]
+            thestations1 = [r['id_staz'] for r in results1]
             msg = "found %s stations near this (radius %s): %r" \
                   % (len(thestations1), radius, thestations1)
         new_messages.append(msg)
-    base_clause = getattr(anag_table.c, 'cod_rete') == station_props['cod_rete']
     # list stations with the same name (case insensitive)
-    clause1 = and_(
-        func.lower(getattr(anag_table.c, 'nome')) == station_props['cod_utente'].lower(),
-        base_clause)
-    query = select([anag_table]).where(clause1)
-    results2 = conn.execute(query).fetchall()
+    results2 = registry.find(cod_rete=station_props['cod_rete'],
+                             nome=station_props['cod_utente'])
     if not results2:
         msg = 'no found any station with the same name (case insensitive)'
         new_messages.append(msg)
     else:
-        thestations2 = [r[0] for r in results2]
+        thestations2 = [r['id_staz'] for r in results2]
         msg = "found %s stations with the same name (case insensitive): %r" \
               % (len(thestations2), thestations2)
         new_messages.append(msg)
     # list stations with the same name (case sensitive)
-    clause2 = and_(
-        getattr(anag_table.c, 'nome') == station_props['cod_utente'],
-        base_clause)
-    query = select([anag_table]).where(clause2)
-    results3 = conn.execute(query).fetchall()
+    results3 = [r for r in results2 if r['nome'] == station_props['cod_utente']]
     if not results3:
         msg = 'no found any station with the same exact name (case sensitive)'
         new_messages.append(msg)
     else:
-        thestations3 = [r[0] for r in results3]
+        thestations3 = [r['id_staz'] for r in results3]
         msg = "found %s stations with the same exact name (case sensitive): %r" \
               % (len(thestations3), thestations3)
         new_messages.append(msg)
@@ -105,56 +347,81 @@ def get_er_station(conn, anag_table, **station_props):
     return new_messages
 
 
-def find_new_er_stations(data_folder, dburi):
+def scan_csv_stations(csv_path):
+    """
+    Return the number of records and the distinct stations of the CSV file `csv_path`
+    (see `export.csv2stations`), or (0, {}) if `csv_path` is not a CSV file.
+
+    :param csv_path: path of the file
+    :return: (number of records, dictionary of the stations)
+    """
+    if not isfile(csv_path) or splitext(csv_path.lower())[1] != '.csv':
+        return 0, dict()
+    return export.csv2stations(csv_path)
+
+
+def scan_stations(data_folder, workers=1):
+    """
+    Scan the files inside the folder `data_folder` reading only the station columns,
+    with `workers` processes. For each file, in the order of `listdir`, yield
+    (index of the file, number of files, number of records, dictionary of the stations).
+
+    :param data_folder: folder path where CSV files are in
+    :param workers: number of processes scanning the files
+    :return: iterable of (i, num_files, num_records, stations)
+    """
+    csv_paths = [join(data_folder, file_name) for file_name in listdir(data_folder)]
+    num_files = len(csv_paths)
+    if workers > 1 and num_files > 1:
+        with db_utils.MP_CONTEXT.Pool(workers) as pool:
+            for i, result in enumerate(pool.imap(scan_csv_stations, csv_paths)):
+                yield (i, num_files) + result
+    else:
+        for i, csv_path in enumerate(csv_paths):
+            yield (i, num_files) + scan_csv_stations(csv_path)
+
+
+def find_new_er_stations(data_folder, dburi, workers=1):
     """debug mode for ER stations"""
     msgs = []
     conn = db_utils.ensure_connection(dburi)
-    meta = MetaData()
-    anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
-                       schema='dailypdbadmclima')
+    registry = get_station_registry(conn)
+    spatial_index = StationSpatialIndex(registry.stations)
     all_stations = dict()
     new_stations = dict()
     num_records = 0
-    with conn.begin():
-        total_to_see = listdir(data_folder)
-        total_to_see_number = len(total_to_see)
-        for i, file_name in enumerate(total_to_see):
-            csv_path = join(data_folder, file_name)
-            msg = 'examine file %s/%s...' % (i+1, total_to_see_number)
-            print(msg)
-            msgs.append(msg)
-            if not isfile(csv_path) or splitext(file_name.lower())[1] != '.csv':
+    for i, num_files, num_file_records, file_stations in scan_stations(data_folder, workers):
+        msg = 'examine file %s/%s...' % (i+1, num_files)
+        print(msg)
+        msgs.append(msg)
+        num_records += num_file_records
+        for station_key, record_md in file_stations.items():
+            if station_key in all_stations:
                 continue
-            records = export.csv2data(csv_path)
-            for record in records:
-                num_records += 1
-                record_md = record[0]
-                station_key = (record_md['cod_utente'], record_md['cod_rete'],
-                               record_md['lat'], record_md['lon'])
-                if station_key in all_stations:
-                    continue
-                station_props = {
-                    'cod_rete': record_md['cod_rete'],
-                    'cod_utente': record_md['cod_utente'],
-                    'lat': record_md['lat'],
-                    'lon': record_md['lon'],
-                    'source': record_md['source'],
-                }
-                if record_md['format'] != 'ARPA-ER':
-                    raise ValueError('do not use the option --er for records not belonging to ER')
-                msg = """
-                examining the station: 
-                    cod_utente: %s 
-                    lat: %s
-                    lon: %s
-                    """ % (record_md['cod_utente'], record_md['lat'], record_md['lon'])
-                print(msg)
-                msgs.append(msg)
-                new_messages = get_er_station(conn, anag_table, **station_props)
-                for new_message in new_messages:
-                    print(new_message)
-                    msgs.append(new_message)
-                all_stations[station_key] = new_messages
+            if record_md['format'] != 'ARPA-ER':
+                raise ValueError('do not use the option --er for records not belonging to ER')
+            all_stations[station_key] = {
+                'cod_rete': record_md['cod_rete'],
+                'cod_utente': record_md['cod_utente'],
+                'lat': record_md['lat'],
+                'lon': record_md['lon'],
+                'source': record_md['source'],
+            }
+    # resolve all the stations in one batch, against the in-memory indexes
+    for station_key, station_props in all_stations.items():
+        msg = """
+        examining the station: 
+            cod_utente: %s 
+            lat: %s
+            lon: %s
+            """ % (station_props['cod_utente'], station_props['lat'], station_props['lon'])
+        print(msg)
+        msgs.append(msg)
+        new_messages = get_er_station(registry, spatial_index, **station_props)
+        for new_message in new_messages:
+            print(new_message)
+            msgs.append(new_message)
+        all_stations[station_key] = new_messages
     num_all_stations = len(all_stations)
     num_new_stations = len(new_stations)
     msg0 = "Examined %i records" % num_records
@@ -167,7 +434,7 @@ def find_new_er_stations(data_folder, dburi):
     return msgs, new_stations
 
 
-def find_new_stations(data_folder, dburi):
+def find_new_stations(data_folder, dburi, workers=1):
     """
     Find stations from a set of CSV files inside a folder `data_folder`, that are not
     present in the database and creates a CSV with the list.
@@ -175,32 +442,22 @@ def find_new_stations(data_folder, dburi):
 
     :param data_folder: folder path where CSV files are in
     :param dburi: db connection URI
+    :param workers: number of processes scanning the CSV files
     :return: ([list of report messages], {dict of not found stations})
     """
     msgs = []
     conn = db_utils.ensure_connection(dburi)
-    meta = MetaData()
-    anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
-                       schema='dailypdbadmclima')
+    registry = get_station_registry(conn)
     all_stations = dict()
     new_stations = dict()
     num_records = 0
     with conn.begin():
-        total_to_see = listdir(data_folder)
-        total_to_see_number = len(total_to_see)
-        for i, file_name in enumerate(total_to_see):
-            csv_path = join(data_folder, file_name)
-            msg = 'examine file %s/%s...' % (i+1, total_to_see_number)
+        for i, num_files, num_file_records, file_stations in scan_stations(data_folder, workers):
+            msg = 'examine file %s/%s...' % (i+1, num_files)
             print(msg)
             msgs.append(msg)
-            if not isfile(csv_path) or splitext(file_name.lower())[1] != '.csv':
-                continue
-            records = export.csv2data(csv_path)
-            for record in records:
-                num_records += 1
-                record_md = record[0]
-                station_key = (record_md['cod_utente'], record_md['cod_rete'],
-                               record_md['lat'], record_md['lon'])
+            num_records += num_file_records
+            for station_key, record_md in file_stations.items():
                 if station_key in all_stations:
                     continue
                 station_props = {
@@ -214,7 +471,7 @@ def find_new_stations(data_folder, dburi):
                         station_props['lat'] = record_md['lat']
                     if record_md['lon']:
                         station_props['lon'] = record_md['lon']
-                db_station = get_db_station(conn, anag_table, **station_props)
+                db_station = registry.get(**station_props)
                 all_stations[station_key] = db_station
                 if not db_station:  # NOT FOUND in the database
                     new_station = station_props
@@ -284,7 +541,7 @@ def load_main_station_groups(conn, group_table_name, schema="dailypdbanpacarica"
 
 def select_prec_records(conn, sql_fields='*', stations_ids=None, schema='dailypdbanpacarica',
                         include_flag_values=None, exclude_flag_interval=None, exclude_values=(),
-                        exclude_null=True, no_order=False):
+                        exclude_null=True, no_order=False, columnar=False):
     """
     Select all the records of the table ds__preci order by station, date.
     If  stations_ids is not None, filter also for station ids.
@@ -299,15 +556,18 @@ def select_prec_records(conn, sql_fields='*', stations_ids=None, schema='dailypd
     :param exclude_values: query excludes not none values in this iterable
     :param exclude_null: if True, excludes NULL values
     :param no_order: if False, sort results by station, date
+    :param columnar: if True, return the list view of a `db_utils.RecordStore`
     :return: the iterable of the results
     """
     conn_r = db_utils.get_safe_memory_read_connection(conn)
     sql = "SELECT %s FROM %s.ds__preci" % (sql_fields, schema)
     where_clauses = []
+    params = dict()
     if stations_ids is not None:
         if len(stations_ids) == 0:
             return []
-        where_clauses.append('cod_staz IN (%s)' % repr(list(stations_ids))[1:-1])
+        stations_where, params = db_utils.stations_filter(conn_r, stations_ids)
+        where_clauses.append(stations_where)
     if include_flag_values is not None:
         include_sql_str = repr(tuple(include_flag_values))
         if len(include_flag_values) == 1:
@@ -325,7 +585,9 @@ def select_prec_records(conn, sql_fields='*', stations_ids=None, schema='dailypd
     if not no_order:
         sql += ' ORDER BY cod_staz, data_i'
     # each record must be a list to make flag changeable:
-    results = conn_r.execute(sql)
+    results = conn_r.execute(sql, **params)
+    if columnar:
+        return db_utils.RecordStore.from_results(results).view()
     results = db_utils.results_list(results)
     return results
 
@@ -333,7 +595,8 @@ def select_prec_records(conn, sql_fields='*', stations_ids=None, schema='dailypd
 def select_temp_records(conn, fields, sql_fields='*', stations_ids=None,
                         schema='dailypdbanpacarica', include_flag_values=None,
                         exclude_flag_interval=None, exclude_values=(),
-                        exclude_null=True, where_sql=None, no_order=False):
+                        exclude_null=True, where_sql=None, no_order=False, columnar=False,
+                        where_params=None):
     """
     Select all the records of the table ds__t200 order by station, date.
     If  stations_ids is not None, filter also for station ids.
@@ -350,16 +613,20 @@ def select_temp_records(conn, fields, sql_fields='*', stations_ids=None,
     :param exclude_values: query excludes not none values in this iterable
     :param exclude_null: if True, excludes NULL values
     :param where_sql: if not None, add the selected where clause in sql
+    :param where_params: dictionary of the parameters bound in `where_sql`
     :param no_order: if True, sort results by station, date
+    :param columnar: if True, return the list view of a `db_utils.RecordStore`
     :return: the iterable of the results
     """
     conn_r = db_utils.get_safe_memory_read_connection(conn)
     sql = "SELECT %s FROM %s.ds__t200" % (sql_fields, schema)
     where_clauses = []
+    params = dict()
     if stations_ids is not None:
         if len(stations_ids) == 0:
             return []
-        where_clauses.append('cod_staz IN (%s)' % repr(list(stations_ids))[1:-1])
+        stations_where, params = db_utils.stations_filter(conn_r, stations_ids)
+        where_clauses.append(stations_where)
     if include_flag_values is not None:
         include_sql_str = repr(tuple(include_flag_values))
         if len(include_flag_values) == 1:
@@ -380,19 +647,23 @@ def select_temp_records(conn, fields, sql_fields='*', stations_ids=None,
             where_clauses.append('(%s).val_md IS NOT NULL' % field)
     if where_sql:
         where_clauses.append(where_sql)
+        params.update(where_params or {})
     if where_clauses:
         sql += ' WHERE %s' % (' AND '.join(where_clauses))
     if not no_order:
         sql += ' ORDER BY cod_staz, data_i'
-    results = conn_r.execute(sql)
+    results = conn_r.execute(sql, **params)
     # each record must be a list to make flag changeable:
+    if columnar:
+        return db_utils.RecordStore.from_results(results).view()
     results = db_utils.results_list(results)
     return results
 
 
 def select_records(conn, table, fields, sql_fields='*', stations_ids=None,
                    schema='dailypdbanpacarica', include_flag_values=None,
-                   exclude_flag_interval=None, where_sql=None, no_order=False):
+                   exclude_flag_interval=None, where_sql=None, no_order=False, columnar=False,
+                   where_params=None):
     """
     Select all the records of the table `table` order by station, date.
     If  stations_ids is not None, filter also for station ids.
@@ -409,16 +680,20 @@ def select_records(conn, table, fields, sql_fields='*', stations_ids=None,
     :param exclude_flag_interval: if not None, exclude fields where flag belongs to this interval
     :param exclude_null: if True, excludes NULL values
     :param where_sql: if not None, add the selected where clause in sql
+    :param where_params: dictionary of the parameters bound in `where_sql`
     :param no_order: if True, sort results by station, date
+    :param columnar: if True, return the list view of a `db_utils.RecordStore`
     :return: the iterable of the results
     """
     conn_r = db_utils.get_safe_memory_read_connection(conn)
     sql = "SELECT %s FROM %s.%s" % (sql_fields, schema, table)
     where_clauses = []
+    params = dict()
     if stations_ids is not None:
         if len(stations_ids) == 0:
             return []
-        where_clauses.append('cod_staz IN (%s)' % repr(list(stations_ids))[1:-1])
+        stations_where, params = db_utils.stations_filter(conn_r, stations_ids)
+        where_clauses.append(stations_where)
     if include_flag_values is not None:
         include_sql_str = repr(tuple(include_flag_values))
         if len(include_flag_values) == 1:
@@ -432,11 +707,14 @@ def select_records(conn, table, fields, sql_fields='*', stations_ids=None,
             where_clauses.append(clause)
     if where_sql:
         where_clauses.append(where_sql)
+        params.update(where_params or {})
     if where_clauses:
         sql += ' WHERE %s' % (' AND '.join(where_clauses))
     if not no_order:
         sql += ' ORDER BY cod_staz, data_i'
-    results = conn_r.execute(sql)
+    results = conn_r.execute(sql, **params)
     # each record must be a list to make flag changeable:
+    if columnar:
+        return db_utils.RecordStore.from_results(results).view()
     results = db_utils.results_list(results)
     return results
@@ -1,7 +1,9 @@
 """
 This module contains functions and utilities that compute when seasons starts/ends
 """
-from datetime import date, datetime
+from datetime import date
+
+import numpy as np
 
 SOLSTICE_MONTH_DEFAULT = 6
 SOLSTICE_DAY_DEFAULT = 21
@@ -156,6 +158,65 @@ def get_equinox(year, of_september=True):
     return ret_value
 
 
+def build_season_table():
+    """
+    Build the table of the seasons, one row for each year from MIN_YEAR to MAX_YEAR.
+    Each row contains the ordinals (see `date.toordinal`) of
+    (june solstice, september equinox, march equinox, december solstice).
+
+    :return: a numpy array of shape (MAX_YEAR - MIN_YEAR + 1, 4)
+    """
+    table = np.empty((MAX_YEAR - MIN_YEAR + 1, 4), dtype=np.int64)
+    for index, year in enumerate(range(MIN_YEAR, MAX_YEAR + 1)):
+        table[index] = [
+            get_solstice(year).toordinal(),
+            get_equinox(year).toordinal(),
+            get_equinox(year, of_september=False).toordinal(),
+            get_solstice(year, of_june=False).toordinal(),
+        ]
+    return table
+
+
+SEASON_TABLE = build_season_table()
+SEASON_ROWS = [tuple(row) for row in SEASON_TABLE.tolist()]
+
+
+def season_table_lookup(days):
+    """
+    Return the rows of SEASON_TABLE and the ordinals of the input `days`.
+
+    :param days: list of date or datetime objects
+    :return: (rows, ordinals)
+    """
+    years = np.fromiter((d.year for d in days), dtype=np.int64, count=len(days))
+    if years.size and (years.min() < MIN_YEAR or years.max() > MAX_YEAR):
+        raise ValueError('cannot compute seasons for %r: year out of range' % days)
+    ordinals = np.fromiter((d.toordinal() for d in days), dtype=np.int64, count=len(days))
+    return SEASON_TABLE[years - MIN_YEAR], ordinals
+
+
+def days_in_summer(days):
+    """
+    Return a boolean array telling which of the input `days` are in summer season.
+
+    :param days: list of date or datetime objects
+    :return: numpy array of booleans
+    """
+    rows, ordinals = season_table_lookup(days)
+    return (rows[:, 0] <= ordinals) & (ordinals <= rows[:, 1])
+
+
+def days_in_winter(days):
+    """
+    Return a boolean array telling which of the input `days` are in winter season.
+
+    :param days: list of date or datetime objects
+    :return: numpy array of booleans
+    """
+    rows, ordinals = season_table_lookup(days)
+    return (ordinals <= rows[:, 2]) | (ordinals >= rows[:, 3])
+
+
 def is_day_in_summer(day):
     """
     Return if the input datetime `day` is in summer season or not.
@@ -163,12 +224,11 @@ def is_day_in_summer(day):
     :param day: input datetime object
     :return: True or False
     """
-    if isinstance(day, datetime):
-        day = day.date()
     year = day.year
-    start_summer = get_solstice(year)
-    end_summer = get_equinox(year)
-    return start_summer <= day <= end_summer
+    if year > MAX_YEAR or year < MIN_YEAR:
+        raise ValueError('cannot compute seasons for %r: year out of range' % day)
+    start_summer, end_summer = SEASON_ROWS[year - MIN_YEAR][:2]
+    return start_summer <= day.toordinal() <= end_summer
 
 
 def is_day_in_winter(day):
@@ -178,9 +238,9 @@ def is_day_in_winter(day):
     :param day: input datetime object
     :return: True or False
     """
-    if isinstance(day, datetime):
-        day = day.date()
     year = day.year
-    start_winter = get_solstice(year, of_june=False)
-    end_winter = get_equinox(year, of_september=False)
-    return day <= end_winter or day >= start_winter
+    if year > MAX_YEAR or year < MIN_YEAR:
+        raise ValueError('cannot compute seasons for %r: year out of range' % day)
+    end_winter, start_winter = SEASON_ROWS[year - MIN_YEAR][2:]
+    ordinal = day.toordinal()
+    return ordinal <= end_winter or ordinal >= start_winter
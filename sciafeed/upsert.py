@@ -7,7 +7,10 @@ import logging
 import time
 import traceback
 
-from sqlalchemy import MetaData, Table
+from psycopg2.extensions import register_type
+from psycopg2.extras import execute_values, register_composite
+from sqlalchemy import Column, MetaData, Table
+from sqlalchemy.sql import column, table as table_clause
 
 from sciafeed import LOG_NAME
 from sciafeed import db_utils
@@ -186,6 +189,59 @@ class2subfields_map = {
 }
 
 
+def split_stations(registry, stations):
+    """
+    Split the input stations in the new ones and the ones already in the `registry`
+    (matched by cod_rete and cod_utente). The existing stations get their 'id_staz';
+    if an existing station is repeated in `stations`, the last one is considered (and
+    reported once in the messages).
+
+    :param registry: the station registry (see `querying.get_station_registry`)
+    :param stations: list of dictionaries of the input stations
+    :return: (new_stations, updated_stations, msgs)
+    """
+    msgs = []
+    new_stations = []
+    updated_stations = dict()
+    for station in stations:
+        db_station = registry.get(cod_rete=station['cod_rete'], cod_utente=station['cod_utente'])
+        if db_station:
+            station['id_staz'] = db_station['id_staz']
+            updated_stations[db_station['id_staz']] = station
+        else:
+            new_stations.append(station)
+    for id_staz in updated_stations:
+        msgs.append('updated existing station id_staz=%s' % id_staz)
+    return new_stations, list(updated_stations.values()), msgs
+
+
+def bulk_update_stations(conn, anag_table, stations):
+    """
+    Update the existing stations of the table `anag_table` with 2 statements: the stations
+    are loaded in a temporary staging table, and the table is updated from it.
+    It assumes all stations are dictionaries with the same keys, including 'id_staz'.
+
+    :param conn: db connection object
+    :param anag_table: table object of the stations
+    :param stations: list of dictionaries of the stations to update
+    :return: the number of updated stations
+    """
+    if not stations:
+        return 0
+    fields = list(stations[0].keys())
+    staging_name = '%s_staging' % anag_table.name
+    conn.execute('CREATE TEMPORARY TABLE %s ON COMMIT DROP AS SELECT %s FROM %s.%s WITH NO DATA'
+                 % (staging_name, ','.join(fields), anag_table.schema, anag_table.name))
+    staging_table = Table(staging_name, MetaData(),
+                          *[Column(f, anag_table.c[f].type) for f in fields])
+    conn.execute(staging_table.insert().values(stations))
+    update_obj = anag_table.update().where(
+        anag_table.c.id_staz == staging_table.c.id_staz).values(
+        {f: staging_table.c[f] for f in fields if f != 'id_staz'})
+    results = conn.execute(update_obj.returning(anag_table.c.id_staz))
+    return len(results.fetchall())
+
+
 def upsert_stations(dburi, stations_path):
     """
     Load a list of stations from a CSV file located at `stations_path` and insert them
@@ -200,10 +256,7 @@ def upsert_stations(dburi, stations_path):
     msgs = []
     upserted_ids = []
     conn = db_utils.ensure_connection(dburi)
-    meta = MetaData()
-    anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
-                       schema='dailypdbadmclima')
-    update_obj = anag_table.update()
+    anag_table = db_utils.get_table('anag__stazioni', 'dailypdbadmclima', conn.engine)
     insert_obj = anag_table.insert()
     try:
         stations = export.csv2items(
@@ -213,26 +266,19 @@ def upsert_stations(dburi, stations_path):
     except ValueError as err:
         msgs = [str(err)]
         return msgs, upserted_ids
-    new_stations = []
-    num_updated_stations = 0
+    registry = querying.get_station_registry(conn, refresh=True)
+    new_stations, updated_stations, msgs = split_stations(registry, stations)
     try:
-        for station in stations:
-            db_station = querying.get_db_station(
-                conn, anag_table, cod_rete=station['cod_rete'], cod_utente=station['cod_utente'])
-            if db_station:
-                where_clause = anag_table.c.id_staz == db_station['id_staz']
-                station['id_staz'] = db_station['id_staz']
-                conn.execute(update_obj.where(where_clause).values(**station))
-                num_updated_stations += 1
-                msgs.append('updated existing station id_staz=%s' % db_station['id_staz'])
-            else:
-                new_stations.append(station)
-        if new_stations:
-            conn.execute(insert_obj.values(new_stations))
+        with conn.begin():
+            num_updated_stations = bulk_update_stations(conn, anag_table, updated_stations)
+            if new_stations:
+                conn.execute(insert_obj.values(new_stations))
     except:
         error = traceback.format_exc()
         msgs.append(error)
         return msgs, 0, 0
+    finally:
+        querying.invalidate_station_registry(conn)
     num_inserted_stations = len(new_stations)
     msgs.append('inserted %i new stations' % num_inserted_stations)
     msgs.append('updated %i new stations' % num_updated_stations)
@@ -271,8 +317,7 @@ def update_prec_flags(conn, records, schema='dailypdbanpacarica', logger=None):
     for cmd in pre_sql_cmds:
         conn.execute(cmd)
     logger.debug('created temp folder')
-    meta = MetaData()
-    table_obj = Table(tmp_table_name, meta, autoload=True, autoload_with=conn.engine)
+    table_obj = table_clause(tmp_table_name, column('cod_staz'), column('data_i'), column('flag'))
     num_of_updates = 0
     try:
         data = [{'cod_staz': r[0], 'data_i': r[1], 'flag': r[3]} for r in records]
@@ -334,8 +379,7 @@ def update_vntmd_flags(conn, records, schema='dailypdbanpacarica', flag_index=3,
     for cmd in pre_sql_cmds:
         conn.execute(cmd)
     logger.debug('created temp folder')
-    meta = MetaData()
-    table_obj = Table(tmp_table_name, meta, autoload=True, autoload_with=conn.engine)
+    table_obj = table_clause(tmp_table_name, column('cod_staz'), column('data_i'), column('flag'))
     num_of_updates = 0
     try:
         data = [{'cod_staz': r[0], 'data_i': r[1], 'flag': r[flag_index]} for r in records]
@@ -397,8 +441,7 @@ def update_flags(conn, records, table, schema='dailypdbanpacarica', db_field='tm
     for cmd in pre_sql_cmds:
         conn.execute(cmd)
     logger.debug('created temp folder')
-    meta = MetaData()
-    table_obj = Table(tmp_table_name, meta, autoload=True, autoload_with=conn.engine)
+    table_obj = table_clause(tmp_table_name, column('cod_staz'), column('data_i'), column('flag'))
     num_of_updates = 0
     try:
         data = [{'id_record': i, 'cod_staz': r[0], 'data_i': r[1], 'flag': r[flag_index]}
@@ -422,11 +465,50 @@ def update_flags(conn, records, table, schema='dailypdbanpacarica', db_field='tm
     return num_of_updates
 
 
+def flatten_composite(value):
+    """
+    Return the list of the leaf values of a (nested) composite value.
+    For example: ((1, 2), 3.5, None) -> [1, 2, 3.5, None]
+
+    :param value: the composite value, as (nested) tuple or list
+    :return: the list of the values
+    """
+    ret_value = []
+    for item in value:
+        if isinstance(item, (tuple, list)):
+            ret_value.extend(flatten_composite(item))
+        else:
+            ret_value.append(item)
+    return ret_value
+
+
+def encode_composite(value):
+    """
+    Return the list of the values of the subfields of a composite value, as strings.
+    For example: ((1, 2), 3.5, None) -> ['1', '2', '3.5', 'NULL']
+    Values blank or 'None' are returned with the string 'NULL'.
+
+    :param value: the composite value, as string (i.e. '("(1,2)",,,)') or (nested) tuple
+    :return: the list of the values of the subfields
+    """
+    if isinstance(value, str):
+        values = value.replace('(', '').replace(')', '').replace("'", "").replace('"', '').\
+            replace('[', '').replace(']', '').split(',')
+    else:
+        values = flatten_composite(value)
+    ret_value = []
+    for item in values:
+        item = item is not None and str(item).strip() or ''
+        ret_value.append(item not in ('', 'None') and item or 'NULL')
+    return ret_value
+
+
 def expand_record(record):
     """
     Get an input record (dictionary) and return a new record with the not null values specified
     by the complete name of the key.
     For example: {'prec24': '("(1,2)",,,)'} -> {'prec24.flag.ndati':1, 'prec24.flag.wht':2}
+    The values of the composite fields can be strings or (nested) tuples (see `encode_composite`).
     Values blank or 'None' are returned with the string 'NULL'.
 
     :param record: input record (as dictionary)
@@ -440,15 +522,96 @@ def expand_record(record):
             if value is None:
                 new_values = ['NULL'] * len(subfields)
             else:
-                new_values = [r.strip() not in ('', 'None') and r.strip() or 'NULL'
-                              for r in value.replace('(', '').replace(')', '').replace("'", "").
-                              replace('"', '').replace('[', '').replace(']', '').split(',')]
+                new_values = encode_composite(value)
             for i, subfield in enumerate(subfields):
                 record["%s.%s" % (field, subfield)] = new_values[i]
             del record[field]
     return record
 
 
+def expand_typed_record(record):
+    """
+    Return a new record with the not null values of the input record (dictionary) specified
+    by the complete name of the key, as `expand_record` does, but without the null values
+    and keeping the types of the values of the composite fields given as (nested) tuples.
+    For example: {'tmdgg': ((24, 1), 9.3, None)} ->
+    {'tmdgg.flag.ndati': 24, 'tmdgg.flag.wht': 1, 'tmdgg.val_md': 9.3}
+
+    :param record: input record (as dictionary)
+    :return: new record with not null values expanded.
+    """
+    ret_value = dict()
+    for field, value in record.items():
+        if field not in field2class_map:
+            if value not in (None, '', 'NULL'):
+                ret_value[field] = value
+            continue
+        if value is None:
+            continue
+        subfields = class2subfields_map[field2class_map[field]]
+        if isinstance(value, str):
+            values = [v != 'NULL' and v or None for v in encode_composite(value)]
+        else:
+            values = flatten_composite(value)
+        for subfield, subvalue in zip(subfields, values):
+            if subvalue is not None and subvalue != '':
+                ret_value["%s.%s" % (field, subfield)] = subvalue
+    return ret_value
+
+
+# psycopg2 casters of the composite types, for each database (see `composite_casters`)
+COMPOSITE_CASTERS = dict()
+# counter of the names of the cursors of `composite_cursor`
+COMPOSITE_CURSORS_COUNTER = itertools.count()
+
+
+def composite_casters(dbapi_conn):
+    """
+    Return the psycopg2 casters of the composite types of `class2subfields_map` (and of
+    their composite attributes) of the database of the DBAPI connection `dbapi_conn`.
+    The catalog is queried only the first time for each database.
+
+    :param dbapi_conn: psycopg2 connection object
+    :return: the list of the casters
+    """
+    if dbapi_conn.dsn in COMPOSITE_CASTERS:
+        return COMPOSITE_CASTERS[dbapi_conn.dsn]
+    sql = """SELECT DISTINCT n.nspname, t.typname FROM pg_type t
+             JOIN pg_namespace n ON (n.oid = t.typnamespace)
+             WHERE t.typtype = 'c' AND (t.typname IN %(names)s OR t.oid IN (
+                SELECT a.atttypid FROM pg_type c JOIN pg_attribute a ON (a.attrelid = c.typrelid)
+                WHERE c.typname IN %(names)s AND a.attnum > 0))"""
+    names = tuple(class2subfields_map)
+    with dbapi_conn.cursor() as cursor:
+        cursor.execute(sql, {'names': names})
+        types = ['%s.%s' % r for r in cursor.fetchall()]
+        # the casters are registered only on this temporary cursor
+        casters = [register_composite(type_name, cursor) for type_name in types]
+    COMPOSITE_CASTERS[dbapi_conn.dsn] = casters
+    return casters
+
+
+def composite_cursor(conn):
+    """
+    Return a new server-side (named) DBAPI cursor of the connection `conn`, fetching
+    `db_utils.ITERSIZE` rows at a time, that reads the composite values of
+    `class2subfields_map` as tuples and not as strings. The other cursors of the
+    connection are not affected.
+    Note that the `description` of the cursor is set by the first fetch.
+
+    :param conn: db connection object
+    :return: the psycopg2 cursor
+    """
+    dbapi_conn = conn.connection.connection
+    casters = composite_casters(dbapi_conn)
+    cursor = dbapi_conn.cursor(name='composite_cursor_%s' % next(COMPOSITE_CURSORS_COUNTER))
+    cursor.itersize = db_utils.ITERSIZE
+    for caster in casters:
+        register_type(caster.typecaster, cursor)
+        register_type(caster.array_typecaster, cursor)
+    return cursor
+
+
 def expand_fields(fields):
     """
     Get an input list of fields and return a list of fields with the complete names specified.
@@ -487,16 +650,20 @@ def create_insert(table_name, schema, fields, data):
     return sql
 
 
-def create_upsert(table_name, schema, fields, data, policy):
-    # NOTE: fields not included in data[i] keys will be set to null for upsert policy
-    if not data or not fields:
-        return
-    insert_sql = create_insert(table_name, schema, fields, data)
-    insert_sql += " ON CONFLICT ON CONSTRAINT %s_pkey DO " % table_name
+def upsert_conflict_sql(table_name, fields, policy):
+    """
+    Return the ON CONFLICT clause of the upserts of `create_upsert` and `execute_upsert`.
+
+    :param table_name: name of the table
+    :param fields: list of the fields (with the complete names, see `expand_fields`)
+    :param policy: 'onlyinsert' or 'upsert'
+    :return: the SQL string
+    """
+    conflict_sql = " ON CONFLICT ON CONSTRAINT %s_pkey DO " % table_name
     if policy == 'onlyinsert':
-        insert_sql += 'NOTHING'
-        return insert_sql
-    insert_sql += 'UPDATE SET (%s) = ' % (','.join(fields))
+        conflict_sql += 'NOTHING'
+        return conflict_sql
+    conflict_sql += 'UPDATE SET (%s) = ' % (','.join(fields))
 
     fields2 = []
     for field in fields:
@@ -508,10 +675,43 @@ def create_upsert(table_name, schema, fields, data, policy):
             fields2.append("(EXCLUDED.%s).%s" % tokens)
         else:
             fields2.append("((EXCLUDED.%s).%s).%s" % tokens)
-    insert_sql += '(%s) ' % (','.join(fields2))
-    insert_sql += "WHERE %s.cod_staz = EXCLUDED.cod_staz AND %s.data_i = EXCLUDED.data_i" \
-                  % (table_name, table_name)
-    return insert_sql
+    conflict_sql += '(%s) ' % (','.join(fields2))
+    conflict_sql += "WHERE %s.cod_staz = EXCLUDED.cod_staz AND %s.data_i = EXCLUDED.data_i" \
+                    % (table_name, table_name)
+    return conflict_sql
+
+
+def create_upsert(table_name, schema, fields, data, policy):
+    # NOTE: fields not included in data[i] keys will be set to null for upsert policy
+    if not data or not fields:
+        return
+    insert_sql = create_insert(table_name, schema, fields, data)
+    return insert_sql + upsert_conflict_sql(table_name, fields, policy)
+
+
+def execute_upsert(conn, table_name, schema, fields, data, policy, page_size=1000):
+    """
+    Execute the upsert of `create_upsert`, passing the values of the records `data` as
+    parameters (with `psycopg2.extras.execute_values`) instead of SQL literals.
+    Fields not included in the records are set to NULL.
+
+    :param conn: db connection object
+    :param table_name: name of the table
+    :param schema: database schema to use
+    :param fields: list of the fields (with the complete names, see `expand_fields`)
+    :param data: list of records (dictionaries)
+    :param policy: 'onlyinsert' or 'upsert'
+    :param page_size: number of records sent in each statement
+    """
+    if not data or not fields:
+        return
+    sql = "INSERT INTO %s.%s (%s) VALUES %%s" % (schema, table_name, ','.join(fields))
+    sql += upsert_conflict_sql(table_name, fields, policy)
+    values = [[record.get(field) for field in fields] for record in data]
+    with conn.begin():
+        cursor = conn.connection.cursor()
+        execute_values(cursor, sql, values, page_size=page_size)
+        cursor.close()
 
 
 def upsert_items(conn, items, policy, schema, table_name, logger=None, find_cod_staz=False):
@@ -539,9 +739,9 @@ def upsert_items(conn, items, policy, schema, table_name, logger=None, find_cod_
     if not items:
         logger.warning('no items to upsert')
         return 0
-    meta = MetaData()
-    anag_table = Table('anag__stazioni', meta, autoload=True, autoload_with=conn.engine,
-                       schema='dailypdbadmclima')
+    registry = None
+    if find_cod_staz:
+        registry = querying.get_station_registry(conn)
     items.sort(key=lambda x: (x['cod_staz'], x['data_i']))
     group_by_station = lambda x: x['cod_staz']
     group_by_date = lambda x: x['data_i']
@@ -555,8 +755,7 @@ def upsert_items(conn, items, policy, schema, table_name, logger=None, find_cod_
         cod_staz = station
         if find_cod_staz:
             cod_utente, cod_rete = station.split('--', 2)
-            stat_obj = querying.get_db_station(
-                conn, anag_table, cod_rete=cod_rete, cod_utente=cod_utente)
+            stat_obj = registry.get(cod_rete=cod_rete, cod_utente=cod_utente)
             if not stat_obj:
                 logger.error("station cod_rete=%s, cod_utente=%s not found. Records ignored."
                              % (cod_rete, cod_utente))
@@ -580,6 +779,111 @@ def upsert_items(conn, items, policy, schema, table_name, logger=None, find_cod_
     return upserted
 
 
+def stream_upsert_items(conn, items, policy, schema, table_name, logger=None, batch_size=10000):
+    """
+    Insert (or update if not exists) items into the database, as `upsert_items`, reading
+    them from an iterable and writing them in batches of `batch_size` (station, day) records,
+    so that the memory used does not depend on the number of items.
+    It assumes the items are grouped by station and day (i.e. they are not sorted here).
+
+    :param conn: db connection object
+    :param items: iterable of dictionaries to be upserted. They must be the same for keys
+    :param policy: 'onlyinsert' or 'upsert'
+    :param schema: database schema to use
+    :param table_name: name of the table
+    :param logger: logging object where to report actions
+    :param batch_size: number of records upserted at a time
+    :return number of updates
+    """
+    if logger is None:
+        logger = logging.getLogger(LOG_NAME)
+    items = iter(items)
+    first_item = next(items, None)
+    if first_item is None:
+        logger.warning('no items to upsert')
+        return 0
+    writer = DbWriter(conn, table_name, schema, policy, list(first_item.keys()), batch_size)
+    for item in itertools.chain([first_item], items):
+        writer.writerow(item)
+    writer.close()
+    return writer.upserted
+
+
+class DbWriter:
+    """
+    Writer of indicators rows into the table `table_name` of the database, with the interface
+    of the CSV writers of `utils.open_csv_writers` (used by `compute.compute_and_store`).
+    Rows are buffered and upserted in batches of `batch_size` (station, day) records;
+    rows of the same (station, day) are merged, as in `upsert_items`, if they are in the same
+    batch (i.e. if the rows are grouped by (station, day)).
+    If `csv_writer` is not None, the rows are also written on it.
+    """
+
+    def __init__(self, conn, table_name, schema, policy, columns, batch_size=10000,
+                 csv_writer=None):
+        self.conn = conn
+        self.table_name = table_name
+        self.schema = schema
+        self.policy = policy
+        self.fields = expand_fields(columns)
+        self.batch_size = batch_size
+        self.csv_writer = csv_writer
+        self.data = dict()
+        self.upserted = 0
+
+    def writerow(self, row):
+        if self.csv_writer is not None:
+            self.csv_writer[0].writerow(row)
+        record = expand_typed_record(row)
+        key = (record['cod_staz'], record['data_i'])
+        if key in self.data:
+            self.data[key].update(record)
+            return
+        # flush only on a new (station, day), so that consecutive rows of a record are merged
+        if len(self.data) >= self.batch_size:
+            self.flush()
+        self.data[key] = record
+
+    def flush(self):
+        """
+        Upsert the buffered records.
+        """
+        if not self.data:
+            return
+        execute_upsert(
+            self.conn, self.table_name, self.schema, self.fields, list(self.data.values()),
+            self.policy)
+        self.upserted += len(self.data)
+        self.data = dict()
+
+    def close(self):
+        self.flush()
+        if self.csv_writer is not None:
+            self.csv_writer[1].close()
+
+
+def open_db_writers(conn, schema, tables_map, policy, csv_writers=None, batch_size=10000):
+    """
+    Return a dictionary of DbWriter objects for the tables of `tables_map`, with the structure
+    of the output of `utils.open_csv_writers`, so that `utils.close_csv_writers` flushes them.
+    If `csv_writers` is not None, the rows are also written on its CSV writers.
+
+    :param conn: db connection object
+    :param schema: database schema to use
+    :param tables_map: dictionary {table: columns}
+    :param policy: 'onlyinsert' or 'upsert'
+    :param csv_writers: None or the output of `utils.open_csv_writers`
+    :param batch_size: number of records upserted at a time
+    :return: the dictionary of the writers
+    """
+    writers = dict()
+    for table, columns in tables_map.items():
+        csv_writer = csv_writers and csv_writers.get(table) or None
+        writer = DbWriter(conn, table, schema, policy, columns, batch_size, csv_writer)
+        writers[table] = writer, writer
+    return writers
+
+
 def choose_main_record(records, master_field):
     """
     Choose the first one of the input records that has the field `master_field` valid and not null.
@@ -614,7 +918,7 @@ def load_unique_data_table(dburi, table_name, master_field, startschema, targets
     conn = db_utils.ensure_connection(dburi)
     conn_r = db_utils.get_safe_memory_read_connection(conn)
     logger = logging.getLogger(logger_name)
-    group_funct = lambda r: (r[0], r[1])  # idgruppo, data_i
+    group_funct = lambda r: (r['idgruppo'], r['data_i'])
 
     logger.info('* start working on table %s' % table_name)
     logger.info(' selecting data on table %s' % table_name)
@@ -622,7 +926,12 @@ def load_unique_data_table(dburi, table_name, master_field, startschema, targets
              FROM %s.%s JOIN %s.%s ON (id_staz=cod_staz)
              ORDER BY (idgruppo, data_i, progstazione)""" \
           % (startschema, table_name, gruppi_tschema, gruppi_tname, startschema, table_name)
-    results = conn_r.execute(sql)
+    cursor = composite_cursor(conn_r)
+    cursor.execute(sql)
+    rows = iter(cursor)
+    first_rows = list(itertools.islice(rows, 1))
+    columns = [c.name for c in cursor.description or ()]
+    results = (dict(zip(columns, r)) for r in itertools.chain(first_rows, rows))
     inserted = 0
     logger.info(' start merge&insert on table %s' % table_name)
     cols = db_utils.get_table_columns(table_name, targetschema)
@@ -643,6 +952,7 @@ def load_unique_data_table(dburi, table_name, master_field, startschema, targets
                 sql = create_insert(table_name, targetschema, fields, data)
                 conn.execute(sql)
                 data = []
+    cursor.close()
     if data:
         sql = create_insert(table_name, targetschema, fields, data)
         conn.execute(sql)
@@ -6,6 +6,7 @@ from datetime import datetime, timedelta
 import gzip
 import itertools
 import logging
+import math
 import os
 import os.path
 import random
@@ -16,6 +17,27 @@ import xlrd
 from sciafeed import LOG_NAME
 
 
+EARTH_RADIUS = 6370986  # meters, the same sphere used by PostGIS ST_DistanceSphere
+
+
+def distance_sphere(lon1, lat1, lon2, lat2):
+    """
+    Return the distance in meters between 2 points on the Earth, using the haversine
+    formula on a sphere.
+
+    :param lon1: longitude of the first point (degrees)
+    :param lat1: latitude of the first point (degrees)
+    :param lon2: longitude of the second point (degrees)
+    :param lat2: latitude of the second point (degrees)
+    :return: the distance in meters
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    hav = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(hav)))
+
+
 def is_float(value):
     try:
         float(value)
@@ -148,3 +148,15 @@ def test_csv_writers(tmpdir):
         writer, fp = writers[key]
         assert fp.mode == 'a'
     utils.close_csv_writers(writers)
+
+
+def test_distance_sphere():
+    assert utils.distance_sphere(11.79314, 43.90708, 11.79314, 43.90708) == 0
+    # 1 degree of latitude
+    distance = utils.distance_sphere(11, 43, 11, 44)
+    assert round(distance) == 111195
+    # symmetric
+    distance1 = utils.distance_sphere(8.31, 39.14, 11.79314, 43.90708)
+    distance2 = utils.distance_sphere(11.79314, 43.90708, 8.31, 39.14)
+    assert round(distance1, 6) == round(distance2, 6)
+    assert 600000 < distance1 < 610000
@@ -0,0 +1,33 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from sciafeed import spring
+
+
+def test_days_in_seasons():
+    days = [date(1903, 1, 1) + timedelta(days=i) for i in range(366 * 3)]
+    days += [datetime(2020, 6, 20, 12), datetime(2020, 9, 22, 23), datetime(2020, 12, 20)]
+    summer = spring.days_in_summer(days)
+    winter = spring.days_in_winter(days)
+    for day, in_summer, in_winter in zip(days, summer, winter):
+        start_summer = spring.get_solstice(day.year)
+        end_summer = spring.get_equinox(day.year)
+        start_winter = spring.get_solstice(day.year, of_june=False)
+        end_winter = spring.get_equinox(day.year, of_september=False)
+        only_day = day.date() if isinstance(day, datetime) else day
+        expected_summer = start_summer <= only_day <= end_summer
+        expected_winter = only_day <= end_winter or only_day >= start_winter
+        assert in_summer == spring.is_day_in_summer(day) == expected_summer
+        assert in_winter == spring.is_day_in_winter(day) == expected_winter
+    assert spring.days_in_summer([]).tolist() == []
+    with pytest.raises(ValueError):
+        spring.days_in_winter([date(2020, 1, 1), date(1500, 1, 1)])
+    with pytest.raises(ValueError) as err:
+        spring.is_day_in_summer(date(2200, 7, 1))
+    assert str(err.value) == \
+        'cannot compute seasons for datetime.date(2200, 7, 1): year out of range'
+    with pytest.raises(ValueError) as err:
+        spring.is_day_in_winter(date(1500, 1, 1))
+    assert str(err.value) == \
+        'cannot compute seasons for datetime.date(1500, 1, 1): year out of range'
@@ -2,6 +2,8 @@
 from datetime import datetime, date
 from os.path import exists
 
+import pytest
+
 from sciafeed import export
 
 
@@ -86,3 +88,63 @@ def test_csv2data(tmpdir):
 
     imported_data = export.csv2data(csv_filepath)
     assert imported_data == data
+
+
+def test_iter_csv_items(tmpdir):
+    csv_path = str(tmpdir.join('ds__t200.csv'))
+    with open(csv_path, 'w') as fp:
+        fp.write('data_i;cod_staz;cod_aggr;tmxgg\n')
+        fp.write('2018-01-01 00:00:00;2;4;((24, 1), 11.5)\n')
+        fp.write('2018-01-02 00:00:00;2;4;\n')
+        fp.write('2018-01-01 00:00:00;10;4;((24, 1), 9.3)\n')
+    items = export.iter_csv_items(csv_path, stations_ids=[10, 3])
+    assert not isinstance(items, list)
+    assert list(items) == [
+        {'data_i': '2018-01-01 00:00:00', 'cod_staz': '10', 'cod_aggr': '4',
+         'tmxgg': '((24, 1), 9.3)'}
+    ]
+    assert list(export.iter_csv_items(csv_path)) == export.csv2items(csv_path)
+    assert export.csv_grouped_by_station(csv_path)
+
+    with open(csv_path, 'a') as fp:
+        fp.write('2018-01-02 00:00:00;2;4;\n')
+    assert not export.csv_grouped_by_station(csv_path)
+    with open(csv_path, 'w') as fp:
+        fp.write('data_i;cod_staz;cod_aggr;tmxgg\n')
+        fp.write('2018-01-02 00:00:00;2;4;\n')
+        fp.write('2018-01-01 00:00:00;2;4;((24, 1), 11.5)\n')
+    assert not export.csv_grouped_by_station(csv_path)
+
+    items = export.iter_grouped_items(export.iter_csv_items(csv_path))
+    assert next(items)['data_i'] == '2018-01-02 00:00:00'
+    with pytest.raises(export.UngroupedItemsError) as err:
+        next(items)
+    assert str(err.value) == 'rows of station 2 are not sorted by day'
+    items = [{'cod_staz': '2', 'data_i': '2018-01-01'}, {'cod_staz': '3', 'data_i': '2018-01-01'},
+             {'cod_staz': '2', 'data_i': '2018-01-02'}]
+    with pytest.raises(export.UngroupedItemsError) as err:
+        list(export.iter_grouped_items(items))
+    assert str(err.value) == 'rows of station 2 are not grouped'
+    assert list(export.iter_grouped_items(items[:2])) == items[:2]
+
+
+def test_csv2stations(tmpdir):
+    metadata1 = {'cod_utente': '70001', 'cod_rete': '11', 'source': 'afile/path',
+                 'format': 'arpa19', 'lat': '', 'lon': ''}
+    metadata2 = {'cod_utente': '70002', 'cod_rete': '11', 'source': 'afile/path',
+                 'format': 'arpa19', 'lat': '43.1', 'lon': '11.2'}
+    data = [
+        (metadata1, datetime(2013, 1, 1, 0, 0), '1', 9.0, True),
+        (metadata2, datetime(2013, 1, 1, 1, 0), '2', 355.0, False),
+        (metadata1, datetime(2013, 1, 1, 2, 0), '3', 68.0, True),
+    ]
+    out_filepath = str(tmpdir.join('datafile.csv'))
+    export.export2csv(data, out_filepath)
+    num_records, stations = export.csv2stations(out_filepath)
+    assert num_records == 3
+    assert stations == {
+        ('70001', '11', '', ''): metadata1,
+        ('70002', '11', '43.1', '11.2'): metadata2,
+    }
+    # the same metadata of csv2data
+    assert list(stations.values()) == [d[0] for d in export.csv2data(out_filepath)[:2]]
@@ -1,5 +1,11 @@
 
+from datetime import datetime
+from decimal import Decimal
+from os.path import exists
+
+import numpy as np
 import pytest
+from sqlalchemy import create_engine
 
 from sciafeed import db_utils
 
@@ -26,3 +32,182 @@ def test_get_table_columns():
     result = db_utils.get_table_columns(table_name, schema='dailypdbanpacarica')
     assert result == expected_result
 
+
+def test_get_table(tmpdir, monkeypatch):
+    db_path = str(tmpdir.join('test.sqlite'))
+    engine = create_engine('sqlite:///%s' % db_path)
+    engine.execute('CREATE TABLE mytable (cod_staz integer, data_i text)')
+    cache_folder = str(tmpdir.mkdir('cache'))
+    monkeypatch.setattr(db_utils, 'REFLECTION_CACHE_FOLDER', cache_folder)
+    monkeypatch.setattr(db_utils, 'REFLECTION_CACHE_PATHS', dict())
+    try:
+        table_obj = db_utils.get_table('mytable', schema='main', engine=engine)
+        assert [c.name for c in table_obj.columns] == ['cod_staz', 'data_i']
+        # reflected only once
+        assert db_utils.get_table('mytable', schema='main', engine=engine) is table_obj
+        # persisted
+        cache_path = db_utils.reflection_cache_path(engine, 'main')
+        assert cache_path.startswith(cache_folder)
+        assert exists(cache_path)
+        # loaded from the persisted file in a new run
+        db_utils.REFLECTION_CACHE.clear()
+        db_utils.REFLECTION_CACHE_PATHS.clear()
+        assert 'main.mytable' in db_utils.get_schema_metadata(engine, 'main').tables
+        # a change of the schema invalidates the persisted file
+        engine.execute('ALTER TABLE mytable ADD COLUMN par_value real')
+        db_utils.REFLECTION_CACHE.clear()
+        db_utils.REFLECTION_CACHE_PATHS.clear()
+        assert db_utils.reflection_cache_path(engine, 'main') != cache_path
+        table_obj2 = db_utils.get_table('mytable', schema='main', engine=engine)
+        assert [c.name for c in table_obj2.columns] == ['cod_staz', 'data_i', 'par_value']
+        # clear the cache
+        db_utils.clear_reflection_cache(engine)
+        assert not exists(cache_path)
+        assert not exists(db_utils.reflection_cache_path(engine, 'main'))
+        engine.execute('DROP TABLE mytable')
+        with pytest.raises(Exception):
+            db_utils.get_table('mytable', schema='main', engine=engine)
+    finally:
+        db_utils.clear_reflection_cache(engine)
+
+
+def test_get_safe_memory_read_connection(tmpdir):
+    db_path = str(tmpdir.join('test.sqlite'))
+    engine = create_engine('sqlite:///%s' % db_path)
+    conn = engine.connect()
+    try:
+        conn_r = db_utils.get_safe_memory_read_connection(conn)
+        assert conn_r is not conn
+        assert conn_r._execution_options['stream_results']
+        # already optimized
+        assert db_utils.get_safe_memory_read_connection(conn_r) is conn_r
+        # reused
+        assert db_utils.get_safe_memory_read_connection(conn) is conn_r
+        # cleanup
+        db_utils.close_read_connections()
+        assert conn_r.closed
+        assert not conn.closed
+        conn_r2 = db_utils.get_safe_memory_read_connection(conn)
+        assert conn_r2 is not conn_r
+    finally:
+        db_utils.close_read_connections()
+        conn.close()
+
+
+def test_stations_filter():
+    conn = None  # not used for small sets
+    assert db_utils.stations_filter(conn, None) == ('1=1', {})
+    assert db_utils.stations_filter(conn, []) == ('cod_staz IN (NULL)', {})
+    where_sql, params = db_utils.stations_filter(conn, [3, 1, 2, 1])
+    assert where_sql == 'cod_staz = ANY(%(stations_ids)s)'
+    assert params == {'stations_ids': [1, 2, 3]}
+    where_sql, params = db_utils.stations_filter(conn, (1, ), column='id_staz')
+    assert where_sql == 'id_staz = ANY(%(stations_ids)s)'
+    assert params == {'stations_ids': [1]}
+
+
+class DummyReadConnection:
+    def __init__(self, engine):
+        self.engine = engine
+        self.executed = []
+
+    def execution_options(self, **kwargs):
+        return self
+
+    def execute(self, sql, **kwargs):
+        self.executed.append(sql)
+        return self
+
+    def scalar(self):
+        return None
+
+
+def test_stations_filter_large_sets(monkeypatch):
+    stations_ids = list(range(db_utils.STATIONS_TEMP_TABLE_THRESHOLD + 1, 0, -1))
+    # temporary table of the ids
+    conn = DummyReadConnection(engine='an engine')
+    where_sql, params = db_utils.stations_filter(conn, stations_ids)
+    assert where_sql.startswith('cod_staz IN (SELECT cod_staz FROM stations_')
+    assert params == {}
+    assert len(conn.executed) == 4
+    assert conn.executed[1].startswith('CREATE TEMP TABLE stations_')
+    # no temporary tables on the read-replica
+    monkeypatch.setattr(db_utils, 'READ_ENGINE', 'a read engine')
+    conn = DummyReadConnection(engine='a read engine')
+    where_sql, params = db_utils.stations_filter(conn, stations_ids)
+    assert where_sql == 'cod_staz = ANY(%(stations_ids)s::integer[])'
+    assert params == {'stations_ids': sorted(stations_ids)}
+    assert conn.executed == []
+
+
+def test_record_store():
+    results = [
+        (1, datetime(2020, 1, 1), 'bagna', Decimal('1.5'), 1),
+        (1, datetime(2020, 1, 2), 'bagna', None, -9),
+        (2, datetime(2020, 1, 1), 'bagna', 3, 1),
+        (3, datetime(2020, 1, 1), 'bagna', 2.5, 1),
+    ]
+    store = db_utils.RecordStore.from_results(results, batch_size=3)
+    assert len(store) == 4
+    assert store.stations.tolist() == [1, 1, 2, 3]
+    assert store.days.tolist() == [datetime(2020, 1, d).toordinal() for d in (1, 2, 1, 1)]
+    assert [c.values.dtype for c in store.columns] == [object, np.float64, np.int64]
+    assert store.station_offsets().tolist() == [0, 2, 3, 4]
+    records = store.view()
+    assert len(records) == 4
+    assert list(records) == [
+        [1, datetime(2020, 1, 1), 'bagna', 1.5, 1],
+        [1, datetime(2020, 1, 2), 'bagna', None, -9],
+        [2, datetime(2020, 1, 1), 'bagna', 3.0, 1],
+        [3, datetime(2020, 1, 1), 'bagna', 2.5, 1],
+    ]
+    # flags are changeable
+    record = records[-1]
+    record_copy = record[:]
+    record[-1] = -9
+    record[3] = None
+    assert records[3] == [3, datetime(2020, 1, 1), 'bagna', None, -9]
+    assert record_copy == [3, datetime(2020, 1, 1), 'bagna', 2.5, 1]
+    records[0][4] = None
+    assert store.columns[2].values.dtype == np.int64
+    assert records[0][4] is None and records[1][4] == -9
+    records[0][4] = 1.5
+    assert store.columns[2].values.dtype == np.float64
+    assert [r[4] for r in records] == [1.5, -9, 1, -9]
+    with pytest.raises(IndexError):
+        records[4]
+
+    store = db_utils.RecordStore.from_results([])
+    assert len(store) == 0
+    assert list(store.view()) == []
+    assert store.station_offsets().tolist() == [0]
+
+
+def test_record_store_batches():
+    # the type of the columns doesn't depend on the batches
+    results = [
+        (1, datetime(2020, 1, 1), None, None, None, Decimal('1.5')),
+        (1, datetime(2020, 1, 2), 'a', 1, None, Decimal('2')),
+        (1, datetime(2020, 1, 3), None, None, 3, None),
+        (2, datetime(2020, 1, 1), 'b', 2, -9, Decimal('-0.25')),
+    ]
+    for batch_size in (1, 2, 3, 4):
+        store = db_utils.RecordStore.from_results(results, batch_size=batch_size)
+        assert [c.values.dtype for c in store.columns] == [object, np.int64, np.int64, np.int64]
+        assert store.columns[3].scale == 2
+        records = [r[:] for r in store.view()]
+        assert records == [list(r) for r in results]
+        assert [type(v) for v in records[1][2:]] == [str, int, type(None), Decimal]
+        floats = store.float_column(1)
+        assert np.isnan(floats[[0, 2]]).all() and floats[[1, 3]].tolist() == [1.0, 2.0]
+        floats = store.float_column(3)
+        assert np.isnan(floats[2]) and floats[[0, 1, 3]].tolist() == [1.5, 2.0, -0.25]
+    store = db_utils.RecordStore.from_results(results, batch_size=1)
+    records = store.view()
+    # decimal values are exact, and the column is converted to fit the new values
+    records[0][5] = Decimal('0.125')
+    assert store.columns[3].scale == 3
+    assert [r[5] for r in records] == [Decimal('0.125'), 2, None, Decimal('-0.25')]
+    records[1][5] = 'x'
+    assert store.columns[3].values.dtype == object
+    assert [r[5] for r in records] == [Decimal('0.125'), 'x', None, Decimal('-0.25')]
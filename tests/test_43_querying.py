@@ -47,6 +47,67 @@ def test_get_db_station(conn):
     assert station.nome == 'Carloforte'
 
 
+def test_station_registry():
+    stations = [
+        {'id_staz': 1, 'nome': 'Carloforte', 'cod_utente': '00001', 'cod_rete': 14,
+         'lat': Decimal('39.14'), 'lon': Decimal('8.31')},
+        {'id_staz': 2, 'nome': 'Corniolo', 'cod_utente': '00002', 'cod_rete': 20,
+         'lat': Decimal('43.90708'), 'lon': Decimal('11.79314')},
+        {'id_staz': 3, 'nome': 'Corniolo', 'cod_utente': '00003', 'cod_rete': 20,
+         'lat': None, 'lon': None},
+    ]
+    registry = querying.StationRegistry(stations)
+    # query by id_staz
+    assert registry.get(id_staz=1) == stations[0]
+    assert registry.get(id_staz='2') == stations[1]
+    # query by (cod_utente, cod_rete)
+    assert registry.get(cod_utente='00002', cod_rete=20) == stations[1]
+    assert registry.get(cod_utente='00002', cod_rete='20') == stations[1]
+    # query with more results
+    assert registry.get(cod_rete=20) is None
+    assert len(registry.find(cod_rete=20)) == 2
+    # query without results
+    assert registry.get(cod_rete=1220) is None
+    # query with name should be case insensitive
+    assert registry.get(cod_rete=14, nome='carlo') is None
+    assert registry.get(cod_rete=14, nome='carloforte') == stations[0]
+    assert registry.get(cod_rete='20', nome='corniolo') is None
+    assert registry.get(cod_rete='20', nome='corniolo', lat='43.90708', lon='11.79314') \
+        == stations[1]
+    # None values are ignored
+    assert registry.get(cod_rete=14, cod_utente=None, nome='Carloforte') == stations[0]
+    # reload
+    registry.load(stations[1:])
+    assert registry.get(id_staz=1) is None
+    assert registry.get(id_staz=3) == stations[2]
+
+
+def test_station_spatial_index():
+    stations = [
+        {'id_staz': 1, 'lat': Decimal('43.90708'), 'lon': Decimal('11.79314')},
+        {'id_staz': 2, 'lat': Decimal('43.90900'), 'lon': Decimal('11.79314')},  # ~213m
+        {'id_staz': 3, 'lat': Decimal('43.91708'), 'lon': Decimal('11.79314')},  # ~1112m
+        {'id_staz': 4, 'lat': Decimal('39.14'), 'lon': Decimal('8.31')},
+        {'id_staz': 5, 'lat': None, 'lon': None},
+    ]
+    spatial_index = querying.StationSpatialIndex(stations)
+    assert spatial_index.num_stations == 4
+    # radius query
+    results = spatial_index.within('11.79314', '43.90800', 1000)
+    assert [r[1]['id_staz'] for r in results] == [1, 2]
+    assert results[0][0] < results[1][0] < 1000
+    results = spatial_index.within(11.79314, 43.90708, 2000)
+    assert [r[1]['id_staz'] for r in results] == [1, 2, 3]
+    assert spatial_index.within(10, 40, 1000) == []
+    # nearest neighbour
+    distance, station = spatial_index.nearest(11.79314, 43.916)
+    assert station['id_staz'] == 3
+    assert round(distance) == 120
+    distance, station = spatial_index.nearest(9, 40)
+    assert station['id_staz'] == 4
+    assert querying.StationSpatialIndex([]).nearest(9, 40) == (None, None)
+
+
 def test_find_new_stations():
     dburi = db_utils.DEFAULT_DB_URI
     data_folder = join(TEST_DATA_PATH, 'indicators', 'input')
@@ -57,6 +118,15 @@ def test_find_new_stations():
     assert len(new_stations) == 0
 
 
+def test_scan_stations():
+    data_folder = join(TEST_DATA_PATH, 'indicators', 'input')
+    results = list(querying.scan_stations(data_folder))
+    assert [r[:3] for r in results] == [(0, 1, 2880)]
+    stations = results[0][3]
+    assert list(stations.keys()) == [('00009', '38', '', '')]
+    assert list(querying.scan_stations(data_folder, workers=2)) == results
+
+
 def test_get_stations_by_where():
     dburi = db_utils.DEFAULT_DB_URI
     # no where condition
@@ -5,6 +5,7 @@ import math
 import operator
 
 from sciafeed import checks
+from sciafeed import db_utils
 
 
 def set_row_index(input_data):
@@ -1497,3 +1498,28 @@ def test_check13():
      [1, datetime(2001, 5, 24, 0, 0), Decimal('41'), -31, Decimal('3'), -31, Decimal('14.1'), 1],
      [1, datetime(2001, 5, 25, 0, 0), Decimal('-4'), 1, Decimal('2'), -31, Decimal('14.1'), 1],
     ]
+
+
+def test_checks_on_record_store():
+    records = [
+     [1, datetime(2001, 5, 17, 0, 0), Decimal('0'), 1, Decimal('17.2'), 1],
+     [1, datetime(2001, 5, 18, 0, 0), Decimal('14'), 1, Decimal('0'), 1],
+     [1, datetime(2001, 5, 19, 0, 0), Decimal('16'), 1, None, 1],
+     [1, datetime(2001, 5, 20, 0, 0), Decimal('15.1'), 1, Decimal('21'), -1],
+     [1, datetime(2001, 5, 21, 0, 0), Decimal('-4'), -1, Decimal('3'), 1],
+     [1, datetime(2001, 5, 22, 0, 0), Decimal('-4'), 1, Decimal('2'), 1],
+     [1, datetime(2001, 5, 23, 0, 0), Decimal('40.1'), 1, Decimal('4'), 1],
+     [2, datetime(2001, 5, 24, 0, 0), Decimal('41'), 1, Decimal('3'), 1],
+     [2, datetime(2001, 5, 25, 0, 0), Decimal('-4'), 1, Decimal('2'), 1],
+    ]
+    store = db_utils.RecordStore.from_results(records, batch_size=4)
+    for check, kwargs in [
+        (checks.check11, {'max_diff': 18}),
+        (checks.check12, {}),
+        (checks.check13, {'operators': (max, operator.ge)}),
+    ]:
+        new_records = check(store.view(), **kwargs)
+        assert new_records == check(records, **kwargs)
+        # values are exact
+        assert [type(r[2]) for r in new_records] == [Decimal] * len(records)
+    assert list(store.view()) == records
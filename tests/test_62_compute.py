@@ -1,5 +1,6 @@
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import random
 
 from sciafeed import compute
 
@@ -97,6 +98,31 @@ def test_sum_records_by_hour_groups():
     ]
 
 
+def test_day_bucket():
+    prec_records = create_samples('PREC')
+    temp_records = create_samples('Tmedia', hour_step=2)
+    invalid_records = [
+        (sample_metadata, datetime(2020, 1, 1, 3), 'PREC', None, True),
+        (sample_metadata, datetime(2020, 1, 1, 4), 'PREC', 3, False),
+    ]
+    bucket = compute.DayBucket(temp_records + invalid_records + prec_records)
+    assert bucket.get('PREC') == prec_records
+    assert bucket.get('Tmedia') == temp_records
+    assert isinstance(bucket.get('Tmedia'), compute.ValidRecords)
+    assert bucket.get('UR media') == []
+    assert isinstance(bucket.get('UR media'), compute.ValidRecords)
+    # valid records are not filtered again
+    assert compute.get_valid_records(bucket.get('PREC')) is bucket.get('PREC')
+    assert compute.get_valid_records(invalid_records + prec_records) == prec_records
+    hours_index = compute.records_by_hour(bucket.get('Tmedia'))
+    assert sorted(hours_index) == list(range(0, 24, 2))
+    assert hours_index[4] == [temp_records[2]]
+    assert compute.records_by_hour(bucket.get('Tmedia')) is hours_index
+    # same indicators with or without invalid records
+    assert compute.compute_day_indicators(temp_records + invalid_records + prec_records) == \
+        compute.compute_day_indicators(prec_records + temp_records)
+
+
 def test_wet_distribution():
     day_records = create_samples('PREC')
     res = compute.wet_distribution(day_records)
@@ -1156,3 +1182,89 @@ def test_compute_etp():
     etp = compute.compute_etp(7.2, 13.7, 2, 40.785333, 16)
     assert etp[0] == (None, 1)
     assert etp[1] == 1.2
+
+
+def test_temperature_arrays():
+    random.seed(1)
+    tmax = [round(random.uniform(-10, 40), 1) for _ in range(1000)]
+    tmin = [round(t - random.uniform(0, 20), 1) for t in tmax]
+    lat = [round(random.uniform(36, 47), 5) for _ in range(1000)]
+    days = [date(2019, 1, 1).toordinal() + random.randint(0, 800) for _ in range(1000)]
+
+    jd = compute.day_of_year_array(days)
+    assert jd.tolist() == [int(date.fromordinal(d).strftime('%j')) for d in days]
+
+    etp = compute.round_array(compute.compute_etp_array(tmax, tmin, lat, jd))
+    assert etp == [compute.compute_etp(*args)[1] for args in zip(tmax, tmin, lat, jd.tolist())]
+
+    latitudes = [40.785333, 44.5, 46.1]
+    table = compute.ra_table(latitudes)
+    assert table.shape == (3, 366)
+    for i, lat_value in enumerate(latitudes):
+        for jd_value in (1, 100, 200, 366):
+            ra = compute.extraterrestrial_radiation(lat_value, jd_value)
+            assert round(table[i, jd_value - 1], 6) == round(ra, 6)
+
+    tmedia = [(t1 + t2) / 2 for t1, t2 in zip(tmax, tmin)]
+    grgg = compute.compute_grgg_array(tmedia)
+    assert grgg.shape == (1000, 5)
+    assert grgg.tolist() == [list(compute.compute_grgg(t)[1:]) for t in tmedia]
+
+
+def random_hourly_measures(day, seed):
+    random.seed(seed)
+    measures = []
+    for par_code, values in [('PREC', [0.0, 0.2, 1.0, 5.0, 12.4, 60.2]),
+                             ('Tmedia', [-1.5, 0.0, 10.2, 21.3]),
+                             ('Tmax', [12.1, 25.0]),
+                             ('FF', [0.0, 0.5, 2.1, 3.0, 7.4, 12.0]),
+                             ('DD', [0.0, 10.0, 22.5, 100.1, 337.5, 360.0])]:
+        for hour in range(24):
+            if random.random() < 0.2:
+                continue
+            value = random.choice(values + [round(random.uniform(0, 70), 1)])
+            the_time = datetime(day.year, day.month, day.day, hour)
+            measures.append((sample_metadata, the_time, par_code, value, random.random() > 0.1))
+    return measures
+
+
+def test_compute_hourly_indicators():
+    metadata = sample_metadata
+    days = [date(2020, 1, 1) + timedelta(days=i) for i in range(12)]
+    days_measures = [random_hourly_measures(day, i) for i, day in enumerate(days)]
+    # sub-hourly records
+    days_measures[1] += [
+        (metadata, datetime(2020, 1, 2, 10, 30), par_code, 3.0, True)
+        for par_code in ('PREC', 'FF', 'DD', 'Tmax')]
+    # daily records
+    days_measures[2] = [(metadata, date(2020, 1, 3), par_code, 5.0, True)
+                        for par_code in ('PREC', 'FF', 'DD', 'Tmedia')]
+    # unsorted records
+    days_measures[3].reverse()
+    # FF and DD in the same hour, at different times
+    days_measures[4] = [m for m in days_measures[4] if m[2] != 'DD'] + [
+        (metadata, m[1] + timedelta(minutes=10), 'DD', m[3], m[4])
+        for m in days_measures[4] if m[2] == 'DD']
+    # DD out of [0, 360]
+    days_measures[5].append((metadata, datetime(2020, 1, 6, 23, 30), 'DD', -10.0, True))
+    # integer values
+    days_measures[6] = [m[:3] + (int(m[3]), m[4]) for m in days_measures[6]]
+    # only invalid records
+    days_measures[7] = [m[:4] + (False, ) for m in days_measures[7]]
+    # DD without FF
+    days_measures[8] = [m for m in days_measures[8] if m[2] != 'FF']
+
+    buckets = [compute.DayBucket(day_measures) for day_measures in days_measures]
+    hourly_indicators = compute.compute_hourly_indicators(buckets)
+    for i, bucket in enumerate(buckets):
+        assert compute.compute_bucket_indicators(bucket, hourly_indicators[i]) \
+            == compute.compute_day_indicators(days_measures[i])
+    for i in (0, 9, 10, 11):
+        assert set(hourly_indicators[i]) == {'ds__preci', 'ds__vnt10', 'temperature_flags'}
+    assert set(hourly_indicators[1]) == {'temperature_flags'}
+    assert set(hourly_indicators[3]) == {'temperature_flags'}
+    assert set(hourly_indicators[4]) == {'ds__preci', 'temperature_flags'}
+    assert set(hourly_indicators[5]) == {'ds__preci', 'temperature_flags'}
+    assert set(hourly_indicators[6]) == {'temperature_flags'}
+    assert hourly_indicators[2] == hourly_indicators[7] == {}
+    assert set(hourly_indicators[8]) == {'ds__preci', 'temperature_flags'}
@@ -6,6 +6,7 @@ from os.path import join
 from sciafeed import export
 from sciafeed import querying
 from sciafeed import upsert
+from sciafeed import utils
 
 import pytest
 
@@ -107,6 +108,34 @@ def test_expand_record():
         'tmdgg.val_vr': 'NULL'}
 
 
+def test_encode_composite():
+    for value in [
+        ((24, 1), 11.5, 1.5, None, '2018-01-01 11:00:00'),
+        "((24, 1), 11.5, 1.5, None, '2018-01-01 11:00:00')",
+        '("(24,1)",11.5,1.5,,"2018-01-01 11:00:00")',
+    ]:
+        assert upsert.encode_composite(value) == [
+            '24', '1', '11.5', '1.5', 'NULL', '2018-01-01 11:00:00']
+    assert upsert.encode_composite(((None, None), [3, 4], '')) == [
+        'NULL', 'NULL', '3', '4', 'NULL']
+
+    record = {
+        'data_i': '2018-01-01 00:00:00', 'cod_staz': 12502, 'cod_aggr': '4',
+        'tmxgg': ((24, 1), 11.5, 1.5, 9.7, '2018-01-01T11:00:00'),
+        'tmdgg': ((24, 1), 9.3, None),
+        'tmngg': None,
+    }
+    new_record = upsert.expand_record(record)
+    assert new_record == {
+        'data_i': '2018-01-01 00:00:00', 'cod_staz': 12502, 'cod_aggr': '4',
+        'tmxgg.flag.ndati': '24', 'tmxgg.flag.wht': '1', 'tmxgg.val_md': '11.5',
+        'tmxgg.val_vr': '1.5', 'tmxgg.val_x': '9.7', 'tmxgg.data_x': '2018-01-01T11:00:00',
+        'tmngg.flag.ndati': 'NULL', 'tmngg.flag.wht': 'NULL', 'tmngg.val_md': 'NULL',
+        'tmngg.val_vr': 'NULL', 'tmngg.val_x': 'NULL', 'tmngg.data_x': 'NULL',
+        'tmdgg.flag.ndati': '24', 'tmdgg.flag.wht': '1', 'tmdgg.val_md': '9.3',
+        'tmdgg.val_vr': 'NULL'}
+
+
 def test_expand_fields():
     fields = ['data_i', 'tmxgg', 'bagna', 'cod_staz']
     res = upsert.expand_fields(fields)
@@ -238,6 +267,26 @@ def test_upsert_items(conn):
         None, None, None, None, None, None, None, None, None, None, None, None)
 
 
+def test_split_stations():
+    registry = querying.StationRegistry([
+        {'id_staz': 3, 'nome': 'Alfa', 'cod_rete': 1, 'cod_utente': 'x', 'lat': 44.1,
+         'lon': 11.2},
+        {'id_staz': 4, 'nome': 'Beta', 'cod_rete': 2, 'cod_utente': 'x', 'lat': 44.2,
+         'lon': 11.3},
+    ])
+    stations = [
+        {'nome': 'Alfa', 'cod_rete': '1', 'cod_utente': 'x', 'lat': '44.0'},
+        {'nome': 'Gamma', 'cod_rete': '1', 'cod_utente': 'y', 'lat': None},
+        {'nome': 'Alfa', 'cod_rete': '1', 'cod_utente': 'x', 'lat': '44.1'},
+    ]
+    new_stations, updated_stations, msgs = upsert.split_stations(registry, stations)
+    assert new_stations == [stations[1]]
+    # the last of the repeated stations is considered
+    assert updated_stations == [
+        {'nome': 'Alfa', 'cod_rete': '1', 'cod_utente': 'x', 'lat': '44.1', 'id_staz': 3}]
+    assert msgs == ['updated existing station id_staz=3']
+
+
 def test_choose_main_record():
     records = [
         {'data_i': '2010-01-01 00:00:00', 'cod_staz': 5540, 'cod_aggr': 4,
@@ -273,3 +322,101 @@ def test_choose_main_record():
     }
     chosen = upsert.choose_main_record(records, 'cl_prec24.wet_04')
     assert not chosen
+
+
+class DummyConnection:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, **kwargs):
+        self.executed.append(sql)
+
+
+def execute_upsert_as_sql(conn, table_name, schema, fields, data, policy):
+    """the same of `upsert.execute_upsert`, but executing the SQL of `upsert.create_upsert`"""
+    conn.execute(upsert.create_upsert(table_name, schema, fields, data, policy))
+
+
+def test_expand_typed_record():
+    record = {
+        'data_i': '2018-01-01 00:00:00', 'cod_staz': 12502, 'cod_aggr': 4, 'provenienza': '',
+        'tmxgg': ((24, 1), 11.5, 1.5, 9.7, '2018-01-01T11:00:00'),
+        'tmdgg': ((24, 1), 9.3, None),
+        'tmngg': None,
+    }
+    assert upsert.expand_typed_record(record) == {
+        'data_i': '2018-01-01 00:00:00', 'cod_staz': 12502, 'cod_aggr': 4,
+        'tmxgg.flag.ndati': 24, 'tmxgg.flag.wht': 1, 'tmxgg.val_md': 11.5,
+        'tmxgg.val_vr': 1.5, 'tmxgg.val_x': 9.7, 'tmxgg.data_x': '2018-01-01T11:00:00',
+        'tmdgg.flag.ndati': 24, 'tmdgg.flag.wht': 1, 'tmdgg.val_md': 9.3}
+    # composite values as strings (i.e. from CSV files)
+    record['tmxgg'] = "((24, 1), 11.5, 1.5, 9.7, '2018-01-01T11:00:00')"
+    record['tmdgg'] = '("(24,1)",9.3,)'
+    assert upsert.expand_typed_record(record) == {
+        'data_i': '2018-01-01 00:00:00', 'cod_staz': 12502, 'cod_aggr': 4,
+        'tmxgg.flag.ndati': '24', 'tmxgg.flag.wht': '1', 'tmxgg.val_md': '11.5',
+        'tmxgg.val_vr': '1.5', 'tmxgg.val_x': '9.7', 'tmxgg.data_x': '2018-01-01T11:00:00',
+        'tmdgg.flag.ndati': '24', 'tmdgg.flag.wht': '1', 'tmdgg.val_md': '9.3'}
+
+
+def test_db_writer(tmpdir, monkeypatch):
+    monkeypatch.setattr(upsert, 'execute_upsert', execute_upsert_as_sql)
+    conn = DummyConnection()
+    columns = ['data_i', 'cod_staz', 'cod_aggr', 'tmxgg', 'tmdgg']
+    csv_writers = utils.open_csv_writers(str(tmpdir), {'ds__t200': columns})
+    writers = upsert.open_db_writers(
+        conn, 'aschema', {'ds__t200': columns}, 'upsert', csv_writers, batch_size=2)
+    writer, _ = writers['ds__t200']
+    rows = [
+        {'data_i': '2018-01-01 00:00:00', 'cod_staz': 1, 'cod_aggr': 4,
+         'tmxgg': ((24, 1), 11.5, 1.5, 9.7, '2018-01-01T11:00:00')},
+        {'data_i': '2018-01-01 00:00:00', 'cod_staz': 1, 'cod_aggr': 4,
+         'tmdgg': ((24, 1), 9.3, None)},
+        {'data_i': '2018-01-02 00:00:00', 'cod_staz': 1, 'cod_aggr': 4, 'tmdgg': None},
+        {'data_i': '2018-01-01 00:00:00', 'cod_staz': 2, 'cod_aggr': 4,
+         'tmdgg': ((24, 1), 9.3, 1.1)},
+    ]
+    for row in rows:
+        writer.writerow(row)
+    # rows of the same (station, day) are merged
+    assert len(conn.executed) == 1
+    assert writer.upserted == 2
+    utils.close_csv_writers(writers)
+    assert len(conn.executed) == 2
+    assert writer.upserted == 3
+    fields = upsert.expand_fields(columns)
+    assert conn.executed[0] == upsert.create_upsert('ds__t200', 'aschema', fields, [
+        {'data_i': '2018-01-01 00:00:00', 'cod_staz': 1, 'cod_aggr': 4,
+         'tmxgg.flag.ndati': '24', 'tmxgg.flag.wht': '1', 'tmxgg.val_md': '11.5',
+         'tmxgg.val_vr': '1.5', 'tmxgg.val_x': '9.7', 'tmxgg.data_x': '2018-01-01T11:00:00',
+         'tmdgg.flag.ndati': '24', 'tmdgg.flag.wht': '1', 'tmdgg.val_md': '9.3'},
+        {'data_i': '2018-01-02 00:00:00', 'cod_staz': 1, 'cod_aggr': 4},
+    ], 'upsert')
+    # the rows are also written on the CSV
+    items = export.csv2items(str(tmpdir.join('ds__t200.csv')))
+    assert len(items) == 4
+    assert items[0]['tmxgg'] == "((24, 1), 11.5, 1.5, 9.7, '2018-01-01T11:00:00')"
+
+
+def test_stream_upsert_items(monkeypatch):
+    monkeypatch.setattr(upsert, 'execute_upsert', execute_upsert_as_sql)
+    data_path = join(TEST_DATA_PATH, 'indicators', 'expected', 'ds__t200.csv')
+    assert export.csv_grouped_by_station(data_path)
+    items = export.csv2items(data_path)
+    expected_conn = DummyConnection()
+    expected_upserted = upsert.upsert_items(expected_conn, items, 'upsert', 'aschema', 'ds__t200')
+
+    conn = DummyConnection()
+    items = export.iter_csv_items(data_path)
+    upserted = upsert.stream_upsert_items(
+        conn, items, 'upsert', 'aschema', 'ds__t200', batch_size=expected_upserted)
+    assert upserted == expected_upserted
+    assert conn.executed == expected_conn.executed
+
+    conn = DummyConnection()
+    items = export.iter_csv_items(data_path)
+    upserted = upsert.stream_upsert_items(
+        conn, items, 'upsert', 'aschema', 'ds__t200', batch_size=2)
+    assert upserted == expected_upserted
+    assert len(conn.executed) == -(-upserted // 2)
+    assert upsert.stream_upsert_items(conn, iter([]), 'upsert', 'aschema', 'ds__t200') == 0
@@ -0,0 +1,287 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+import functools
+import itertools
+import math
+import random
+import statistics
+
+from sciafeed import dma
+
+
+def create_t200_rows(stations=(1, 2), start=datetime(2019, 12, 20), days=400, seed=1):
+    """rows of kind [cod_staz, data_i, tmax, tmax_flag, tmin, tmin_flag, tmed, tmed_flag]"""
+    rnd = random.Random(seed)
+    rows = []
+    for station in stations:
+        for i in range(days):
+            day = start + timedelta(days=i)
+            if rnd.random() < 0.05:
+                continue  # missing day
+            tmin = Decimal(rnd.randint(-100, 200)) / 10
+            tmax = tmin + Decimal(rnd.randint(0, 150)) / 10
+            tmed = (tmax + tmin) / 2
+            rows.append([station, day, tmax, rnd.choice([1, 1, 1, -1]),
+                         tmin, rnd.choice([1, 1, 1, None]), tmed, 1])
+    return rows
+
+
+def test_compute_dma_aggregations():
+    rows = create_t200_rows()
+    tmax_record = lambda r: [r[0], r[1], 'tmax', r[2], r[3]]
+    tmin_record = lambda r: [r[0], r[1], 'tmin', r[4], r[5]]
+    aggregators = [
+        ('prs_t200mx', tmax_record, dma.compute_year_records,
+         {'prs_t200mx': dma.compute_prs_t200mx}),
+        ('tmxgg', tmax_record, dma.compute_dma_records,
+         {'tmxgg': dma.compute_tmxgg, 'cl_tmxgg': dma.compute_cl_tmxgg}),
+        ('tmngg', tmin_record, dma.compute_dma_records, {'tmngg': dma.compute_tmngg}),
+    ]
+    results = dma.compute_dma_aggregations(iter(rows), aggregators)
+    assert set(results.keys()) == {'prs_t200mx', 'tmxgg', 'tmngg'}
+
+    def sort_key(item):
+        return item['cod_staz'], item['cod_aggr'], item['data_i']
+    for name, record_funct, compute_funct, map_funct in aggregators:
+        expected = compute_funct([record_funct(r) for r in rows], map_funct=map_funct)
+        assert sorted(results[name], key=sort_key) == sorted(expected, key=sort_key)
+    # 2 stations x (3 years + 14 months + 41 decades)
+    assert len(results['tmxgg']) == 2 * (3 + 14 + 41)
+    assert len(results['prs_t200mx']) == 2 * 3
+
+
+def test_compute_dma_records_mergeable(monkeypatch):
+    rows = create_t200_rows()
+    rnd = random.Random(2)
+    tmax_records = [[r[0], r[1], 'tmax', r[2], r[3]] for r in rows]
+    tmin_records = [[r[0], r[1], 'tmin', r[4], r[5]] for r in rows]
+    tmax_tmin_records = [[r[0], r[1], 'tmax_tmin', [r[2], r[4]], r[3]] for r in rows]
+    prec_records = [[r[0], r[1], 'prec', Decimal(rnd.choice([0, 0, 0, 2, 35, 120])) / 10,
+                     rnd.choice([1, 1, 1, -1])] for r in rows]
+    cases = [
+        (tmax_records, {'tmxgg': dma.compute_tmxgg, 'cl_tmxgg': dma.compute_cl_tmxgg,
+                        'tmdgg': dma.compute_tmdgg, 'day_gelo': dma.compute_day_gelo}),
+        (tmin_records, {'tmngg': dma.compute_tmngg, 'cl_tmngg': dma.compute_cl_tmngg}),
+        # ifs is not mergeable: it is computed on the records of each aggregation
+        (tmax_tmin_records, {'tmdgg1': dma.compute_tmdgg1, 'ifs': dma.compute_ifs,
+                             'deltagg': dma.compute_deltagg}),
+        (prec_records, {'prec24': dma.compute_prec24, 'cl_prec24': dma.compute_cl_prec24}),
+        (tmax_records, {'bagna': dma.compute_bagna, 'elio': dma.compute_elio,
+                        'etp': dma.compute_etp}),
+    ]
+    results = [dma.compute_dma_records(records, map_funct=map_funct)
+               for records, map_funct in cases]
+    # without mergeable aggregations, each decade/month/year is computed on its records
+    monkeypatch.setattr(dma, 'MERGEABLE_AGGREGATIONS', dict())
+    for (records, map_funct), result in zip(cases, results):
+        assert result == dma.compute_dma_records(records, map_funct=map_funct)
+
+
+def test_dma_summary():
+    values = [Decimal('1.5'), Decimal('-2.5'), Decimal('3.0'), Decimal('3.0'), Decimal('0.5')]
+    days = [datetime(2020, 1, i) for i in range(1, 6)]
+    summary1 = dma.DmaSummary(thresholds=[0, 2])
+    summary2 = dma.DmaSummary(thresholds=[0, 2])
+    for value, day in zip(values[:3], days[:3]):
+        summary1.add(value, day)
+    for value, day in zip(values[3:], days[3:]):
+        summary2.add(value, day)
+    summary = summary1.merge(summary2)
+    assert summary.count == 5
+    assert summary.total() == Decimal('5.5')
+    assert summary.mean() == statistics.mean(values)
+    assert summary.stdev() == statistics.stdev(values)
+    assert (summary.mx, summary.mx_day) == (Decimal('3.0'), days[2])
+    assert (summary.mn, summary.mn_day) == (Decimal('-2.5'), days[1])
+    assert summary.negatives == 1
+    assert summary.bins == [1, 2, 2]
+    assert summary.flag(0.75, 6) == (5, 1)
+    assert summary.flag(0.9, 6) == (5, 0)
+
+    # the same results of `statistics` for ints, floats and mixed values
+    rnd = random.Random(1)
+    for values in [
+        [rnd.randint(-5, 50) for _ in range(20)],
+        [round(rnd.uniform(-30, 40), 1) for _ in range(20)],
+        [rnd.random() * 10 ** rnd.randint(-5, 5) for _ in range(20)],
+        [1, 2.5, 3, 4.25],
+    ]:
+        summary = dma.DmaSummary()
+        for value, day in zip(values, itertools.cycle(days)):
+            summary.add(value, day)
+        assert summary.total() == math.fsum(values)
+        assert summary.mean() == statistics.mean(values)
+        assert type(summary.mean()) == type(statistics.mean(values))
+        assert summary.stdev() == statistics.stdev(values)
+
+
+def test_changed_selection():
+    # no changes: no filtering
+    assert dma.changed_selection(None, ['ds__t200'], [1, 2]) == ([1, 2], None, None, None)
+    changes = {
+        'ds__t200': {(1, datetime(2020, 2, 29)), (1, datetime(2020, 2, 3)),
+                     (3, datetime(2019, 12, 15))},
+        'ds__preci': {(2, datetime(2020, 1, 1))},
+    }
+    stations_ids, where_sql, where_params, buckets = dma.changed_selection(
+        changes, ['ds__t200', 'ds__preci'], [1, 2])
+    assert stations_ids == [1, 2]
+    assert where_sql == "(cod_staz, date_part('year', data_i)::integer) IN " \
+                        "(SELECT * FROM unnest(%(changed_stations)s::integer[], " \
+                        "%(changed_years)s::integer[]))"
+    assert where_params == {'changed_stations': [1, 2], 'changed_years': [2020, 2020]}
+    stations_ids, where_sql, where_params, buckets = dma.changed_selection(
+        changes, ['ds__t200'], [1, 2])
+    assert stations_ids == [1]
+    assert where_params == {'changed_stations': [1], 'changed_years': [2020]}
+    assert buckets == {
+        (1, 1, datetime(2020, 2, 10)), (1, 1, datetime(2020, 2, 29)),
+        (1, 2, datetime(2020, 2, 29)), (1, 3, datetime(2020, 12, 31))}
+    assert dma.changed_selection(changes, ['ds__vnt10'], None) == ([], None, None, set())
+
+    # only the affected buckets are kept
+    rows = create_t200_rows()
+    records = [[r[0], r[1], 'tmax', r[2], r[3]] for r in rows]
+    data = dma.compute_dma_records(records, 'tmxgg', dma.compute_tmxgg)
+    filtered = dma.filter_buckets(data, buckets)
+    assert len(filtered) == 4
+    assert dma.filter_buckets(data, None) == data
+
+
+class DummyConnection:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, **kwargs):
+        self.executed.append((sql, kwargs))
+
+
+def test_delete_missing_buckets():
+    rows = create_t200_rows()
+    records = [[r[0], r[1], 'tmax', r[2], r[3]] for r in rows]
+    data = dma.compute_dma_records(records, 'tmxgg', dma.compute_tmxgg)
+    # the records of station 2 of January 2022 were all deleted
+    deleted_buckets = dma.dma_buckets(2, datetime(2022, 1, 5))
+    buckets = set(dma.dma_buckets(1, datetime(2020, 2, 3)) + deleted_buckets)
+    conn = DummyConnection()
+    assert dma.delete_missing_buckets(conn, 'ds__t200', 'aschema', data, None) == 0
+    assert dma.delete_missing_buckets(conn, 'ds__t200', 'aschema', data, buckets, [1]) == 0
+    assert conn.executed == []
+    assert dma.delete_missing_buckets(conn, 'ds__t200', 'aschema', data, buckets) == 3
+    assert conn.executed == [(
+        "DELETE FROM aschema.ds__t200 WHERE provenienza = 'DAILY' AND "
+        "(cod_staz, cod_aggr, data_i) IN (SELECT * FROM unnest(%(missing_stations)s::integer[], "
+        "%(missing_aggrs)s::integer[], %(missing_days)s::timestamp[]))",
+        {'missing_stations': [2, 2, 2], 'missing_aggrs': [1, 2, 3],
+         'missing_days': [datetime(2022, 1, 10), datetime(2022, 1, 31),
+                          datetime(2022, 12, 31)]})]
+
+
+def select_states_in_python(rows, values_indexes):
+    """the same of `dma.select_dma_states` on rows of kind [cod_staz, data_i, values, wht]"""
+    def group_key(row):
+        day = row[1].day
+        return row[0], row[1].year, row[1].month, day <= 10 and 1 or day <= 20 and 2 or 3
+    for key, group_rows in itertools.groupby(rows, group_key):
+        group_rows = [r for r in group_rows if r[3] is not None and r[3] > 0]
+        summaries = [dma.DmaSummary.from_partials(len(group_rows))]
+        for index in values_indexes:
+            values = [r[2][index] for r in group_rows if r[2][index] is not None]
+            if not values:
+                summaries.append(dma.DmaSummary.from_partials(0))
+                continue
+            summaries.append(dma.DmaSummary.from_partials(
+                len(values), sum(values), sum([v * v for v in values]), max(values), min(values)))
+        yield key + (summaries, )
+
+
+def test_compute_dma_records_from_states():
+    rnd = random.Random(3)
+    rows = []
+    for row in create_t200_rows():
+        values = [row[2], row[4], row[6], None, row[2] - row[4]]
+        values = [rnd.random() < 0.1 and None or v for v in values]
+        rows.append([row[0], row[1], values, rnd.choice([1, 1, 1, -1, None])])
+    cases = [
+        ('press', dma.compute_press, [0, 1, 2], dma.finalize_press_states),
+        ('ur', dma.compute_ur, [0, 2, 3], dma.finalize_ur_states),
+        ('grgg', dma.compute_grgg, [0, 1, 2, 3, 4], dma.finalize_grgg_states),
+        ('bagna', dma.compute_bagna, [0], dma.first_value_finalize(dma.finalize_bagna)),
+        ('etp', dma.compute_etp, [1], dma.first_value_finalize(dma.finalize_md_vr_mx_mn)),
+        ('elio', dma.compute_elio, [2], dma.first_value_finalize(dma.finalize_elio)),
+    ]
+    for field, compute_funct, values_indexes, finalize_funct in cases:
+        if len(values_indexes) == 1:
+            records = [[r[0], r[1], field, r[2][values_indexes[0]], r[3]] for r in rows]
+        else:
+            records = [[r[0], r[1], field, r[2], r[3]] for r in rows]
+        expected = dma.compute_dma_records(records, field, compute_funct)
+        states = select_states_in_python(rows, values_indexes)
+        assert dma.compute_dma_records_from_states(states, field, finalize_funct) == expected
+
+
+def test_select_dma_states(conn):
+    # pushdown of the aggregations must give the same results of the python implementation
+    sql_fields = "cod_staz, data_i, 'tmdgg', (tmdgg).val_md, ((tmdgg).flag).wht"
+    table_records = dma.querying.select_records(
+        conn, 'ds__t200', fields=[], sql_fields=sql_fields, schema='test')
+    expected = dma.compute_dma_records(table_records, 'tmdgg', dma.compute_tmdgg)
+    states = dma.select_dma_states(
+        conn, 'ds__t200', 'test', ['(tmdgg).val_md'], '((tmdgg).flag).wht')
+    results = dma.compute_dma_records_from_states(
+        states, 'tmdgg', dma.first_value_finalize(dma.finalize_tmdgg))
+    assert len(results) == len(expected)
+    for result, expected_record in zip(results, expected):
+        assert result == expected_record
+
+
+def test_dma_accumulator():
+    rows = create_t200_rows()
+    tmax_records = [[r[0], r[1], 'tmax', r[2], r[3]] for r in rows]
+    tmin_records = [[r[0], r[1], 'tmin', r[4], r[5]] for r in rows]
+    results = [
+        dma.compute_dma_records(tmax_records, 'tmxgg', dma.compute_tmxgg),
+        dma.compute_dma_records(tmin_records, 'tmngg', dma.compute_tmngg),
+        dma.compute_year_records(tmin_records, 'prs_t200mn', dma.compute_prs_t200mn),
+    ]
+    expected = functools.reduce(dma.merge_data_items, results)
+    accumulator = dma.DmaAccumulator()
+    for records in results:
+        accumulator.add(records)
+    assert len(accumulator) == len(expected)
+    assert accumulator.records() == expected
+    columns = accumulator.columns(['cod_staz', 'prs_t200mn'])
+    assert columns['cod_staz'] == [r['cod_staz'] for r in expected]
+    assert columns['prs_t200mn'] == [r.get('prs_t200mn') for r in expected]
+
+
+def test_compute_bioclimatic_indexes():
+    day = lambda i: datetime(2020, 1, 1) + timedelta(days=i)
+    values = [
+        (Decimal('25.0'), Decimal('57.5')), (Decimal('27.3'), Decimal('50')),
+        (Decimal('19.2'), Decimal('85.0')), (Decimal('3.0'), Decimal('42.5')),
+        (Decimal('-1.0'), Decimal('99.0')), (Decimal('2.0'), Decimal('60.1')),
+        (Decimal('24'), Decimal('62.5')), (None, Decimal('70'))]
+    records = [[1, day(i), 'x', list(v), 1] for i, v in enumerate(values)]
+    assert dma.compute_sharl(records, 10) == ((8, 1), 2, 1, 0)
+    assert dma.compute_ifu1(records, 10) == ((8, 1), 6, 11, 0)
+    assert dma.compute_sharl([], 10) == ((0, 0), 0, 0, 0)
+
+
+def test_compute_persistence():
+    day = lambda i: datetime(2020, 1, 1) + timedelta(days=i)
+    tmax = ['-5', '-6.1', '12', '14.9', '15', '3', '41', '10.5', '11', '12', '-5.0', '0']
+    records = [[1, day(i), 'x', Decimal(v), 1] for i, v in enumerate(tmax)]
+    assert dma.compute_prs_t200mx(records, 12) == [
+        (12, 1), 2, '2020-01-01 00:00:00', 1, '2020-01-12 00:00:00', 1, '2020-01-06 00:00:00',
+        0, None, 3, '2020-01-03 00:00:00', 0, None, 0, None, 0, None, 0, None, 0, None,
+        1, '2020-01-07 00:00:00']
+    assert dma.compute_prs_t200mn(records, 12) == [
+        (12, 1), 0, None, 0, None, 0, None, 2, '2020-01-01 00:00:00', 1, '2020-01-12 00:00:00',
+        1, '2020-01-06 00:00:00', 0, None, 3, '2020-01-03 00:00:00', 1, '2020-01-07 00:00:00']
+    prec = ['0', '0.5', '3', '1', '0', '0', '7.5', '2.5', '0', '12', '1.2', '0', '4', '0']
+    records = [[1, day(i), 'x', Decimal(v), 1] for i, v in enumerate(prec)]
+    assert dma.compute_prs_prec(records, 14) == [
+        (14, 1), 3, '2020-01-04 00:00:00', 2, '2020-01-01 00:00:00', 2, '2020-01-01 00:00:00',
+        2, 10.0, '2020-01-07 00:00:00', 2, 13.2, '2020-01-10 00:00:00',
+        1, 3.0, '2020-01-03 00:00:00'] + [None] * 9
@@ -1,9 +1,13 @@
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
 from os.path import exists, join
 import os
+import random
 
-from sciafeed import process, arpa19, utils
+import pytest
+
+from sciafeed import compute, db_utils, export, process, arpa19, upsert, utils
 
 from . import TEST_DATA_PATH
 
@@ -392,7 +396,149 @@ def test_compute_daily_indicators(conn, tmpdir):
     dumped_result_exp_file = join(TEST_DATA_PATH, 'indicators', 'expected', 'result.txt')
     os.mkdir(indicators_folder)
     computed_indicators = process.compute_daily_indicators(
-        conn, data_folder, indicators_folder)
+        conn, data_folder, indicators_folder, keep_indicators=True)
     with open(dumped_result_exp_file) as fp:
         dumped_result_exp = fp.read()
         assert str(computed_indicators) == dumped_result_exp.strip()
+
+
+def test_compute_temperature_items():
+    random.seed(2)
+    records = []
+    for i in range(500):
+        tmax = Decimal(random.randint(-100, 400)) / 10
+        tmin = tmax - Decimal(random.randint(-10, 200)) / 10
+        lat = random.choice([None, Decimal('40.785333'), Decimal('44.5')])
+        records.append([
+            1 + i % 7, datetime(2019, 1, 1) + timedelta(days=i), lat,
+            random.choice([tmax, None]), random.choice([1, 1, -1]),
+            tmin, 1, None, None])
+    records.sort(key=lambda r: r[0])
+    store = db_utils.RecordStore.from_results(records)
+    temp_items, grgg_items, etp_items = process.compute_temperature_items(store)
+
+    # the per-record Decimal computation
+    exp_temp_items = []
+    exp_grgg_items = []
+    exp_etp_items = []
+    for cod_staz, data_i, lat, tmax, tmax_flag, tmin, tmin_flag, _, _ in records:
+        if tmax is None or tmax_flag <= 0 or tmin is None or tmin_flag <= 0:
+            continue
+        base_item = {'data_i': data_i, 'cod_staz': cod_staz, 'cod_aggr': 4}
+        deltagg = tmax - tmin
+        tmdgg1 = (tmax + tmin) / 2
+        exp_temp_items.append(dict(base_item, **{
+            'tmdgg1.val_md': tmdgg1, 'tmdgg1.flag.wht': 1,
+            'deltagg.val_md': deltagg, 'deltagg.flag.wht': 1}))
+        _, grgg1, grgg2, grgg3, grgg4, grgg5 = compute.compute_grgg(tmdgg1)
+        exp_grgg_items.append(dict(base_item, **{
+            'grgg.flag.wht': 1, 'grgg.tot00': grgg1, 'grgg.tot05': grgg2,
+            'grgg.tot10': grgg3, 'grgg.tot15': grgg4, 'grgg.tot21': grgg5}))
+        if lat is not None and deltagg >= 0:
+            jd = int(data_i.strftime('%j'))
+            etp = compute.compute_etp(tmax, tmin, lat, jd)
+            exp_etp_items.append(dict(base_item, **{'etp.val_md': etp[1], 'etp.flag.wht': 1}))
+    assert len(exp_temp_items) > 100
+    assert len(exp_etp_items) > 50
+
+    def as_decimals(items):
+        return [{k: Decimal(str(v)) if isinstance(v, float) else v for k, v in item.items()}
+                for item in items]
+
+    assert as_decimals(temp_items) == exp_temp_items
+    assert as_decimals(grgg_items) == exp_grgg_items
+    assert etp_items == exp_etp_items
+    assert process.compute_temperature_items(db_utils.RecordStore.from_results([])) == (
+        [], [], [])
+
+
+def test_write_items(monkeypatch):
+    calls = []
+    monkeypatch.setattr(upsert, 'execute_upsert', lambda *args, **kwargs: calls.append(
+        (args, kwargs)))
+    process.write_items('conn', 'aschema', 'ds__t200', [])
+    assert calls == []
+    items = [{'data_i': datetime(2019, 1, 1), 'cod_staz': 1, 'tmdgg1.val_md': 8.2},
+             {'data_i': datetime(2019, 1, 2), 'cod_staz': 1, 'tmdgg1.val_md': 8.25}]
+    process.write_items('conn', 'aschema', 'ds__t200', items, batch_size=1)
+    assert calls == [(
+        ('conn', 'ds__t200', 'aschema', ['data_i', 'cod_staz', 'tmdgg1.val_md'], items,
+         'upsert'), {'page_size': 1})]
+
+
+def test_partition_by_station(tmpdir, monkeypatch):
+    monkeypatch.setattr(process, 'PARTITION_BUFFER_SIZE', 7)
+    data_folder = str(tmpdir.join('data'))
+    os.mkdir(data_folder)
+    input_path = join(TEST_DATA_PATH, 'indicators', 'input',
+                      'loc01_00009_201801010100_201801011000.dat.csv')
+    data = export.csv2data(input_path)
+    other_data = [({**r[0], 'cod_utente': 'other'},) + r[1:] for r in data[:10]]
+    export.export2csv(data[:20] + other_data, join(data_folder, 'file1.csv'))
+    export.export2csv(data[20:], join(data_folder, 'file2.csv'))
+    with open(join(data_folder, 'file3.csv'), 'w') as fp:
+        fp.write('not parsable')
+    # a file with a row not parsable after some partition writes
+    new_station_data = [({**r[0], 'cod_utente': 'new'},) + r[1:] for r in data[:10]]
+    export.export2csv(data[:10] + new_station_data, join(data_folder, 'file4.csv'))
+    with open(join(data_folder, 'file4.csv'), 'a') as fp:
+        fp.write('not;parsable\n')
+    partitions_folder = str(tmpdir.join('partitions'))
+    os.mkdir(partitions_folder)
+    logger = utils.setup_log(str(tmpdir.join('log.txt')))
+
+    partitions = process.partition_by_station(data_folder, partitions_folder, logger)
+    written_data = export.csv2data(join(data_folder, 'file1.csv')) + \
+        export.csv2data(join(data_folder, 'file2.csv'))
+    assert sorted(partitions) == sorted({process.station_key(r) for r in written_data})
+    assert len(partitions) == 2
+    for key, partition_path in partitions.items():
+        station_data = process.load_partition(partition_path)
+        expected_data = [r for r in written_data if process.station_key(r) == key]
+        sort_key = lambda r: (r[1], r[2])
+        assert sorted(station_data, key=sort_key) == sorted(expected_data, key=sort_key)
+
+
+def test_indicators_shards(tmpdir):
+    data_folder = join(TEST_DATA_PATH, 'indicators', 'input')
+    logger = utils.setup_log(str(tmpdir.join('log.txt')))
+    partitions = process.partition_by_station(data_folder, str(tmpdir), logger)
+    partition_path = list(partitions.values())[0]
+    expected_folder = str(tmpdir.join('expected'))
+    os.mkdir(expected_folder)
+    writers = utils.open_csv_writers(expected_folder, compute.INDICATORS_TABLES)
+    expected_indicators = compute.compute_station_indicators(
+        1, process.load_partition(partition_path), writers, compute.INDICATORS_TABLES)
+    utils.close_csv_writers(writers)
+    assert expected_indicators
+
+    shard_folder = str(tmpdir.join('shard'))
+    assert process.run_indicators_task((shard_folder, [(1, partition_path)], None)) == 1
+    with pytest.raises(ValueError):
+        process.compute_daily_indicators(None, data_folder, workers=2, keep_indicators=True)
+    merged_folder = str(tmpdir.join('merged'))
+    os.mkdir(merged_folder)
+    writers = utils.open_csv_writers(merged_folder, compute.INDICATORS_TABLES)
+    process.merge_indicators_shard(shard_folder, writers)
+    utils.close_csv_writers(writers)
+    for table in compute.INDICATORS_TABLES:
+        with open(join(expected_folder, '%s.csv' % table)) as expected_fp, \
+                open(join(merged_folder, '%s.csv' % table)) as merged_fp:
+            assert merged_fp.read() == expected_fp.read()
+
+
+def test_dma_tasks():
+    # sequential
+    tasks = process.dma_tasks([3, 1, 2], 'src', 'dst', 'upsert', 1)
+    assert [t[0] for t in tasks] == list(process.LARGE_DMA_FAMILIES) + [
+        f for f in process.DMA_FAMILIES if f not in process.LARGE_DMA_FAMILIES]
+    assert all(t[1:] == ([3, 1, 2], 'src', 'dst', 'upsert') for t in tasks)
+    # parallel: large families split in batches
+    tasks = process.dma_tasks([5, 3, 1, 2, 4, 1], 'src', 'dst', 'upsert', 2)
+    assert len(tasks) == len(process.DMA_FAMILIES) + len(process.LARGE_DMA_FAMILIES)
+    for family in process.DMA_FAMILIES:
+        family_stations = [t[1] for t in tasks if t[0] == family]
+        if family in process.LARGE_DMA_FAMILIES:
+            assert family_stations == [[1, 2, 3], [4, 5]]
+        else:
+            assert family_stations == [[5, 3, 1, 2, 4, 1]]
@@ -207,3 +207,14 @@ def test_compute_daily_indicators(tmpdir):
             indicators_effective = fp_effective.read()
         with open(join(expected_folder, fname)) as fp_expected:
             assert indicators_effective == fp_expected.read()
+
+
+def test_compute_daily_indicators_usage(tmpdir):
+    runner = CliRunner()
+    data_folder = join(TEST_DATA_PATH, 'indicators', 'input')
+    report_path = str(tmpdir.join('report.txt'))
+    result = runner.invoke(entry_points.compute_daily_indicators,
+                           [data_folder, '-r', report_path])
+    assert result.exit_code == 2
+    assert 'indicators_folder is required (if not --direct)' in result.output
+    assert not exists(report_path)